@@ -1,17 +1,201 @@
 """
-将 PDF 文件转换为 Word 文件
+将 PDF 文件转换为 Word 文件，或直接抽取为 .txt
+- MODE = "txt"（默认，跨平台）：用 pypdf（没有时用 pdfminer.six）直接抽取文本层，
+  写出与 02word_to_txt.py 相同格式的 .txt（每段一行，末尾换行），省去 PDF→DOCX→TXT 两次转换；
+  多进程并行，大 PDF 按页区间拆成多个任务
+- MODE = "docx"：原来的 Word COM 方式（仅 Windows + Office），单进程逐个转换
+- 两种模式都保持子目录结构；源文件未变化且输出已存在时跳过
 """
 import os
-from win32com.client import Dispatch
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pipeline_manifest import Manifest
+from pipeline_metrics import Metrics
 
 # ======= 自己改这里的路径 =======
 INPUT_DIR = r"F:\PhD-item-experment\answer\knowledge\knowledgecode\Code\dataset_processing\pdf"          # 放 PDF 的文件夹
 OUTPUT_DIR = r"F:\PhD-item-experment\answer\knowledge\knowledgecode\Code\dataset_processing\pdf"        # 输出 Word 的文件夹
+TXT_OUTPUT_DIR = r"F:\PhD-item-experment\answer\knowledge\knowledgecode\Code\dataset_processing\wordtxt"  # 输出 .txt 的文件夹（与 02 的输出目录一致）
 # =================================
 
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+# "txt" 直接抽取文本；"docx" 用 Word 转成 .docx 再交给 02
+MODE = "txt"
+# 并行进程数（0 表示自动：CPU 核数）
+WORKERS = 0
+# 每个任务处理的页数；页数更多的 PDF 会拆成多个任务并行抽取
+PAGES_PER_TASK = 50
+
+STAGE = "01pdf_to_word"
+TXT_STAGE = "01pdf_to_txt"
+
+# 段落结束标点：行尾是这些字符时不与下一行合并
+_PARA_END = "。！？；：!?;:…」』”）)"
+
+def _normalize_newlines(text):
+    return (text or "").replace("\r\n", "\n").replace("\r", "\n")
+
+# ================== 文本抽取（在子进程中执行） ==================
+
+def _page_count(pdf_path):
+    try:
+        from pypdf import PdfReader
+        return len(PdfReader(pdf_path).pages)
+    except ImportError:
+        from pdfminer.pdfpage import PDFPage
+        with open(pdf_path, "rb") as f:
+            return sum(1 for _ in PDFPage.get_pages(f))
+
+def extract_pages(pdf_path, start, end):
+    """抽取第 start ~ end-1 页的文本，返回每页文本的列表"""
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        from pdfminer.high_level import extract_text
+        pages = extract_text(pdf_path, page_numbers=list(range(start, end))).split("\f")
+        pages = pages[:end - start] + [""] * (end - start - len(pages))
+        return [_normalize_newlines(p) for p in pages]
+    reader = PdfReader(pdf_path)
+    return [_normalize_newlines(reader.pages[i].extract_text()) for i in range(start, end)]
+
+# ================== 版面还原 ==================
+
+def reflow(pages):
+    """
+    把 PDF 的版面行还原成段落：空行处断开；行尾是句末标点时断开；否则与下一行合并
+    （上一行以英文字符结尾、下一行以英文/数字开头时补一个空格）。返回段落列表。
+    """
+    paragraphs = []
+    current = ""
+    for page in pages:
+        for line in page.split("\n"):
+            line = line.strip()
+            if not line:
+                if current:
+                    paragraphs.append(current)
+                    current = ""
+                continue
+            if not current:
+                current = line
+            elif re.match(r"[A-Za-z0-9(]", line) and re.search(r"[\x21-\x7e]$", current):
+                current += " " + line
+            else:
+                current += line
+            if current.endswith(tuple(_PARA_END)):
+                paragraphs.append(current)
+                current = ""
+    if current:
+        paragraphs.append(current)
+    return paragraphs
+
+def write_txt(paragraphs, txt_path):
+    """与 02word_to_txt._write_blocks 相同的写出格式"""
+    os.makedirs(os.path.dirname(txt_path) or ".", exist_ok=True)
+    with open(txt_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(p for p in paragraphs if p.strip()).strip() + "\n")
+
+def convert_pdf_to_txt(pdf_path, txt_path):
+    """单个 PDF 整体抽取为 txt（pipeline.py 按文件调度时使用），返回 (页数, 段落数)"""
+    n = _page_count(pdf_path)
+    paragraphs = reflow(extract_pages(pdf_path, 0, n))
+    if not paragraphs:
+        print(f"⚠️ 没有文本层（可能是扫描件，需要 OCR）：{pdf_path}")
+    write_txt(paragraphs, txt_path)
+    return n, len(paragraphs)
+
+# ================== 批处理 ==================
+
+def _collect_pdfs(input_dir, output_dir, ext):
+    """保持子目录结构，返回 [(PDF 路径, 输出路径), ...]"""
+    pairs = []
+    for root, dirs, files in os.walk(input_dir):
+        rel_root = os.path.relpath(root, input_dir)
+        out_root = os.path.normpath(os.path.join(output_dir, rel_root))
+        for fname in files:
+            if fname.lower().endswith(".pdf"):
+                pairs.append((os.path.join(root, fname),
+                              os.path.join(out_root, os.path.splitext(fname)[0] + ext)))
+    return pairs
+
+def convert_all_pdfs_to_txt(input_dir, output_dir, workers=WORKERS, pages_per_task=PAGES_PER_TASK, manifest=None,
+                            metrics=None):
+    """并行抽取 input_dir 下全部 PDF 的文本，返回 (成功数, 失败数, 跳过数)"""
+    manifest = manifest or Manifest()
+    own_metrics = metrics is None  # 自己打开的指标文件由自己关闭，调用方传入的留给调用方
+    metrics = metrics or Metrics()
+    pairs = _collect_pdfs(input_dir, output_dir, ".txt")
+    todo = [(src, dst) for src, dst in pairs if not manifest.is_fresh(TXT_STAGE, src, [dst])]
+    skipped = len(pairs) - len(todo)
+    print(f"发现 {len(pairs)} 个 PDF，计划抽取 {len(todo)} 个，跳过已存在 {skipped} 个。")
+
+    ok = fail = 0
+    max_workers = workers if workers and workers > 0 else (os.cpu_count() or 4)
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as ex:
+            # 先并行统计页数，再按页区间拆分任务
+            started = time.perf_counter()
+            counts = {ex.submit(_page_count, src): (src, dst) for src, dst in todo}
+            pending = {}   # src -> {"dst", "pages": [每个区间的结果], "left": 未完成区间数}
+            futures = {}
+            for fut in as_completed(counts):
+                src, dst = counts[fut]
+                try:
+                    n = fut.result()
+                except Exception as e:
+                    print(f"❌ 读取失败：{src}（{e}）")
+                    metrics.event(TXT_STAGE, "file", path=src, ok=False, error=str(e),
+                                  seconds=time.perf_counter() - started, bytes_in=os.path.getsize(src))
+                    fail += 1
+                    continue
+                ranges = [(s, min(s + pages_per_task, n)) for s in range(0, n, pages_per_task)] or [(0, 0)]
+                pending[src] = {"dst": dst, "pages": [None] * len(ranges), "left": len(ranges), "n": n}
+                for i, (s, e) in enumerate(ranges):
+                    futures[ex.submit(extract_pages, src, s, e)] = (src, i)
+
+            for fut in as_completed(futures):
+                src, i = futures[fut]
+                job = pending.get(src)
+                if job is None:
+                    continue  # 该文件的其他区间已失败
+                try:
+                    job["pages"][i] = fut.result()
+                except Exception as e:
+                    print(f"❌ 抽取失败：{src}（{e}）")
+                    metrics.event(TXT_STAGE, "file", path=src, ok=False, error=str(e),
+                                  seconds=time.perf_counter() - started, bytes_in=os.path.getsize(src))
+                    del pending[src]
+                    fail += 1
+                    continue
+                job["left"] -= 1
+                if job["left"]:
+                    continue
+                del pending[src]
+                paragraphs = reflow(p for part in job["pages"] for p in part)
+                if not paragraphs:
+                    print(f"⚠️ 没有文本层（可能是扫描件，需要 OCR）：{src}")
+                write_txt(paragraphs, job["dst"])
+                manifest.record(TXT_STAGE, src, [job["dst"]])
+                # 文件在池中与其他文件交错执行，耗时记为从开始调度到写出完成
+                metrics.event(TXT_STAGE, "file", path=src, seconds=time.perf_counter() - started, pages=job["n"],
+                              records=len(paragraphs), bytes_in=os.path.getsize(src),
+                              bytes_out=os.path.getsize(job["dst"]))
+                ok += 1
+                print(f"✅ {src} → {job['dst']}")
+    finally:
+        manifest.save()
+    print(f"完成：成功 {ok}，失败 {fail}，跳过 {skipped}。")
+    metrics.print_summary()
+    if own_metrics:
+        metrics.close()
+    return ok, fail, skipped
 
 def convert_all_pdfs_to_docx(input_dir, output_dir):
+    # 仅在使用 Word 转换时才需要 pywin32，Linux 上走 txt 模式不会导入
+    from win32com.client import Dispatch
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = Manifest()
+    metrics = Metrics()
     # 打开 Word 程序（不显示窗口）
     word = Dispatch("Word.Application")
     word.Visible = False
@@ -31,24 +215,34 @@ def convert_all_pdfs_to_docx(input_dir, output_dir):
                 base_name = os.path.splitext(fname)[0]
                 out_path = os.path.join(out_root, base_name + ".docx")
 
-                # 如果已经转换过，可以选择跳过
-                if os.path.exists(out_path):
+                # 已转换过且 PDF 未变化则跳过；PDF 有改动会重新转换
+                if manifest.is_fresh(STAGE, in_path, [out_path]):
                     print("已存在，跳过：", out_path)
                     continue
 
                 print("正在转换：", in_path)
 
-                # 打开 PDF（Word 会自动进行“PDF 重排”）
-                # ReadOnly=True 避免修改原文件；ConfirmConversions=False 不弹转换对话框
-                doc = word.Documents.Open(in_path, ReadOnly=True)
+                with metrics.timer(STAGE, path=in_path, bytes_in=os.path.getsize(in_path)) as info:
+                    # 打开 PDF（Word 会自动进行“PDF 重排”）
+                    # ReadOnly=True 避免修改原文件；ConfirmConversions=False 不弹转换对话框
+                    doc = word.Documents.Open(in_path, ReadOnly=True)
 
-                # FileFormat=16 表示 wdFormatDocumentDefault，一般就是 .docx
-                doc.SaveAs(out_path, FileFormat=16)
-                doc.Close()
+                    # FileFormat=16 表示 wdFormatDocumentDefault，一般就是 .docx
+                    doc.SaveAs(out_path, FileFormat=16)
+                    doc.Close()
+                    info["bytes_out"] = os.path.getsize(out_path)
+                manifest.record(STAGE, in_path, [out_path])
     finally:
         # 关闭 Word 进程
         word.Quit()
+        manifest.save()
+        metrics.print_summary()
+        metrics.close()
 
 if __name__ == "__main__":
-    convert_all_pdfs_to_docx(INPUT_DIR, OUTPUT_DIR)
-    print("PDF 转 Word 全部完成！")
+    if MODE == "docx":
+        convert_all_pdfs_to_docx(INPUT_DIR, OUTPUT_DIR)
+        print("PDF 转 Word 全部完成！")
+    else:
+        convert_all_pdfs_to_txt(INPUT_DIR, TXT_OUTPUT_DIR)
+        print("PDF 转 txt 全部完成！")
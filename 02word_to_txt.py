@@ -1,21 +1,40 @@
 """
 批量将 Word(.doc/.docx) 转为 .txt
 - 递归处理目录，保持相对目录结构
-- 并行处理（WORKERS）
+- 并行处理（WORKERS）：线程池，或进程池（EXECUTOR="process"，绕开 GIL，适合 CPU 密集的 docx 解析）
 - 跳过已存在（OVERWRITE=False），或强制覆盖（OVERWRITE=True）
 - 失败不中断
 - 不插入任何分隔符/占位符；图片内容会被忽略
+- 两种 .docx 解析方式（EXTRACTOR）：python-docx 对象遍历，或 lxml 直接流式解析 word/document.xml（输出完全一致，更快、内存有界）
+- .doc 先由 LibreOffice 进程池（soffice_pool.SofficePool）批量转为 .docx，每个实例独立配置目录，崩溃/卡死自动重启
+- 可选的块索引（BLOCKS_SIDECAR=True）：在同一遍解析里，与 .txt 一起写出同名的 .blocks.jsonl，每个段落/表格一行：
+  type（heading / paragraph / table）、level（标题级别，正文为 null）、style（段落样式 ID）、
+  start / end（在 .txt 文本中的字符偏移，换行按 \n 计）、text、rows（仅表格：每行的单元格列表）
+  下游（qa_chunking.load_block_index）按偏移直接切出各块，不必再从纯文本里猜段落、标题与表格的边界
 """
 
 import os
+import re
 import shlex
 import shutil
 import subprocess
+import multiprocessing
+import multiprocessing.connection
+import time
+import zipfile
+from collections import deque
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from docx import Document#解析word内容
 from docx.text.paragraph import Paragraph
+from lxml import etree
+
+from dataset_io import write_records
+from pipeline_manifest import Manifest
+from pipeline_metrics import Metrics
+from qa_chunking import blocks_path_for
+from soffice_pool import SofficePool
 
 # ========== 在这里直接配置路径与参数 ==========
 # 单文件：把 INPUT_PATH 设为某个 .doc/.docx 文件；目录：设为文件夹
@@ -24,10 +43,27 @@ INPUT_PATH  = r"F:\PhD-item-experment\answer\knowledge\knowledgecode\Code\datase
 # 对于目录：OUTPUT_PATH 为输出根目录；为空则默认在输入目录下创建 txt_out/
 OUTPUT_PATH = r"F:\PhD-item-experment\answer\knowledge\knowledgecode\Code\dataset_processing\wordtxt"
 
-# 并行线程数（0 表示自动：min(32, CPU*2)）
+# 并行方式："thread" 线程池；"process" 进程池（docx 解析是 CPU 密集型，多核机器上用进程池）
+EXECUTOR    = "thread"
+# 并行线程/进程数（0 表示自动：线程 min(32, CPU*2)，进程 CPU 核数）
 WORKERS     = 0
-# 是否覆盖已存在的目标文件（默认 False：跳过）
+# 进程池参数：每次投递给子进程的文档数；单个文档超时秒数（None 不限，超时的子进程会被杀掉重启）；
+# 子进程处理多少个文档后退出重建（控制内存增长，None 表示一直复用）
+CHUNKSIZE   = 8
+TASK_TIMEOUT = 300
+MAX_TASKS_PER_CHILD = 500
+# .docx 解析方式："python-docx" 逐个包装为 Paragraph/Table 对象；"lxml" 直接流式解析 XML（表格多时快很多）
+EXTRACTOR   = "lxml"
+# .doc 转换：LibreOffice 实例数；每次交给一个实例的文档数；单个文档超时秒数
+SOFFICE_WORKERS = 2
+SOFFICE_BATCH   = 20
+SOFFICE_TIMEOUT = 120
+# 是否覆盖已存在的目标文件（默认 False：源文件未变化则跳过）
 OVERWRITE   = False
+# 是否同时写出块索引 <同名>.blocks.jsonl（见文件开头说明）；关闭时转换会删掉旧的块索引，避免与新 txt 对不上
+BLOCKS_SIDECAR = False
+
+STAGE = "02word_to_txt"
 
 # ================== 通用工具函数 ==================
 
@@ -43,23 +79,33 @@ def _paragraph_to_text(p) -> str:
             parts.append(r.text)
     return "".join(parts).strip()#用空字符串连接所有片段，并去除首尾空白后返回。
 
-def _table_to_tsv(table) -> str: 
-    """
-    表格输出为纯文本：将表格每行拼成 \t 分隔的字符串，再把各行用 \n 连接
-    """
-    lines = []
+def _table_rows(table) -> list:
+    """表格的单元格文本，按行返回列表的列表"""
+    rows = []
     for row in table.rows:
         cells = []
         for cell in row.cells:
             # 合并单元格内所有段落的文本（已归一化），中间用空格
             txt = " ".join(_norm(p.text) for p in cell.paragraphs if _norm(p.text))
             cells.append(txt)
-        lines.append("\t".join(cells).rstrip())
+        rows.append(cells)
+    return rows
+
+def _rows_to_tsv(rows) -> str:
+    lines = ["\t".join(cells).rstrip() for cells in rows]
     return "\n".join(lines) + "\n" if lines else ""
 
-def docx_to_txt(docx_path: Path, txt_path: Path):
+def _table_to_tsv(table) -> str: 
+    """
+    表格输出为纯文本：将表格每行拼成 \t 分隔的字符串，再把各行用 \n 连接
+    """
+    return _rows_to_tsv(_table_rows(table))
+
+def docx_to_txt(docx_path: Path, txt_path: Path, blocks_path: Path | None = None):
     doc = Document(str(docx_path))#使用 docx 库解析 docx 文件，获取 Document 对象。
     out = []#用于存储转换后的文本内容。
+    records = [] if blocks_path is not None else None#块索引的结构信息，与 out 一一对应
+    levels = _style_levels(doc.styles.element) if records is not None else {}
 
     def iter_block_items(parent):#内部生成器遍历 docx 的段落/表格下的段落或表格。 每个段落或表格都生成一个 Paragraph 或 Table 对象。
         from docx.document import Document as _DocxDocument
@@ -89,21 +135,247 @@ def docx_to_txt(docx_path: Path, txt_path: Path):
             txt = _paragraph_to_text(block) #段落调用 _paragraph_to_text
             if txt: #如果段落有文本内容，就添加到out列表中
                 out.append(txt)
+                if records is not None:
+                    records.append(_paragraph_record(*_xml_paragraph_style(block._p, levels)))
         else:
-            tsv = _table_to_tsv(block) #表格调用 _table_to_tsv
+            rows = _table_rows(block)
+            tsv = _rows_to_tsv(rows) #表格调用 _table_to_tsv
             if _norm(tsv):
                 out.append(tsv.rstrip("\n"))  # 统一在最后统一加换行
+                if records is not None:
+                    records.append(_table_record(rows))
+
+    return _write_blocks(out, txt_path, blocks_path, records)
 
+def _write_blocks(out, txt_path: Path, blocks_path: Path | None = None, records=None):
     # 写出文件（不添加额外分隔符
     #将非空块写入目标 txt，每块之间换行，末尾补换行，并确保输出目录存在。
     #确保输出文件的父目录存在：parents=True 会递归创建所有缺失的父目录；exist_ok=True 表示目录已存在时不报错。
     txt_path.parent.mkdir(parents=True, exist_ok=True)
+    kept = [i for i, s in enumerate(out) if _norm(s)]
+    joined = "\n".join(out[i] for i in kept)
+    body = joined.strip()
     #以 UTF-8 编码打开目标文件用于写入，with 确保写入完成后自动关闭
     with open(txt_path, "w", encoding="utf-8") as f:
         # 段落/表格块之间用换行分隔，末尾补一个换行
-        f.write("\n".join([s for s in out if _norm(s)]).strip() + "\n")
+        f.write(body + "\n")
+    if blocks_path is not None:
+        # 各块在 joined 中的位置减去整体 strip 掉的开头空白，就是在 txt 中的字符偏移
+        lead = len(joined) - len(joined.lstrip())
+        pos = 0
+        index = []
+        for i in kept:
+            start, end = max(0, pos - lead), min(len(body), pos + len(out[i]) - lead)
+            pos += len(out[i]) + 1
+            index.append(dict(records[i], start=start, end=end, text=body[start:end]))
+        write_records(blocks_path, (_ordered_record(r) for r in index))
     return txt_path #返回目标文件路径
 
+# ================== lxml 直接解析 ==================
+# 与上面 python-docx 路径的取值规则逐条对应：
+# - 正文段落：只取 w:p 的直接子 w:r（即 Paragraph.runs），不含超链接内的文字
+# - 单元格段落：取直接子 w:r 与 w:hyperlink 下的 w:r（即 Paragraph.text）
+# - run 文字：w:t 原文，w:tab/w:ptab 为 \t，w:cr 与普通 w:br 为 \n，分页/分栏 w:br 为空，w:noBreakHyphen 为 -
+# - 表格：横向合并按 gridSpan 重复，纵向合并（vMerge=continue）取上一行同一网格位置的单元格
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_R_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_OFFICE_DOCUMENT = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"
+_RUN_CHARS = {_W + "tab": "\t", _W + "ptab": "\t", _W + "cr": "\n", _W + "noBreakHyphen": "-"}
+
+def _run_text(r) -> str:
+    parts = []
+    for child in r:
+        tag = child.tag
+        if tag == _W + "t":
+            parts.append(child.text or "")
+        elif tag == _W + "br":
+            parts.append("\n" if child.get(_W + "type", "textWrapping") == "textWrapping" else "")
+        elif tag in _RUN_CHARS:
+            parts.append(_RUN_CHARS[tag])
+    return "".join(parts)
+
+def _xml_paragraph_runs_text(p) -> str:
+    """等价于 _paragraph_to_text(Paragraph)"""
+    return "".join(_run_text(r) for r in p if r.tag == _W + "r").strip()
+
+def _xml_paragraph_text(p) -> str:
+    """等价于 Paragraph.text（含超链接文字）"""
+    parts = []
+    for child in p:
+        if child.tag == _W + "r":
+            parts.append(_run_text(child))
+        elif child.tag == _W + "hyperlink":
+            parts.extend(_run_text(r) for r in child if r.tag == _W + "r")
+    return "".join(parts)
+
+def _int_val(elem, path, default):
+    found = elem.find(path)
+    if found is None:
+        return default
+    return int(found.get(_W + "val", default))
+
+def _xml_table_to_tsv(tbl) -> str:
+    """等价于 _table_to_tsv(Table)，但每个单元格只解析一次，合并单元格不再二次方遍历"""
+    return _rows_to_tsv(_xml_table_rows(tbl))
+
+def _xml_table_rows(tbl) -> list:
+    """等价于 _table_rows(Table)"""
+    grids = []   # 每行：{网格起始列: w:tc}
+    rows = []
+    text_cache = {}
+
+    def cell_text(tc):
+        key = id(tc)
+        if key not in text_cache:
+            texts = (_norm(_xml_paragraph_text(p)) for p in tc if p.tag == _W + "p")
+            text_cache[key] = " ".join(t for t in texts if t)
+        return text_cache[key]
+
+    def cells_of(row_idx, offset):
+        tc = grids[row_idx][offset]
+        vmerge = tc.find(f"{_W}tcPr/{_W}vMerge")
+        if vmerge is not None and vmerge.get(_W + "val", "continue") == "continue":
+            if row_idx == 0 or offset not in grids[row_idx - 1]:
+                raise ValueError("纵向合并单元格找不到上方单元格")
+            return cells_of(row_idx - 1, offset)
+        return [cell_text(tc)] * _int_val(tc, f"{_W}tcPr/{_W}gridSpan", 1)
+
+    for tr in tbl:
+        if tr.tag != _W + "tr":
+            continue
+        offset = _int_val(tr, f"{_W}trPr/{_W}gridBefore", 0)
+        grid = {}
+        for tc in tr:
+            if tc.tag == _W + "tc":
+                grid[offset] = tc
+                offset += _int_val(tc, f"{_W}tcPr/{_W}gridSpan", 1)
+        grids.append(grid)
+        row_idx = len(grids) - 1
+        cells = []
+        for start in grid:
+            cells.extend(cells_of(row_idx, start))
+        rows.append(cells)
+    return rows
+
+def _main_part_name(zf: zipfile.ZipFile) -> str:
+    """从 _rels/.rels 找正文部件（通常是 word/document.xml）"""
+    try:
+        rels = etree.fromstring(zf.read("_rels/.rels"))
+    except KeyError:
+        return "word/document.xml"
+    for rel in rels:
+        if rel.get("Type") == _OFFICE_DOCUMENT:
+            return rel.get("Target").lstrip("/")
+    return "word/document.xml"
+
+def iter_docx_blocks(docx_path: Path, structure: bool = False):
+    """
+    流式遍历正文顶层块，产出 ("p", 段落文本) 或 ("tbl", 表格 TSV)。
+    structure=True 时多产出一项块索引的结构信息：("p", 段落文本, {type, level, style}) 或 ("tbl", 表格 TSV, {type, rows})
+    每处理完一个顶层块就释放它，内存只与最大的单个块有关。
+    """
+    with zipfile.ZipFile(docx_path) as zf, zf.open(_main_part_name(zf)) as xml:
+        levels = _style_levels(_docx_styles(zf)) if structure else {}
+        for _, elem in etree.iterparse(xml, events=("end",), tag=(_W + "p", _W + "tbl")):
+            body = elem.getparent()
+            if body is None or body.tag != _W + "body":
+                continue  # 单元格内的段落/嵌套表格，由所在的顶层表格处理
+            if elem.tag == _W + "p":
+                text = _xml_paragraph_runs_text(elem)
+                yield ("p", text, _paragraph_record(*_xml_paragraph_style(elem, levels))) if structure else ("p", text)
+            elif structure:
+                rows = _xml_table_rows(elem)
+                yield "tbl", _rows_to_tsv(rows), _table_record(rows)
+            else:
+                yield "tbl", _xml_table_to_tsv(elem)
+            # 释放已处理的块
+            elem.clear()
+            while elem.getprevious() is not None:
+                del body[0]
+
+def docx_to_txt_fast(docx_path: Path, txt_path: Path, blocks_path: Path | None = None):
+    """lxml 直接解析版 docx_to_txt，输出（含块索引）与 docx_to_txt 逐字一致"""
+    out = []
+    records = [] if blocks_path is not None else None
+    for kind, text, *info in iter_docx_blocks(docx_path, structure=records is not None):
+        if kind == "p" and not text or kind == "tbl" and not _norm(text):
+            continue
+        out.append(text if kind == "p" else text.rstrip("\n"))
+        if records is not None:
+            records.append(info[0])
+    return _write_blocks(out, txt_path, blocks_path, records)
+
+# ================== 块索引 ==================
+
+# 内置标题样式名（styles.xml 中为英文小写）与中文版 Word 的样式名
+_HEADING_NAME = re.compile(r"^(?:heading|标题)\s*(\d)$", re.IGNORECASE)
+_TITLE_NAMES = {"title", "标题"}
+_BLOCK_KEYS = ("type", "level", "style", "start", "end", "text", "rows")
+
+def _style_levels(styles) -> dict:
+    """
+    styles.xml 根元素 → {段落样式 ID: 标题级别}，正文样式不在字典里
+    级别取样式（沿 basedOn 继承链）的大纲级别 outlineLvl + 1；没有大纲级别时按样式名 heading N / 标题 N，
+    Title / 标题 记为 0
+    """
+    if styles is None:
+        return {}
+    raw = {}
+    for st in styles.iter(_W + "style"):
+        if st.get(_W + "type") != "paragraph":
+            continue
+        name = st.find(_W + "name")
+        outline = st.find(f"{_W}pPr/{_W}outlineLvl")
+        based = st.find(_W + "basedOn")
+        raw[st.get(_W + "styleId")] = ((name.get(_W + "val") or "").strip().lower() if name is not None else "",
+                                        int(outline.get(_W + "val")) if outline is not None else None,
+                                        based.get(_W + "val") if based is not None else None)
+
+    def level(sid, depth=0):
+        if sid not in raw or depth > 20:
+            return None
+        name, outline, based = raw[sid]
+        if outline is not None:
+            return outline + 1 if outline < 9 else None#9 为正文级别
+        m = _HEADING_NAME.match(name)
+        if m:
+            return int(m.group(1))
+        if name in _TITLE_NAMES:
+            return 0
+        return level(based, depth + 1)
+
+    return {sid: lvl for sid in raw if (lvl := level(sid)) is not None}
+
+def _xml_paragraph_style(p, levels) -> tuple:
+    """段落（w:p）的 (样式 ID, 标题级别)；段落上直接设置的大纲级别优先于样式"""
+    ppr = p.find(_W + "pPr")
+    if ppr is None:
+        return None, None
+    pstyle = ppr.find(_W + "pStyle")
+    sid = pstyle.get(_W + "val") if pstyle is not None else None
+    outline = ppr.find(_W + "outlineLvl")
+    if outline is not None:
+        lvl = int(outline.get(_W + "val"))
+        return sid, (lvl + 1 if lvl < 9 else None)
+    return sid, levels.get(sid)
+
+def _paragraph_record(style, level) -> dict:
+    return {"type": "heading" if level is not None else "paragraph", "level": level, "style": style}
+
+def _table_record(rows) -> dict:
+    return {"type": "table", "level": None, "style": None, "rows": rows}
+
+def _ordered_record(record) -> dict:
+    return {k: record[k] for k in _BLOCK_KEYS if k in record}
+
+def _docx_styles(zf: zipfile.ZipFile):
+    """styles.xml 根元素；没有样式部件时为 None"""
+    try:
+        return etree.fromstring(zf.read("word/styles.xml"))
+    except KeyError:
+        return None
+
 # ================== .doc -> .docx 转换与批处理 ==================
 
 def soffice_convert_to_docx(input_doc: Path) -> Path:
@@ -118,15 +390,22 @@ def soffice_convert_to_docx(input_doc: Path) -> Path:
         raise RuntimeError(proc.stderr or proc.stdout)
     return out_dir / (input_doc.stem + ".docx")
 
+def outputs_for(dst: Path) -> list[Path]:
+    """一个文档的全部产物（登记清单、判断是否需要重新转换用）：txt，开启块索引时再加 .blocks.jsonl"""
+    return [dst, blocks_path_for(dst)] if BLOCKS_SIDECAR else [dst]
+
 def convert_one(src: Path, dst: Path) -> Path:
+    extract = docx_to_txt_fast if EXTRACTOR == "lxml" else docx_to_txt#按配置选择解析方式
     ext = src.suffix.lower()#获取源文件的后缀，并转换为小写。
-    if ext == ".docx":
-        return docx_to_txt(src, dst)#如果后缀是 .docx，直接调用 docx_to_txt 函数进行转换。
-    elif ext == ".doc":
-        docx_path = soffice_convert_to_docx(src)#如果后缀是 .doc，先调用 soffice_convert_to_docx 函数将 .doc 转换为 .docx，再调用 docx_to_txt 函数进行转换。
-        return docx_to_txt(docx_path, dst)
-    else:
+    if ext == ".doc":
+        src = soffice_convert_to_docx(src)#如果后缀是 .doc，先调用 soffice_convert_to_docx 函数将 .doc 转换为 .docx，再解析进行转换。
+    elif ext != ".docx":
         raise ValueError(f"只支持 .docx/.doc：{src}")#如果后缀既不是 .docx 也不是 .doc，抛出 ValueError 异常。
+    blocks_path = blocks_path_for(dst)
+    if not BLOCKS_SIDECAR:
+        blocks_path.unlink(missing_ok=True)#旧的块索引与新 txt 对不上，删掉
+        blocks_path = None
+    return extract(src, dst, blocks_path)
 
 # ---------------- 批量处理核心 ----------------
 
@@ -136,7 +415,7 @@ def collect_inputs(input_path: Path) -> list[Path]:
         return [input_path] if input_path.suffix.lower() in {".docx", ".doc"} else []
     files = []
     for f in input_path.rglob("*"):#递归遍历输入路径下的所有文件，包括子目录
-        if f.is_file() and f.suffix.lower() in {".docx", ".doc"}:
+        if f.is_file() and f.suffix.lower() in {".docx", ".doc"} and "_converted_docx" not in f.parts:#跳过 .doc 转换出的中间文件
             files.append(f)#把符合条件的文件路径加入列表。
     return files#返回所有符合条件的列表
 
@@ -154,10 +433,139 @@ def map_dst(src: Path, in_root: Path, out_root: Path | None, ext: str = ".txt")
 def _safe_convert(src: Path, dst: Path):
     convert_one(src, dst)#调用 convert_one 函数，传入源文件路径和目标文件路径，进行实际的转换操作。
 
+def _timed_convert(src: Path, dst: Path):
+    """线程池任务：返回 (错误信息, 耗时秒数)，错误信息为空表示成功"""
+    start = time.perf_counter()
+    try:
+        _safe_convert(src, dst)
+        return "", time.perf_counter() - start
+    except Exception as e:
+        return str(e) or type(e).__name__, time.perf_counter() - start
+
+# ---------------- 进程池 ----------------
+
+def _process_worker(conn, max_tasks):
+    """子进程：从管道领取一批任务执行，逐个回报开始/结果；处理满 max_tasks 个后退出以便重建。"""
+    done = 0
+    while True:
+        batch = conn.recv()
+        if batch is None:
+            return
+        for task_id, src, dst in batch:
+            conn.send(("start", task_id, ""))
+            try:
+                _safe_convert(src, dst)
+                conn.send(("ok", task_id, ""))
+            except Exception as e:
+                conn.send(("fail", task_id, str(e) or type(e).__name__))
+            done += 1
+        if max_tasks is not None and done >= max_tasks:
+            conn.send(("exit", None, ""))
+            return
+        conn.send(("idle", None, ""))
+
+def run_in_processes(jobs, max_workers, chunksize=CHUNKSIZE, timeout=TASK_TIMEOUT,
+                     max_tasks_per_child=MAX_TASKS_PER_CHILD):
+    """
+    用常驻子进程执行 jobs=[(src, dst), ...]，按完成顺序产出 (下标, 错误信息, 耗时秒数)，错误信息为空表示成功。
+    - 任务按 chunksize 个一批派发，减少进程间通信次数
+    - 子进程复用，处理满 max_tasks_per_child 个后自动退出并补一个新进程
+    - 单个文档超过 timeout 秒仍未完成，杀掉该子进程、记为失败，同批中未完成的任务重新派发
+    - 子进程崩溃（如解析库段错误）同样只影响当前文档
+    """
+    ctx = multiprocessing.get_context()
+    backlog = deque(list(range(i, min(i + chunksize, len(jobs)))) for i in range(0, len(jobs), chunksize))
+    workers = {}   # 父进程端管道 -> {"proc", "batch": 未完成的任务下标, "current": (任务下标, 开始时间)}
+    finished = set()
+
+    def assign(conn):
+        w = workers[conn]
+        if backlog:
+            batch = backlog.popleft()
+            w["batch"] = set(batch)
+            conn.send([(j, *jobs[j]) for j in batch])
+        else:
+            conn.send(None)
+            retire(conn)
+
+    def retire(conn):
+        w = workers.pop(conn)
+        w["proc"].join(timeout=5)
+        conn.close()
+
+    def spawn():
+        parent_conn, child_conn = ctx.Pipe()
+        proc = ctx.Process(target=_process_worker, args=(child_conn, max_tasks_per_child), daemon=True)
+        proc.start()
+        child_conn.close()
+        workers[parent_conn] = {"proc": proc, "batch": set(), "current": None}
+        assign(parent_conn)
+
+    def kill(conn):
+        """终止子进程；当前文档记失败，同批其余未完成的放回队首；返回 (当前文档下标, 耗时)，下标可能为 None"""
+        w = workers.pop(conn)
+        w["proc"].terminate()
+        w["proc"].join()
+        conn.close()
+        current = w["current"][0] if w["current"] else None
+        seconds = time.monotonic() - w["current"][1] if w["current"] else 0.0
+        rest = sorted(w["batch"] - {current} - finished)
+        if rest:
+            backlog.appendleft(rest)
+        if backlog:
+            spawn()
+        return current, seconds
+
+    for _ in range(min(max_workers, len(backlog))):
+        spawn()
+    try:
+        while len(finished) < len(jobs) and workers:
+            for conn in multiprocessing.connection.wait(list(workers), timeout=1):
+                w = workers[conn]
+                try:
+                    kind, task_id, err = conn.recv()
+                except (EOFError, OSError):
+                    current, seconds = kill(conn)
+                    if current is not None and current not in finished:
+                        finished.add(current)
+                        yield current, f"子进程异常退出（exitcode={w['proc'].exitcode}）", seconds
+                    continue
+                if kind == "start":
+                    w["current"] = (task_id, time.monotonic())
+                elif kind in ("ok", "fail"):
+                    seconds = time.monotonic() - w["current"][1] if w["current"] else 0.0
+                    w["current"] = None
+                    w["batch"].discard(task_id)
+                    finished.add(task_id)
+                    yield task_id, err, seconds
+                elif kind == "idle":
+                    assign(conn)
+                elif kind == "exit":
+                    retire(conn)
+                    if backlog:
+                        spawn()
+
+            # 单个文档超时：杀掉子进程并补一个新的
+            if timeout is not None:
+                now = time.monotonic()
+                for conn, w in list(workers.items()):
+                    if w["current"] and now - w["current"][1] > timeout:
+                        current, seconds = kill(conn)
+                        finished.add(current)
+                        yield current, f"超时（>{timeout} 秒），已终止子进程", seconds
+    finally:
+        for conn, w in list(workers.items()):
+            w["proc"].terminate()
+            w["proc"].join()
+            conn.close()
+
 def batch_convert(input_path: Path,
                   output_path: Path | None,
                   workers: int = 0,
-                  overwrite: bool = False):
+                  overwrite: bool = False,
+                  executor: str = "thread",
+                  manifest: Manifest | None = None,
+                  metrics: Metrics | None = None):
     in_path = input_path
     out_root = output_path
 
@@ -165,10 +573,13 @@ def batch_convert(input_path: Path,
     if not files:
         raise FileNotFoundError(f"未找到可处理文件：{input_path}")
 
+    manifest = manifest or Manifest()
+    own_metrics = metrics is None  # 自己打开的指标文件由自己关闭，调用方传入的留给调用方
+    metrics = metrics or Metrics()
     tasks = []
     for src in files:
         dst = map_dst(src, in_path, out_root)#得到每个文件的目标文件.txt路径
-        if not overwrite and dst.exists():#如果没有开启 OVERWRITE 且目标 txt 已存在，就不再重复生成。
+        if not overwrite and manifest.is_fresh(STAGE, src, outputs_for(dst)):#如果没有开启 OVERWRITE 且源文件未变、目标 txt 已存在，就不再重复生成。
             tasks.append(("skip", src, dst, "exists"))
         else:
             dst.parent.mkdir(parents=True, exist_ok=True)#确保目标文件所在的目录已经创建（包括多级新目录），避免写文件时报错。
@@ -181,31 +592,66 @@ def batch_convert(input_path: Path,
     print(f"发现 {total} 个文档，计划转换 {will_run} 个，跳过已存在 {skipped} 个。")
 
     results = []#用于记录每个任务的执行结果
-    #根据用户配置或自动计算最大线程数，避免过多线程导致系统负担过大。
-    max_workers = workers if workers and workers > 0 else min(32, (os.cpu_count() or 4) * 2)
-
-    from concurrent.futures import ThreadPoolExecutor, as_completed
-    with ThreadPoolExecutor(max_workers=max_workers) as ex:#创建线程池
-        futures = {}#用于存储每个任务的 future 对象，方便后续获取结果。
-        for tag, src, dst, note in tasks:#tag：标签 src：源路径 dst：目标txt路径 note：exists说明txt件已存在或"空字符串"目标文件还未转换
-            if tag == "skip":
-                results.append({"src": str(src), "dst": str(dst), "status": "skipped", "error": note})
+    for tag, src, dst, note in tasks:#tag：标签 src：源路径 dst：目标txt路径 note：exists说明txt件已存在或"空字符串"目标文件还未转换
+        if tag == "skip":
+            results.append({"src": str(src), "dst": str(dst), "status": "skipped", "error": note})
+    jobs = [(src, dst) for tag, src, dst, _ in tasks if tag == "run"]
+    origins = {}#解析用的 .docx 路径 -> 原始 .doc 路径
+
+    def finish(src, dst, error, seconds=0.0):
+        src = origins.get(src, src)
+        metrics.event(STAGE, "file", path=str(src), seconds=seconds, ok=not error,
+                      bytes_in=src.stat().st_size if src.exists() else 0,
+                      bytes_out=dst.stat().st_size if not error and dst.exists() else 0,
+                      **({"error": error} if error else {}))
+        if error:
+            results.append({"src": str(src), "dst": str(dst), "status": "fail", "error": error})
+        else:
+            manifest.record(STAGE, src, outputs_for(dst))
+            results.append({"src": str(src), "dst": str(dst), "status": "ok", "error": ""})
+
+    # .doc 先统一交给 LibreOffice 进程池批量转换，避免每个文件单独启动一次 soffice
+    docs = [src for src, _ in jobs if src.suffix.lower() == ".doc"]
+    if docs:
+        print(f"🔄 LibreOffice 批量转换 {len(docs)} 个 .doc（{SOFFICE_WORKERS} 个实例）...")
+        pool = SofficePool(SOFFICE_WORKERS, SOFFICE_BATCH, SOFFICE_TIMEOUT)
+        try:
+            converted = pool.convert_all(docs)
+        finally:
+            pool.close()
+        runnable = []
+        for src, dst in jobs:
+            got = converted.get(src, src)
+            if isinstance(got, Exception):
+                finish(src, dst, str(got) or type(got).__name__)
             else:
-                fut = ex.submit(_safe_convert, src, dst)#对需要执行的任务，将 _safe_convert(src, dst) 提交到线程池
-                futures[fut] = (src, dst)#并在 futures 中保存 Future 与对应的源/目标路径。
-
-        for fut in as_completed(futures):
-            src, dst = futures[fut]
-            try:
-                fut.result()
-                results.append({"src": str(src), "dst": str(dst), "status": "ok", "error": ""})
-            except Exception as e:
-                results.append({"src": str(src), "dst": str(dst), "status": "fail", "error": str(e)})
-
+                origins[got] = src
+                runnable.append((got, dst))
+        jobs = runnable
+
+    if executor == "process":
+        max_workers = workers if workers and workers > 0 else (os.cpu_count() or 4)
+        for idx, error, seconds in run_in_processes(jobs, max_workers):
+            finish(*jobs[idx], error, seconds)
+    else:
+        #根据用户配置或自动计算最大线程数，避免过多线程导致系统负担过大。
+        max_workers = workers if workers and workers > 0 else min(32, (os.cpu_count() or 4) * 2)
+        with ThreadPoolExecutor(max_workers=max_workers) as ex:#创建线程池
+            #对需要执行的任务，将 _safe_convert(src, dst) 提交到线程池，并在 futures 中保存 Future 与对应的源/目标路径。
+            futures = {ex.submit(_timed_convert, src, dst): (src, dst) for src, dst in jobs}
+            for fut in as_completed(futures):
+                src, dst = futures[fut]
+                finish(src, dst, *fut.result())
+
+    manifest.save()
     ok = sum(1 for r in results if r["status"] == "ok")
     fail = sum(1 for r in results if r["status"] == "fail")
     skip = sum(1 for r in results if r["status"] == "skipped")
     print(f"完成：成功 {ok}，失败 {fail}，跳过 {skip}。")
+    metrics.print_summary()
+    if own_metrics:
+        metrics.close()
+    return results
 
 # ---------------- 入口 ----------------
 
@@ -221,4 +667,5 @@ if __name__ == "__main__":
         output_path=out_path,
         workers=WORKERS,
         overwrite=OVERWRITE,
+        executor=EXECUTOR,
     )
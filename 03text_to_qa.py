@@ -4,198 +4,467 @@
 根据文件大小决定生成问答对的数量。
 调用通义千问 API 生成问答对。
 将问答对转换为 Alpaca 格式并保存为 JSON 文件。
-政策问答提示词：
-        prompt = (
-        "您是中文污水处理政策/法规/标准问答生成助手。\n"
-        "任务：\n"
-        f"根据以下文本，生成至少 {qa_count} 个高质量问答对，确保问答内容严格基于文本。\n"
-        "内容范围：\n"
-        "- 适用范围/适用性\n"
-        "- 主要要求\n"
-        "- 指标限​​值/阈值（包括单位和条件）\n"
-        "- 职责/角色\n"
-        "- 实施程序/工作流程（包括报告/记录/验收，如有提及）\n"
-        "规则：\n\n"
-        "1) 请勿添加文本中未提及的信息。如果文本中没有某个细节，请勿推断。\n"
-        "2) 请用中文撰写。\n"
-        '3) 优先选择可检查合规性的问题（例如，"应当/不应当"、"必须/不得"、"限值/阈值"、"监测/采样频率"、"责任方/实体"、"程序步骤/工作流程"）。\n'
-        "4) 避免重复或近似重复；每个问答对应针对不同的条款/要点。\n"
-        "5) 答案务必简洁明了。请完全保留原文中的数字、单位和条件。\n"
-        "输出：\n"
-        "仅返回一个 JSON 数组，例如：\n"
-        "[\n"
-        '{"question":"...", "answer":"..."},\n'
-        "...\n"
-        "]\n"
-        "文本：\n"
-        f"{text}"
-    )
-
-    try:
-        response = dashscope.Generation.call(
-            model='qwen-turbo',
-            messages=[
-                {'role': 'system', 'content': '您是中文污水处理政策/法规/标准问答生成助手。'},#设定模型角色
-                {'role': 'user', 'content': prompt}#用户的内容就是上面构造的prompt
-            ],
-            result_format='message',#指定返回格式为“message”形式（SDK 自己的格式）
-            temperature=0.7,#默认值
-            max_tokens=2048  # 限制模型最大输出长度
-        )#调用通义千问生成接口
+按文件夹/文件名选择提示词配置（运行知识、政策/法规/标准、科研论文、设备维修，见 qa_profiles.py），
+原来写在这里的政策问答提示词现在是其中的 policy 配置。
 """
-import os
 import json
-import chardet
+import threading
 from pathlib import Path
-import dashscope#导入通义千问SDK，用于调用大模型生成问答
+from dataset_io import write_records
+from qa_engine import GenerationEngine, GenerationError, parse_partial_array, describe, estimate_tokens
+from qa_packing import RequestPacker, pack_documents, split_by_doc
+from qa_profiles import PROFILES, ROUTES, get_profile, route
+from llm_backends import make_backend, BatchBackend, BatchDeferred
+from qa_chunking import chunk_text, load_block_index
+from qa_policy import DensityPolicy
+from qa_quality import QualityFilter
+from qa_cache import ResponseCache
+from pipeline_manifest import Manifest
+from pipeline_metrics import Metrics
 
 # 设置你的通义千问 API 密钥，用于认证你调用通义千问API的身份
-dashscope.api_key = 'sk-'  # ←←← 替换为你的密钥
+API_KEY = 'sk-'  # ←←← 替换为你的密钥
 
 # 自定义输出文件夹，创建一个 Path 对象，表示输出 JSON 文件存放的目录。
-OUTPUT_DIR = Path(r"F:\PhD-item-experment\answer\knowledge\knowledgecode\Code\dataset_processing\text_to_qa")  # ←←← 你可以修改为任意路径
-OUTPUT_DIR.mkdir(parents=True, exist_ok=True)#如果目录不存在，创建。如果存在，不报错
-
-"""检测文本文件的编码"""
-def detect_encoding(file_path):
-    with open(file_path, 'rb') as f:#以二进制打开文件，因为chardet需要原始字节
-        raw_data = f.read()#读出全部字节内容
-    result = chardet.detect(raw_data)#用 chardet 检测编码，返回一个字典
+OUTPUT_DIR = Path(r"F:\PhD-item-experment\answer\knowledge\knowledgecode\Code\dataset_processing\text_to_qa")  # ←←← 你可以修改为任意路径（开始生成时自动创建）
+
+# 大模型后端（见 llm_backends.py）：
+# "dashscope" 通义千问 SDK；"openai" 任意 OpenAI 兼容接口（DashScope 兼容模式、本地 vLLM / llama.cpp 等）；
+# "batch" 离线批量任务：第一次运行只排队并提交，批次完成后重跑本脚本取回结果（截断续写会排进下一批）；
+# "fake" 本地模拟，离线测试用
+BACKEND = "dashscope"
+BACKEND_OPTIONS = {
+    "dashscope": {"api_key": API_KEY},
+    "openai": {"base_url": "https://dashscope.aliyuncs.com/compatible-mode/v1", "api_key": API_KEY},
+    "batch": {"base_url": "https://dashscope.aliyuncs.com/compatible-mode/v1", "api_key": API_KEY,
+              "workdir": OUTPUT_DIR / ".qa_batch"},
+    "fake": {"latency": 0.05, "pairs": 5},
+}
+
+# 并发与限流（按账号配额修改）
+CONCURRENCY = 8        # 同时在途的 API 请求数
+RPM_LIMIT = 300        # 每分钟请求数上限，None 表示不限
+TPM_LIMIT = 500000     # 每分钟 token 数上限（输入 + 最大输出），None 表示不限
+
+# 响应缓存：重跑、换模板对比、崩溃重启时已完成的分块不再重复付费
+CACHE_PATH = OUTPUT_DIR / ".qa_cache.sqlite"   # 设为 None 关闭缓存
+CACHE_MAX_BYTES = 2 * 1024 ** 3                # 超过后按最近访问时间淘汰
+
+STAGE = "03text_to_qa"
+
+# 输出格式：".json" 为缩进的 JSON 数组（默认），".jsonl" 为每行一条记录，便于下游流式合并
+OUTPUT_SUFFIX = ".json"
+
+# 分块：长文本按段落/表格边界切成小窗口，每块单独生成问答对
+CHUNK_TOKENS = 3000        # 每块正文的 token 上限
+CHUNK_OVERLAP = 200        # 相邻块重叠的 token 数
+MAX_QA_PER_CHUNK = 15      # 单块问答对上限（max_tokens=2048 大约能容纳的数量）
+
+# 编码检测：先按 UTF-8 严格解码（02 总是写 UTF-8），失败时才让 chardet 逐块查看前 DETECT_BYTES 字节，有把握就停
+DETECT_BYTES = 256 * 1024
+DETECT_CHUNK = 16 * 1024
+
+"""检测文本文件的编码；raw 为已读出的字节时不再读文件"""
+def detect_encoding(file_path, raw=None):
+    if raw is None:
+        with open(file_path, 'rb') as f:#以二进制打开文件，因为chardet需要原始字节
+            raw = f.read(DETECT_BYTES)#只读检测需要的前缀
+    if raw.startswith(b'\xef\xbb\xbf'):
+        return 'utf-8-sig'
+    try:
+        raw.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError as e:
+        if e.start >= len(raw) - 3 and len(raw) >= DETECT_BYTES:
+            return 'utf-8'#只是前缀末尾截断了一个多字节字符
+    import chardet  # 只有非 UTF-8 文件才需要
+    detector = chardet.UniversalDetector()
+    for start in range(0, min(len(raw), DETECT_BYTES), DETECT_CHUNK):
+        detector.feed(raw[start:start + DETECT_CHUNK])
+        if detector.done:#置信度足够，不再往下看
+            break
+    result = detector.close()
     return result['encoding'] or 'utf-8'#取检测到的编码，如果没有检测出来默认utf-8
 
 def read_text(file_path):
-    encoding = detect_encoding(file_path)#先检测文件编码方式
-    with open(file_path, 'r', encoding=encoding, errors='ignore') as f:#按文件编码方式以文本模式r打开文件，把整个文件内容读成一个字符串返回
-        return f.read()
-
-"""根据文件大小决定问答对数量"""
-def decide_qa_count(file_size_bytes):
-    kb = file_size_bytes / 1024
-    if kb < 5:
-        return 5
-    elif kb < 20:
-        return 10
-    elif kb < 50:
-        return 15
-    elif kb < 100:
-        return 20
-    elif kb < 300:
-        return 30
-    elif kb < 600:
-        return 40
-    else:
-        return 50
+    """整个文件只读一次：按检测出的编码解码，换行统一为 \\n（与文本模式读取一致）"""
+    with open(file_path, 'rb') as f:
+        raw = f.read()
+    try:
+        text = raw.decode('utf-8-sig')#快速路径：整个文件严格按 UTF-8 解码成功就不用检测（有无 BOM 都可）
+    except UnicodeDecodeError:
+        encoding = detect_encoding(file_path, raw[:DETECT_BYTES])
+        try:
+            text = raw.decode(encoding, errors='ignore')
+        except LookupError:#chardet 给出了 Python 不认识的编码名
+            text = raw.decode('utf-8', errors='ignore')
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+# 提示词配置（见 qa_profiles.py）：运行知识、政策/法规/标准、科研论文、设备维修四套，各有自己的静态前缀、
+# 系统提示词与并发/token 预算；按 PROFILE_ROUTES 匹配文件夹名选择（含 / 的规则才看文件名），都不匹配时用 DEFAULT_PROFILE。
+# 静态前缀放在最前面，同一配置的所有请求（单篇与合并请求）逐字节相同，让服务端的前缀缓存（上下文缓存）能够命中
+PROFILE_ROUTES = ROUTES
+DEFAULT_PROFILE = "operations"
+# 默认配置的前缀与模板（单篇模板参与缓存键计算）
+PROMPT_PREFIX = PROFILES["operations"].prefix
+PROMPT_TEMPLATE = PROFILES["operations"].template
+PACKED_TEMPLATE = str(PROFILES["operations"].packed)
+# 输出被截断时的续写提示词，{remaining} 为还差的问答对数量
+CONTINUE_PROMPT = (
+    "上一次输出被截断了，上面是已经完整生成的问答对。"
+    "请继续生成另外 {remaining} 个问答对，不要重复上面已有的问题，同样严格基于文本。"
+    "仅返回这 {remaining} 个新问答对组成的 JSON 数组。"
+)
+PACKED_CONTINUE_PROMPT = (
+    "上一次输出被截断了，上面是已经完整生成的问答对。请继续生成：{spec}。"
+    "不要重复上面已有的问题，同样严格基于对应的文本，每个元素用 doc 注明文档编号。"
+    "仅返回这些新问答对组成的 JSON 数组。"
+)
+# 截断后最多续写几次
+MAX_CONTINUATIONS = 2
+SYSTEM_PROMPT = PROFILES["operations"].system
+MODEL = 'qwen-turbo'
+GEN_PARAMS = {'result_format': 'message', 'temperature': 0.7, 'max_tokens': 2048}
+# 质量过滤（见 qa_quality.py）：设为 None 关闭；阈值可传 QualityFilter({"min_overlap": 0.3}) 覆盖
+QUALITY_FILTER = QualityFilter()
+# 被拒问答对的报告目录（子目录，不会被 04 当作数据集读入）
+REJECTED_DIR = OUTPUT_DIR / "_rejected"
+# 问答数量策略（见 qa_policy.py）：DensityPolicy 按去重后的信息量定数量与每块 max_tokens；
+# qa_policy.SizePolicy 为原来按文件字节数分档的做法
+QA_POLICY = DensityPolicy(max_per_chunk=MAX_QA_PER_CHUNK, max_tokens=GEN_PARAMS['max_tokens'])
+# 请求合并（见 qa_packing.py）：不超过 PACK_DOC_TOKENS 的小文本（小文件或小分块）攒成一个请求，
+# 每包最多 PACK_MAX_DOCS 篇、输入加输出预算不超过 PACK_MAX_TOKENS，没攒满时最多等 PACK_LINGER 秒；
+# 合并请求的 max_tokens 为各篇预算之和，不超过 PACK_MAX_OUTPUT。批量后端不合并（每次的分包不同，结果无法对应）
+PACK_REQUESTS = True
+PACK_DOC_TOKENS = 2000
+PACK_MAX_DOCS = 8
+PACK_MAX_TOKENS = 8000
+PACK_MAX_OUTPUT = 4096
+PACK_LINGER = 0.2
+
 """调用通义千问生成问答对
-text：整个文章内容
+text：文章内容（长文本为其中一块）
 qa_count：希望生成的问答对数量
+engine：GenerationEngine，传入时走并发引擎的限流、分类重试与熔断，否则直接调用 SDK
+cache：ResponseCache，命中时不再调用 API
+- 输出被截断（常见于 max_tokens 用满）时，保留已完整的问答对，只请求模型续写剩余的数量
+- 调用最终失败时抛出 GenerationError，由上层把整个文件记为失败（已完成的分块在缓存里，重跑不再付费）
+- 开启请求合并时小文本交给合并器，和其他线程的小文本一起发出；合并结果里一个也没拿到时再单独请求
+profile：提示词配置（名字或 qa_profiles.PromptProfile），默认 DEFAULT_PROFILE；请求受该配置的并发与 token 预算约束
 """
-def generate_qa_pairs(text, qa_count):
-    prompt = (
-        "您是一位负责生成中文污水处理运行知识问答对的助手。\n\n"
-        "任务：\n"
-        f"根据以下文本，生成至少 {qa_count} 个信息丰富、不冗余且严格基于文本的问答对。\n\n"
-        "涵盖范围：\n"
-        "- 定义/概念\n"
-        "- 原理/机制\n"
-        "- 工艺流程/步骤\n"
-        "- 效益/适用性\n"
-        "- 注意事项/限制/安全须知\n"
-        "- 常见问题/故障模式\n"
-        "- 控制策略/故障排除措施\n"
-        "规则：\n"
-        "1) 请勿添加文本中未提及的信息。请勿推断缺失的细节。\n"
-        "2) 请用中文撰写。\n"
-        "3) 优先选择涵盖关键原理和概念的问题，以及具有高度实用性和可操作性的问题（例如，参数、运行条件、程序/步骤、异常情况、可能原因、纠正措施和检查）。\n"
-        "4) 避免重复或近似重复；每个问答对应针对一个不同的要点。\n"
-        "5) 答案应简洁明了。请完全保留文本中的数字、单位和条件。\n"
-        "输出：\n"
-        "仅返回一个 JSON 数组，例如：\n"
-        "[\n"
-        '{"question":"...", "answer":"..."},\n'
-        "...\n"
-        "]\n"
-        "文本：\n"
-        f"{text}"
-    )
+def generate_qa_pairs(text, qa_count, engine=None, cache=None, max_tokens=None, pack=True, profile=None):
+    profile = get_profile(profile or DEFAULT_PROFILE)
+    prompt = profile.render(qa_count, text)
+    params = dict(GEN_PARAMS, max_tokens=profile.budget(max_tokens or GEN_PARAMS['max_tokens']))
 
-    try:
-        response = dashscope.Generation.call(
-            model='qwen-turbo',
-            messages=[
-                {'role': 'system', 'content': 'You are a question-answer pair generation assistant for Chinese wastewater-treatment operational knowledge.'},#设定模型角色
-                {'role': 'user', 'content': prompt}#用户的内容就是上面构造的prompt
-            ],
-            result_format='message',#指定返回格式为“message”形式（SDK 自己的格式）
-            temperature=0.7,#默认值
-            max_tokens=2048  # 限制模型最大输出长度
-        )#调用通义千问生成接口
-        print(response)
+    key = None
+    if cache is not None:
+        key = cache.make_key(MODEL, profile.template, dict(params, system=profile.system, qa_count=qa_count), text)
+        content = cache.get(key)
+        if content is not None:
+            if engine is not None and engine.metrics is not None:
+                engine.metrics.event(STAGE, "cache_hit")
+            return parse_partial_array(content)[0]
+
+    packer = _packer(profile) if pack and engine is not None else None
+    if packer is not None:
+        tokens = estimate_tokens(text)
+        if tokens <= PACK_DOC_TOKENS:
+            qa_list = packer.run((text, qa_count, params['max_tokens']), tokens + params['max_tokens'])
+            if qa_list:
+                if key is not None:
+                    cache.put(key, json.dumps(qa_list, ensure_ascii=False))#合并请求拆回来的结果按单篇的键缓存
+                return qa_list
+
+    call = engine.call if engine else default_backend()
+    messages = [
+        {'role': 'system', 'content': profile.system},#设定模型角色
+        {'role': 'user', 'content': prompt}#用户的内容就是上面构造的prompt
+    ]
+    qa_list = []
+    for attempt in range(MAX_CONTINUATIONS + 1):
+        with profile.limit(estimate_tokens(prompt) + params['max_tokens']):
+            response = call(
+                model=MODEL,
+                messages=messages,
+                **params#result_format='message' 返回SDK自己的格式；temperature=0.7；max_tokens=2048 限制模型最大输出长度
+            )#调用通义千问生成接口；延迟、重试与 usage 由引擎记入指标日志
+        if getattr(response, "status_code", 200) != 200:#不走引擎时 SDK 以状态码返回错误
+            raise GenerationError(describe(response))
         content = response['output']['choices'][0]['message']['content'].strip()#提取通义千问模型实际生成的内容，并去掉首尾空白字符
-        json_start = content.find('[')#找到第一个[的位置
-        json_end = content.rfind(']') + 1#找到最后一个 ] 的位置再加 1
-
-        #取出从第一个[到最后一个]的字串，把这个字符除按解析成python列表，每个元素就是一个字典
-        qa_list = json.loads(content[json_start:json_end])
-        return qa_list#返回问答对列表
-    except Exception as e:
-        print(f"[❌ ERROR] API 调用失败或 JSON 解析错误：{e}")
-        return []
-"""处理一个文件夹里的所有txt文件"""
-def process_folder(input_folder):
-    folder = Path(input_folder)
-    txt_files = list(folder.glob("*.txt"))#所有txt文件路径
-    if not txt_files:
-        print("⚠️ 没有找到 .txt 文件")
-        return
+        items, complete = parse_partial_array(content)
+        qa_list.extend(items if attempt == 0 else items[:qa_count - len(qa_list)])#续写部分只取缺的数量
+        if complete or len(qa_list) >= qa_count:
+            break
+        if not items and attempt == 0 and '[' not in content:
+            print(f"[⚠️ WARN] 输出中没有 JSON 数组：{content[:100]}")
+            return []
+        remaining = qa_count - len(qa_list)
+        if attempt == MAX_CONTINUATIONS:
+            print(f"[⚠️ WARN] 续写 {MAX_CONTINUATIONS} 次后仍不完整，保留已恢复的 {len(qa_list)} 个问答对")
+            break
+        print(f"✂️ 输出被截断，已恢复 {len(qa_list)} 个问答对，续写剩余 {remaining} 个")
+        # 把已恢复的问答对作为助手回复放回对话，只请求剩余部分
+        messages = messages[:2] + [
+            {'role': 'assistant', 'content': json.dumps(qa_list, ensure_ascii=False)},
+            {'role': 'user', 'content': CONTINUE_PROMPT.format(remaining=remaining)},
+        ]
+    if key is not None and qa_list:
+        cache.put(key, json.dumps(qa_list, ensure_ascii=False))#只缓存解析出的问答对
+    return qa_list#返回问答对列表
 
-    for txt_path in txt_files:
-        print(f"\n📄 正在处理: {txt_path.name}")
-        file_size = txt_path.stat().st_size#返回文件大小 30585517B
-        #30585517 字节 ≈ 29868.7 KB，生成 50 个问答对
-        qa_count = decide_qa_count(file_size)#生成的问答对个数
-        print(f"📏 文件大小: {file_size} 字节 ≈ {file_size/1024:.1f} KB，生成 {qa_count} 个问答对")
+"""合并请求：jobs 为 [(文本, 数量, max_tokens), ...]，一次调用为多篇生成问答对
+返回与 jobs 等长的列表，每篇为问答对列表；某篇一个也没拿到时为空列表（generate_qa_pairs 会改为单独请求）
+输出被截断时与单篇一样续写，只请求各篇还缺的数量；一包里的文本都属于同一个提示词配置 profile"""
+def generate_packed(jobs, engine, profile=None):
+    profile = get_profile(profile or DEFAULT_PROFILE)
+    counts = [n for _, n, _ in jobs]
+    prompt = profile.render_packed(len(jobs), _pack_spec(counts), pack_documents([t for t, _, _ in jobs]))
+    params = dict(GEN_PARAMS, max_tokens=min(PACK_MAX_OUTPUT, sum(b for _, _, b in jobs)))
+    messages = [
+        {'role': 'system', 'content': profile.system},
+        {'role': 'user', 'content': prompt}
+    ]
+    got = [[] for _ in jobs]
+    for attempt in range(MAX_CONTINUATIONS + 1):
+        with profile.limit(estimate_tokens(prompt) + params['max_tokens']):
+            response = engine.call(model=MODEL, messages=messages, **params)
+        content = response['output']['choices'][0]['message']['content'].strip()
+        items, complete = parse_partial_array(content)
+        for pairs, new in zip(got, split_by_doc(items, [n - len(g) for n, g in zip(counts, got)])):
+            pairs.extend(new)
+        missing = [n - len(g) for n, g in zip(counts, got)]
+        if complete or not any(missing) or attempt == MAX_CONTINUATIONS:
+            break
+        done = [dict(pair, doc=i) for i, pairs in enumerate(got, 1) for pair in pairs]
+        messages = messages[:2] + [
+            {'role': 'assistant', 'content': json.dumps(done, ensure_ascii=False)},
+            {'role': 'user', 'content': PACKED_CONTINUE_PROMPT.format(spec=_pack_spec(missing))},
+        ]
+    if engine.metrics is not None:
+        engine.metrics.event(STAGE, "pack", docs=len(jobs), pairs=sum(len(g) for g in got), profile=profile.name)
+    return got
 
-        text = read_text(txt_path)#读取文本内容
-        if not text.strip():
-            print("⚠️ 文本内容为空，跳过")
-            continue
+def _pack_spec(counts):
+    return "；".join(f"文档 {i}：{n} 个" for i, n in enumerate(counts, 1) if n > 0)
 
-        qa_pairs = generate_qa_pairs(text, qa_count)#传入全文内容和问答数量，调用通义千问。生成问答对
-        if not qa_pairs:
-            print("⚠️ 没有生成问答对")
-            continue
+# 每个提示词配置一个合并器（前缀不同的文本不能合进同一个请求），首次用到时创建；
+# open_generation 开启合并时设置引擎，close_generation 清空
+_packers = {}
+_pack_engine = None
+_packers_lock = threading.Lock()
+def _packer(profile):
+    engine = _pack_engine
+    if engine is None:
+        return None
+    with _packers_lock:
+        if profile.name not in _packers:
+            _packers[profile.name] = RequestPacker(lambda jobs: generate_packed(jobs, engine, profile),
+                                                   PACK_MAX_DOCS, PACK_MAX_TOKENS, PACK_LINGER)
+        return _packers[profile.name]
 
-        # 转换为 Alpaca 格式
-        alpaca_data = []
-        output_path = OUTPUT_DIR / f"{txt_path.stem}.json"#abc.txt → abc
-        if output_path.exists():
-            print(f"⏩ 已存在转换文件，跳过：{output_path.name}")
-            continue
-        for pair in qa_pairs:#遍历每一个问答对
-            if isinstance(pair, str):
-                try:
-                    pair = json.loads(pair)
-                    print(pair)
-                except json.JSONDecodeError:
-                    print(f"⚠️ 跳过无法解析的问答对：{pair}")
-                    continue
-            if not isinstance(pair, dict):
-                print(f"⚠️ 跳过非字典格式的问答对：{pair}")
+_backend = None
+def default_backend():
+    """按 BACKEND 配置创建的后端，进程内共用一个（长连接池、批量任务目录都只需一份）"""
+    global _backend
+    if _backend is None:
+        _backend = make_backend(BACKEND, **BACKEND_OPTIONS.get(BACKEND, {}))
+    return _backend
+
+"""输出文件名（不含后缀）：root 的子文件夹里的文件加上相对文件夹前缀（a/b/x.txt → a__b__x），
+递归处理时不同文件夹里的同名文件不会写到同一个输出；直接在 root 下或没有 root 时就是文件名本身"""
+def output_stem(txt_path, root=None):
+    if root is not None:
+        try:
+            parts = Path(txt_path).relative_to(root).parent.parts
+        except ValueError:
+            parts = ()
+        if parts:
+            return "__".join(parts + (txt_path.stem,))
+    return txt_path.stem
+
+"""处理单个txt文件，返回生成的问答对数量；传入 metrics 时记录耗时、字节数与问答对数
+profile：提示词配置；不传时按 PROFILE_ROUTES 匹配 root 目录名及其下各级文件夹（没有 root 时为所在文件夹），见 qa_profiles.route"""
+def process_file(txt_path, engine=None, cache=None, manifest=None, metrics=None, profile=None, root=None):
+    profile = get_profile(profile) if profile else route(txt_path, PROFILE_ROUTES, DEFAULT_PROFILE, root)
+    print(f"\n📄 正在处理: {txt_path.name}" + (f"（{profile.name}）" if profile.name != DEFAULT_PROFILE else ""))
+    output_path = OUTPUT_DIR / f"{output_stem(txt_path, root)}{OUTPUT_SUFFIX}"#abc.txt → abc.json / abc.jsonl
+    #先判断是否已生成，避免白白调用 API；有清单时源 txt 变化了也会重新生成
+    if manifest.is_fresh(STAGE, txt_path, [output_path]) if manifest else output_path.exists():
+        print(f"⏩ 已存在转换文件，跳过：{output_path.name}")
+        return 0
+    profile.count_file()
+    if metrics is None:
+        return _generate_file(txt_path, output_path, engine, cache, manifest, {}, profile)
+    with metrics.timer(STAGE, path=str(txt_path), profile=profile.name) as info:
+        return _generate_file(txt_path, output_path, engine, cache, manifest, info, profile)
+
+def _generate_file(txt_path, output_path, engine, cache, manifest, info, profile):
+    file_size = txt_path.stat().st_size#返回文件大小 30585517B
+    info["bytes_in"] = file_size
+
+    text = read_text(txt_path)#读取文本内容
+    if not text.strip():
+        print("⚠️ 文本内容为空，跳过")
+        return 0
+
+    #切块后由策略决定每块的问答数量与 max_tokens，各块并发生成后按原顺序拼接
+    blocks = load_block_index(txt_path, text)#有 02 的块索引时按索引取块，不再从纯文本推断
+    chunks = chunk_text(text, CHUNK_TOKENS, CHUNK_OVERLAP, blocks)
+    policy = profile.policy or QA_POLICY
+    counts, budgets, plan = policy.plan(text, chunks, file_size)
+    info["qa_target"] = plan["target"]
+    print(f"📏 文件大小: {file_size} 字节 ≈ {file_size/1024:.1f} KB，{policy.name} 策略：生成 {plan['target']} 个问答对"
+          + (f"（有效 token {plan['content_tokens']}，不重复句子 {plan['unique_sentences']}/{plan['sentences']}）"
+             if "content_tokens" in plan else ""))
+    jobs = [(i, c, n, t) for i, (c, n, t) in enumerate(zip(chunks, counts, budgets)) if n > 0]
+    print(f"✂️ 切分为 {len(chunks)} 块，其中 {len(jobs)} 块参与生成")
+    results = {}
+    if engine is None:
+        for job in jobs:
+            results[job[0]] = generate_qa_pairs(job[1], job[2], cache=cache, max_tokens=job[3], profile=profile)
+    else:
+        failed = []
+        for job, pairs, error in engine.map(lambda j: generate_qa_pairs(j[1], j[2], engine, cache, j[3], profile=profile), jobs):
+            if error is not None:
+                failed.append(error)
+            results[job[0]] = pairs or []
+        if failed and all(isinstance(e, BatchDeferred) for e in failed):
+            raise BatchDeferred(f"{len(failed)}/{len(jobs)} 块等待批量结果")
+        if failed:
+            # 不写出缺块的结果，也不登记清单：下次重跑时已成功的分块直接命中缓存
+            raise GenerationError(f"{len(failed)}/{len(jobs)} 块生成失败，首个错误：{failed[0]}")
+    qa_pairs = [(i, pair) for i in sorted(results) for pair in results[i]]#带上来源分块的下标，质量过滤要用
+    if not qa_pairs:
+        print("⚠️ 没有生成问答对")
+        return 0
+
+    # 转换为 Alpaca 格式
+    alpaca_data = []
+    source_ids = []
+    for chunk_id, pair in qa_pairs:#遍历每一个问答对
+        if isinstance(pair, str):
+            try:
+                pair = json.loads(pair)
+                print(pair)
+            except json.JSONDecodeError:
+                print(f"⚠️ 跳过无法解析的问答对：{pair}")
                 continue
-            question = pair.get("question", "").strip()#取出question字段并去掉首尾空白
-            answer = pair.get("answer", "").strip()
-            if question and answer:#都非空
-                alpaca_data.append({
-                    "instruction": question,#问题
-                    "input": "",#有些任务会用input传入上下文
-                    "output": answer#答案
-                })
-
-        # 写入 JSON 文件（仅包含问答对列表）
-        with open(output_path, "w", encoding="utf-8") as f:#以写模式、utf-8 编码打开输出文件
-            json.dump(alpaca_data, f, ensure_ascii=False, indent=2)#把alpaca_data写入json文件，保证直接写入中文，缩进2个空格方便阅读
-
-        print(f"✅ 已保存（Alpaca 格式）：{output_path.resolve()}")
+        if not isinstance(pair, dict):
+            print(f"⚠️ 跳过非字典格式的问答对：{pair}")
+            continue
+        question = pair.get("question", "").strip()#取出question字段并去掉首尾空白
+        answer = pair.get("answer", "").strip()
+        if question and answer:#都非空
+            alpaca_data.append({
+                "instruction": question,#问题
+                "input": "",#有些任务会用input传入上下文
+                "output": answer#答案
+            })
+            source_ids.append(chunk_id)
+
+    if QUALITY_FILTER is not None:
+        #批量打分：长度、中文比例、答案与来源分块的重合度、数字单位是否原样保留；被拒的写进报告
+        alpaca_data, rejected = QUALITY_FILTER.split(alpaca_data, chunks, source_ids)
+        info["rejected"] = len(rejected)
+        report = REJECTED_DIR / f"{output_path.stem}.jsonl"
+        if rejected:
+            REJECTED_DIR.mkdir(exist_ok=True)
+            write_records(report, rejected)
+            print(f"🧹 质量过滤拒绝 {len(rejected)} 个问答对，详见 {REJECTED_DIR.name}/{report.name}")
+        elif report.exists():
+            report.unlink()#重新生成后没有被拒的，删掉旧报告
+
+    # 写入 JSON / JSONL 文件（仅包含问答对列表）；.json 与 json.dump(indent=2) 输出一致，保证直接写入中文
+    info["records"] = write_records(output_path, alpaca_data)
+    info["bytes_out"] = output_path.stat().st_size
+
+    if manifest is not None:
+        manifest.record(STAGE, txt_path, [output_path])
+    print(f"✅ 已保存（Alpaca 格式）：{output_path.resolve()}")
+    return len(alpaca_data)
+
+"""创建后端、并发引擎与缓存（process_folder 与 pipeline.py 共用）；批量后端先取回已完成的批次"""
+def open_generation(metrics, concurrency=CONCURRENCY, call_fn=None):
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)#如果目录不存在，创建。如果存在，不报错
+    backend = call_fn or default_backend()
+    batch = isinstance(backend, BatchBackend)
+    if batch:
+        done, running = backend.collect()
+        print(f"📦 批量任务：取回 {done} 个批次，仍在进行 {running} 个，已有结果 {len(backend.results)} 条")
+    # 批量模式只是排队，不占实时配额
+    engine = GenerationEngine(backend,
+                              concurrency=concurrency, rpm=None if batch else RPM_LIMIT, tpm=None if batch else TPM_LIMIT,
+                              metrics=metrics, stage=STAGE)
+    cache = ResponseCache(CACHE_PATH, CACHE_MAX_BYTES) if CACHE_PATH else None
+    global _pack_engine
+    _packers.clear()
+    _pack_engine = engine if PACK_REQUESTS and not batch else None
+    for profile in PROFILES.values():
+        profile.reset_stats()
+    return engine, cache
+
+"""收尾：批量后端提交本轮排队的请求；打印调用、缓存与质量过滤统计并关闭缓存"""
+def close_generation(engine, cache, deferred=0):
+    backend = engine.call_fn
+    if isinstance(backend, BatchBackend):
+        created = backend.submit()
+        if deferred:
+            print(f"📦 本轮新排队 {backend.queued} 个请求，提交批次 {len(created)} 个；{deferred} 个文件等待批量结果，完成后重跑本脚本")
+    print(f"API 调用 {engine.stats['calls']} 次，其中限流 {engine.stats['rate_limited']} 次，"
+          f"重试 {engine.stats['retried']} 次，失败 {engine.stats['failed']} 次。")
+    global _pack_engine
+    items = sum(p.stats["items"] for p in _packers.values())
+    packs = sum(p.stats["packs"] for p in _packers.values())
+    if packs:
+        print(f"📨 请求合并：{items} 段小文本合并为 {packs} 个请求")
+    _packers.clear()
+    _pack_engine = None
+    used = [p for p in PROFILES.values() if p.stats["files"] or p.stats["requests"]]
+    if len(used) > 1 or any(p.name != DEFAULT_PROFILE for p in used):
+        print("🗂️ 提示词配置：" + "，".join(f"{p.name} {p.stats['files']} 个文件 / {p.stats['requests']} 次请求"
+                                        for p in used))
+    if cache is not None:
+        st = cache.stats()
+        print(f"缓存：命中 {st['hits']}，未命中 {st['misses']}，命中率 {st['hit_rate']:.1%}，"
+              f"共 {st['entries']} 条 / {st['bytes']/1024/1024:.1f} MB")
+        cache.close()
+    if QUALITY_FILTER is not None:
+        print(f"🧹 质量过滤：{QUALITY_FILTER.summary()}")
+
+"""处理一个文件夹里的所有txt文件
+多个文件并发生成，整体受 CONCURRENCY / RPM_LIMIT / TPM_LIMIT 约束
+call_fn：替换 BACKEND 配置的后端，例如传入 qa_engine.FakeGeneration() 做离线测试
+批量后端：开始时先取回已完成的批次，结束时把本轮排队的请求打包提交
+recursive：连同子文件夹一起处理（跳过以 _ 或 . 开头的目录），混合语料一次跑完，
+各文件按 PROFILE_ROUTES 匹配所在的各级文件夹名选择提示词配置
+子文件夹里的文件输出为“相对文件夹__文件名”（见 output_stem），同名文件不会互相覆盖
+"""
+def process_folder(input_folder, concurrency=CONCURRENCY, call_fn=None, recursive=False):
+    folder = Path(input_folder)
+    txt_files = sorted(p for p in (folder.rglob("*.txt") if recursive else folder.glob("*.txt"))#所有txt文件路径
+                       if not any(part.startswith(("_", ".")) for part in p.relative_to(folder).parts[:-1]))
+    if not txt_files:
+        print("⚠️ 没有找到 .txt 文件")
+        return
+    metrics = Metrics()
+    engine, cache = open_generation(metrics, concurrency, call_fn)
+    manifest = Manifest()
+    ok = fail = deferred = 0
+    for txt_path, saved, error in engine.map(lambda p: process_file(p, engine, cache, manifest, metrics, root=folder),
+                                               txt_files):
+        if isinstance(error, BatchDeferred):
+            deferred += 1
+        elif error is not None:
+            fail += 1
+            print(f"[❌ ERROR] 处理失败：{txt_path.name}：{error}")
+        elif saved:
+            ok += 1
+    manifest.save()
+    print(f"\n完成：成功 {ok} 个，失败 {fail} 个，共 {len(txt_files)} 个")
+    close_generation(engine, cache, deferred)
+    metrics.print_summary()
+    metrics.close()
 
 if __name__ == "__main__":
     #修改输入文件夹路径
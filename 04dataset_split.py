@@ -1,18 +1,167 @@
 """
-该脚本将 JSON 数据集按不同比例划分为训练集、验证集和测试集。
-根据数据集大小选择不同的划分比例。
-保存划分后的数据集为 JSON 文件。
+该脚本将 JSON 数据集划分为训练集、验证集和测试集。
+两种方式（SPLIT_MODE）：
+- "hash"（默认）：按稳定哈希把每条记录分到 train/val/test，流式单遍处理，
+  直接写出合并后的 train/val/test 三个文件（不再需要 05 合并）；同一条记录无论何时、和哪些新数据一起处理，划分结果都不变。
+  GROUP_BY 决定哈希的键："record" 按归一化后的问答文本（内容相同的问答必定进入同一划分），
+  "source" 按源文件（同一文档生成的问答整体进入同一划分，彻底避免同文档泄漏）
+  近似重复（DEDUP）：与 05 相同，用 qa_dedup.DedupIndex 去掉；先写 test/val、再写 train（输入读两遍，仍是流式），
+  与评估集近似重复的问答从 train 中去掉，避免哈希到不同划分的近似重复把测试集泄漏进训练集
+- "ratio"：原来的方式，按数据集大小选择不同比例，每个源文件各自保存三个 JSON 文件
 """
+import hashlib
 import os
 import json
+import time
+from contextlib import ExitStack
 from pathlib import Path
-from sklearn.model_selection import train_test_split
+
+from dataset_io import iter_records, open_writer, open_appender, JSON_SUFFIXES, NotArrayError
+from pipeline_manifest import Manifest
+from pipeline_metrics import Metrics
+from qa_dedup import DedupIndex, record_text, normalize
 
 INPUT_DIR = r"F:\PhD-item-experment\answer\knowledge\knowledgecode\Code\dataset_processing\text_to_qa\standard"
 OUTPUT_ROOT = r"F:\PhD-item-experment\answer\knowledge\knowledgecode\Code\dataset_processing\datasplit\standard"
-#确保输出目录下有 train / val / test 三个子文件夹
-for subdir in ['train', 'val', 'test']:
-    os.makedirs(os.path.join(OUTPUT_ROOT, subdir), exist_ok=True)
+# hash 方式直接写出合并结果的目录（即 05 的输出目录）
+MERGED_DIR = r"F:\PhD-item-experment\answer\knowledge\knowledgecode\Code\dataset_processing\datasplit\standard-dataset"
+# 输出格式：".json" 为缩进的 JSON 数组，".jsonl" 为每行一条记录
+OUTPUT_SUFFIX = ".json"
+
+SPLIT_MODE = "hash"
+GROUP_BY = "record"
+# train / val / test 比例
+SPLIT_RATIOS = (0.8, 0.1, 0.1)
+# 哈希盐：改动后所有记录会重新洗牌，平时不要改
+SPLIT_SALT = "wwt-qa-split-v1"
+# hash 方式的近似去重（见 qa_dedup.py），索引放在合并结果目录下（与 05 的索引同名同位置）
+DEDUP = True
+DEDUP_INDEX = os.path.join(MERGED_DIR, ".dedup_index.sqlite")
+
+SPLITS = ['train', 'val', 'test']
+
+if SPLIT_MODE == "ratio":
+    #确保输出目录下有 train / val / test 三个子文件夹
+    for subdir in SPLITS:
+        os.makedirs(os.path.join(OUTPUT_ROOT, subdir), exist_ok=True)
+
+STAGE = "04dataset_split"
+HASH_STAGE = "04dataset_split_hash"
+
+# ================== hash 方式 ==================
+
+def assign_split(key, ratios=SPLIT_RATIOS, salt=SPLIT_SALT):
+    """由键的稳定哈希决定划分：哈希映射到 [0, 1)，按比例落在 train / val / test 区间"""
+    digest = hashlib.blake2b(f"{salt}\0{key}".encode("utf-8"), digest_size=8).digest()
+    x = int.from_bytes(digest, "big") / 2 ** 64
+    acc = 0.0
+    for name, ratio in zip(SPLITS, ratios):
+        acc += ratio
+        if x < acc:
+            return name
+    return SPLITS[-1]
+
+def group_key(record, source, group_by=GROUP_BY):
+    """划分用的键：源文件名，或归一化后的问答文本（忽略空白、标点、全半角差异）"""
+    if group_by == "source":
+        return Path(source).stem
+    return normalize(record_text(record))
+
+def _split_records(files, writers, metrics=None, dedup=None, owners=None):
+    """
+    逐条读取 files，按哈希写入对应划分；返回 (各划分新增条数, 读取失败的文件 {文件: 失败前已写出的条数})
+    传入 dedup 时分两遍：第一遍只写 test/val，第二遍只写 train，每条先过近似去重（owners 为各划分登记用的输出名）
+    """
+    counts = dict.fromkeys(SPLITS, 0)
+    passes = [set(SPLITS)] if dedup is None else [{"test", "val"}, {"train"}]
+    stats = {file: {"records": 0, "written": 0, "seconds": 0.0, "error": None} for file in files}
+    for wanted in passes:
+        for file in files:
+            st = stats[file]
+            if st["error"] is not None:
+                continue
+            n = 0
+            start = time.perf_counter()
+            try:
+                for record in iter_records(file):
+                    split = assign_split(group_key(record, file))
+                    if split not in wanted:
+                        continue
+                    n += 1
+                    if dedup is not None and not dedup.check(record, owners[split]):
+                        continue
+                    writers[split].write(record)
+                    counts[split] += 1
+                    st["written"] += 1
+            except NotArrayError as e:
+                st["error"] = str(e)
+                print(f"⚠️ 非数组格式：{file.name} {e}")
+            except Exception as e:
+                st["error"] = str(e)
+                print(f"❌ 加载失败：{file.name} 错误：{e}，已划分 {st['records'] + n} 条")
+            st["records"] += n
+            st["seconds"] += time.perf_counter() - start
+        if dedup is not None:
+            dedup.commit()
+    for file, st in stats.items():
+        if st["error"] is None:
+            print(f"✅ {file.name} 总数: {st['records']}")
+        if metrics is not None:
+            metrics.event(HASH_STAGE, "file", path=str(file), seconds=st["seconds"], records=st["records"],
+                          bytes_in=file.stat().st_size, ok=st["error"] is None,
+                          **({"error": st["error"]} if st["error"] else {}))
+    return counts, {file: st["written"] for file, st in stats.items() if st["error"] is not None}
+
+def hash_split(files, manifest, metrics=None, dedup=None):
+    """
+    流式划分并直接写出合并后的三个文件；输入没变就跳过，只多了新文件就追加
+    dedup：qa_dedup.DedupIndex，去掉近似重复（整体重建时先清掉三个输出之前登记的记录；
+    追加时新记录与已有的全部记录比较，与已写入 train 的记录重复的评估样本也会被去掉）
+    读取失败的文件不登记清单，下次运行会重试；中途失败、已写出部分记录的，不含这些文件整体重建一次，
+    输出里不留半个文件的记录
+    """
+    os.makedirs(MERGED_DIR, exist_ok=True)
+    outputs = {split: Path(MERGED_DIR) / f"{split}{OUTPUT_SUFFIX}" for split in SPLITS}
+    plans = [manifest.plan_merge(HASH_STAGE, out, files) for out in outputs.values()]
+    actions = {action for action, _ in plans}
+    if actions == {"skip"}:
+        print("⏩ 无变化，跳过")
+        return
+    append = actions == {"append"}
+    todo = plans[0][1] if append else files
+    owners = {split: str(out) for split, out in outputs.items()}
+    failed = {}
+    while True:
+        if dedup is not None and not append:
+            for owner in owners.values():
+                dedup.forget(owner)
+        dropped = dedup.dropped if dedup is not None else 0
+        with ExitStack() as stack:
+            opener = open_appender if append else open_writer
+            writers = {split: stack.enter_context(opener(out)) for split, out in outputs.items()}
+            added, errors = _split_records(todo, writers, metrics, dedup, owners)
+        failed.update(errors)
+        partial = [file for file, written in errors.items() if written]
+        if not partial:
+            break
+        print(f"♻️ {len(partial)} 个文件读到一半失败，撤回已写出的记录：不含失败的文件重新划分")
+        append = False
+        todo = [file for file in files if file not in failed]
+    if dedup is not None and dedup.dropped > dropped:
+        print(f"🧹 去掉近似重复 {dedup.dropped - dropped} 条（评估集优先保留）")
+    done = [file for file in files if file not in failed]
+    for split, out in outputs.items():
+        count = added[split] + (manifest.entry(HASH_STAGE, out)["count"] if append else 0)
+        manifest.record_merge(HASH_STAGE, out, done, count)
+        print(f"✅ {out.name} {'新增' if append else '样本数'}: {added[split]}，总数: {count}")
+    if failed:
+        print(f"❌ {len(failed)} 个文件读取失败，未登记清单，下次运行会重试：{', '.join(f.name for f in failed)}")
+
+# ================== ratio 方式 ==================
+
+def split_outputs(base_name):
+    """某个源文件对应的三个划分产物路径"""
+    return [os.path.join(OUTPUT_ROOT, subdir, f'{base_name}.json') for subdir in SPLITS]
 #将数据保存为json文件
 def save_json(data, path):
     with open(path, 'w', encoding='utf-8') as f:
@@ -20,6 +169,8 @@ def save_json(data, path):
 #定义一个函数 split_by_ratio，根据样本数量自动进行 train/val/test 划分，并保存到相应文件。
 def split_by_ratio(data, base_name):
     total = len(data)
+    # 只有这种方式需要 sklearn，用到时再导入
+    from sklearn.model_selection import train_test_split
 
     if total >= 10:
         # 正常 8:1:1 划分
@@ -53,17 +204,50 @@ def split_by_ratio(data, base_name):
     print(f"✅ {base_name}.json 总数: {total} → train={len(train_data)}, val={len(val_data)}, test={len(test_data)}")
 
 def main():
-    files = Path(INPUT_DIR).glob("*.json")#遍历目录中的所有json文件并处理
+    manifest = Manifest()
+    metrics = Metrics()
+    files = [p for p in Path(INPUT_DIR).iterdir() if p.suffix.lower() in JSON_SUFFIXES]#遍历目录中的所有json/jsonl文件并处理
+    if SPLIT_MODE == "hash":
+        os.makedirs(MERGED_DIR, exist_ok=True)
+        dedup = DedupIndex(DEDUP_INDEX) if DEDUP else None
+        try:
+            hash_split(sorted(files), manifest, metrics, dedup)
+        finally:
+            if dedup is not None:
+                dedup.close()
+            manifest.save()
+            metrics.print_summary()
+            metrics.close()
+        return
+    skipped = 0
     for file in files:
-        with open(file, 'r', encoding='utf-8') as f:
-            try:
-                data = json.load(f)#读取并解析json文件内容
-                if isinstance(data, list) and len(data) >= 1:
+        if manifest.is_fresh(STAGE, file, split_outputs(file.stem)):#源文件未变化且三个划分文件都在，跳过
+            skipped += 1
+            continue
+        try:
+            with metrics.timer(STAGE, path=str(file), bytes_in=file.stat().st_size) as info:
+                data = list(iter_records(file))#读取并解析json数组或jsonl文件内容
+                info["records"] = len(data)
+                if len(data) >= 1:
                     split_by_ratio(data, file.stem)#是一个列表并对数据进行划分
+                    manifest.record(STAGE, file, split_outputs(file.stem))
                 else:
-                    print(f"⚠️ 空文件或非数组格式：{file.name}")
-            except Exception as e:
-                print(f"❌ 加载失败：{file.name} 错误：{e}")
+                    print(f"⚠️ 空文件：{file.name}")
+        except NotArrayError as e:
+            print(f"⚠️ 非数组格式：{file.name} {e}")
+        except Exception as e:
+            print(f"❌ 加载失败：{file.name} 错误：{e}")
+
+    # 上游已删除的源文件：同时删除它的划分产物，避免旧数据继续被合并
+    for src, entry in manifest.prune(STAGE, files).items():
+        for out in entry.get("outputs", {}):
+            if os.path.exists(out):
+                os.remove(out)
+        print(f"🗑️ 源文件已删除，清理划分结果：{Path(src).name}")
+    manifest.save()
+    print(f"未变化跳过 {skipped} 个文件")
+    metrics.print_summary()
+    metrics.close()
 
 if __name__ == "__main__":
     main()
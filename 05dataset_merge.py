@@ -1,39 +1,108 @@
 """
 合并指定文件夹下的 JSON 文件
+只用于 04 的 ratio 方式（INPUT_ROOT 下的 train/val/test 子目录）；04 的 hash 方式已直接写出合并结果并完成近似去重，
+不需要再运行本脚本，缺少的子目录会提示后跳过
 """
 import os
-import json
+from contextlib import contextmanager
 from pathlib import Path
 
+from dataset_io import iter_records, open_writer, append_records, JSON_SUFFIXES, NotArrayError
+from pipeline_manifest import Manifest
+from pipeline_metrics import Metrics
+from qa_dedup import DedupIndex
+
 INPUT_ROOT = r"F:\PhD-item-experment\answer\knowledge\knowledgecode\Code\dataset_processing\datasplit\standard"
 OUTPUT_DIR = r"F:\PhD-item-experment\answer\knowledge\knowledgecode\Code\dataset_processing\datasplit\standard-dataset"
+# 输出格式：".json" 为缩进的 JSON 数组（与原先 json.dump(indent=2) 逐字节一致），".jsonl" 为每行一条记录
+OUTPUT_SUFFIX = ".json"
+# 近似去重：合并时用 MinHash/LSH 过滤与已合并记录高度相似的问答对（跨 train/val/test 共用一个索引）
+DEDUP = True
+DEDUP_INDEX = os.path.join(OUTPUT_DIR, ".dedup_index.sqlite")
+
+STAGE = "05dataset_merge"
 
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+def read_file(file):
+    """逐条产出一个输入文件（json 数组或 jsonl）的记录；读取出错时打印并结束，不中断整个合并"""
+    count = 0
+    try:
+        for record in iter_records(file):
+            yield record
+            count += 1
+    except NotArrayError as e:
+        print(f"⚠️ 文件格式错误（{e}）：{file.name}，已合并 {count} 条")
+    except Exception as e:
+        print(f"❌ 读取失败：{file.name} 错误：{e}，已合并 {count} 条")
 
-def merge_json_files(subdir_name):
+def merge_json_files(subdir_name, manifest=None, dedup=None, metrics=None):
+    """逐条从输入读、逐条往输出写，内存占用与数据集大小无关；传入 dedup 时去掉近似重复的问答对"""
     input_path = Path(INPUT_ROOT) / subdir_name
-    merged_data = []
+    output_name = f"{subdir_name}{OUTPUT_SUFFIX}"
+    output_path = Path(OUTPUT_DIR) / output_name
+    if not input_path.is_dir():
+        print(f"⚠️ 没有划分目录 {input_path}，跳过（04 的 hash 方式直接写出合并结果，不需要 05）")
+        return
+    files = [p for p in input_path.iterdir() if p.suffix.lower() in JSON_SUFFIXES]#取下面的所有json/jsonl文件
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    def read(file):
+        records = read_file(file)
+        return dedup.filter(records, str(output_path)) if dedup is not None else records
+
+    # 有清单时增量更新：输入都没变就跳过；只新增了文件就追加到已有结果末尾
+    if manifest is not None:
+        action, todo = manifest.plan_merge(STAGE, output_path, files)
+        if action == "skip":
+            print(f"⏩ 无变化，跳过：{output_name}")
+            return
+        if action == "append":
+            with _timer(metrics, output_path, todo) as info:
+                added = info["records"] = sum(append_records(output_path, read(file)) for file in todo)
+            count = manifest.entry(STAGE, output_path)["count"] + added
+            manifest.record_merge(STAGE, output_path, files, count)
+            print(f"✅ 增量合并完成：{output_name} | 新增文件 {len(todo)} 个，新增样本 {added}，样本总数: {count}")
+            return
 
-    for file in input_path.glob("*.json"):#取下面的所有json文件
-        with open(file, 'r', encoding='utf-8') as f:
-            try:
-                data = json.load(f)
-                if isinstance(data, list):
-                    merged_data.extend(data)#
-                else:
-                    print(f"⚠️ 文件格式错误（不是list）：{file.name}")
-            except Exception as e:
-                print(f"❌ 读取失败：{file.name} 错误：{e}")
+    if dedup is not None:
+        dedup.forget(str(output_path))  # 整体重建：先清掉这个输出之前登记的记录
+    dropped = dedup.dropped if dedup is not None else 0
+    with _timer(metrics, output_path, files) as info:
+        with open_writer(output_path) as writer:
+            for file in files:
+                for record in read(file):
+                    writer.write(record)
+        info["records"] = writer.count
+    if dedup is not None and dedup.dropped > dropped:
+        print(f"🧹 {output_name} 去掉近似重复 {dedup.dropped - dropped} 条")
 
-    output_path = Path(OUTPUT_DIR) / f"{subdir_name}.json"
-    with open(output_path, 'w', encoding='utf-8') as out_f:
-        json.dump(merged_data, out_f, ensure_ascii=False, indent=2)
+    if manifest is not None:
+        manifest.record_merge(STAGE, output_path, files, writer.count)
+    print(f"✅ 合并完成：{output_name} | 样本总数: {writer.count}")
 
-    print(f"✅ 合并完成：{subdir_name}.json | 样本总数: {len(merged_data)}")
+@contextmanager
+def _timer(metrics, output_path, inputs):
+    """有 metrics 时记录一次合并的耗时、读入字节数与输出字节数"""
+    if metrics is None:
+        yield {}
+        return
+    with metrics.timer(STAGE, path=str(output_path), bytes_in=sum(p.stat().st_size for p in inputs)) as info:
+        yield info
+        info["bytes_out"] = output_path.stat().st_size
 
 def main():
-    for split in ['train', 'val', 'test']:
-        merge_json_files(split)
+    manifest = Manifest()
+    metrics = Metrics()
+    dedup = DedupIndex(DEDUP_INDEX) if DEDUP else None
+    try:
+        # 先合并 test/val 再合并 train：与评估集重复的样本从 train 中去掉，避免测试集泄漏到训练集
+        for split in ['test', 'val', 'train']:
+            merge_json_files(split, manifest, dedup, metrics)
+    finally:
+        if dedup is not None:
+            dedup.close()
+        manifest.save()
+        metrics.print_summary()
+        metrics.close()
 
 if __name__ == "__main__":
     main()
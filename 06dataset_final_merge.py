@@ -1,6 +1,11 @@
 import os
-import json
 from pathlib import Path
+
+from dataset_io import iter_records, open_writer, append_records, JSON_SUFFIXES, NotArrayError
+from pipeline_manifest import Manifest
+from pipeline_metrics import Metrics
+from qa_dedup import DedupIndex
+from record_store import pack, STORE_SUFFIX
 """
 合并多个包含 `val.json` 的子目录下的数据。
 """
@@ -13,29 +18,100 @@ SOURCE_DIRS = [
 
 OUTPUT_FILE = r"F:\PhD-item-experment\answer\knowledge\knowledgecode\Code\dataset_processing\final_dataset\val.json"
 #os.makedirs("final_dataset", exist_ok=True)
+# 近似去重：索引放在输出目录下，分别合并 train/val/test 时共用，跨划分去重
+DEDUP = True
+DEDUP_INDEX = os.path.join(os.path.dirname(OUTPUT_FILE), ".dedup_index.sqlite")
+
+# 合并后另存一份 .rstore 记录库（与输出同名同目录），训练数据加载、抽查可按下标直接读取，不用解析整个 JSON
+RECORD_STORE = True
+
+STAGE = "06dataset_final_merge"
+
+def find_split_file(dir_path, split="val"):
+    """来源目录下的 val.json 或 val.jsonl，都没有时返回 None"""
+    for suffix in JSON_SUFFIXES:
+        path = Path(dir_path) / f"{split}{suffix}"
+        if path.exists():
+            return path
+    return None
+
+def merge_trains(source_dirs, output_file, manifest=None, dedup=None):
+    """逐条从各来源读、逐条往 output_file 写；输出格式由后缀决定（.json 与原先 json.dump(indent=2) 逐字节一致）
+    传入 dedup 时去掉与已合并记录近似重复的问答对；返回本次写入的样本数"""
+    inputs = [p for p in (find_split_file(d) for d in source_dirs) if p is not None]
+
+    def read(path):
+        records = iter_records(path)
+        return dedup.filter(records, str(output_file)) if dedup is not None else records
+
+    # 有清单时增量更新：各来源都没变就跳过；只新增了来源就追加到已有结果末尾
+    if manifest is not None:
+        action, todo = manifest.plan_merge(STAGE, output_file, inputs)
+        if action == "skip":
+            print(f"⏩ 无变化，跳过：{output_file}")
+            return 0
+        if action == "append":
+            added = 0
+            for train_path in todo:
+                n = append_records(output_file, read(train_path))
+                added += n
+                print(f"✅ 追加：{train_path}，数量: {n}")
+            count = manifest.entry(STAGE, output_file)["count"] + added
+            manifest.record_merge(STAGE, output_file, inputs, count)
+            print(f"\n✅ 增量合并完成：{output_file}，总计样本数: {count}")
+            return added
+
+    if dedup is not None:
+        dedup.forget(str(output_file))  # 整体重建：先清掉这个输出之前登记的记录
+    with open_writer(output_file) as writer:
+        for dir_path in source_dirs:
+            train_path = find_split_file(dir_path)
+            if train_path is None:
+                print(f"⚠️ 未找到：{Path(dir_path) / 'val.json'}")
+                continue
+            before = writer.count
+            try:
+                for record in read(train_path):
+                    writer.write(record)
+                print(f"✅ 加载：{train_path}，数量: {writer.count - before}")
+            except NotArrayError:
+                print(f"⚠️ 跳过（不是列表格式）：{train_path}")
+            except Exception as e:
+                print(f"❌ 读取失败：{train_path}，错误：{e}，已合并 {writer.count - before} 条")
+
+    print(f"\n✅ 合并完成：{output_file}，总计样本数: {writer.count}")
+    if dedup is not None:
+        print(f"🧹 去掉近似重复 {dedup.dropped} 条")
+    if manifest is not None:
+        manifest.record_merge(STAGE, output_file, inputs, writer.count)
+    return writer.count
+
+def _store_fresh(store, output_file):
+    """记录库已写完且不比合并结果旧时不必重新打包"""
+    meta = Path(store) / "meta.json"
+    return meta.exists() and meta.stat().st_mtime_ns >= os.stat(output_file).st_mtime_ns
+
+def main():
+    manifest = Manifest()
+    metrics = Metrics()
+    dedup = DedupIndex(DEDUP_INDEX) if DEDUP else None
+    try:
+        inputs = [p for p in (find_split_file(d) for d in SOURCE_DIRS) if p is not None]
+        with metrics.timer(STAGE, path=OUTPUT_FILE, bytes_in=sum(p.stat().st_size for p in inputs)) as info:
+            info["records"] = merge_trains(SOURCE_DIRS, OUTPUT_FILE, manifest, dedup)
+            info["bytes_out"] = os.path.getsize(OUTPUT_FILE)
+        store = Path(OUTPUT_FILE).with_suffix(STORE_SUFFIX)
+        if RECORD_STORE and not _store_fresh(store, OUTPUT_FILE):
+            with metrics.timer(STAGE, kind="store", path=str(store), bytes_in=os.path.getsize(OUTPUT_FILE)) as info:
+                info["records"] = pack(OUTPUT_FILE, store)
+            print(f"📦 已打包记录库：{store}")
+    finally:
+        if dedup is not None:
+            dedup.close()
+        manifest.save()
+        metrics.print_summary()
+        metrics.close()
 
-def merge_trains(source_dirs, output_file):
-    all_data = []
-
-    for dir_path in source_dirs:
-        train_path = Path(dir_path) / "val.json"
-        if train_path.exists():
-            with open(train_path, "r", encoding="utf-8") as f:
-                try:
-                    data = json.load(f)
-                    if isinstance(data, list):
-                        all_data.extend(data)
-                        print(f"✅ 加载：{train_path}，数量: {len(data)}")
-                    else:
-                        print(f"⚠️ 跳过（不是列表格式）：{train_path}")
-                except Exception as e:
-                    print(f"❌ 读取失败：{train_path}，错误：{e}")
-        else:
-            print(f"⚠️ 未找到：{train_path}")
-
-    with open(output_file, "w", encoding="utf-8") as f_out:
-        json.dump(all_data, f_out, ensure_ascii=False, indent=2)
-        print(f"\n✅ 合并完成：{output_file}，总计样本数: {len(all_data)}")
-
-# 执行合并
-merge_trains(SOURCE_DIRS, OUTPUT_FILE)
+# 执行合并（导入本模块时不运行，benchmark.py 等可直接调用 merge_trains）
+if __name__ == "__main__":
+    main()
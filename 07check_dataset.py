@@ -1,58 +1,275 @@
+import codecs
 import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from dataset_io import iter_json_array, is_jsonl, NotArrayError
+from pipeline_metrics import Metrics
 
 """
 检查数据集有无问题
-支持两种格式：
+支持三种格式：
 1. 标准 JSON 数组格式（整个文件是一个 JSON 数组）
 2. JSON Lines 格式（每行是一个 JSON 对象）
+3. .rstore 记录库目录（record_store.py 打包的二进制格式）
+- 单遍流式读取，不把整个文件读进内存
+- JSON Lines 按字节区间切分，多进程并行检查；多个文件也一起并行
+- 不在第一处错误停下，收集所有问题（含行号/记录序号）写入报告
+- 严格按 UTF-8 解码，不合法的字节报告字节偏移；顶层是单个对象（不是数组、也不是逐行的记录）的文件报告“不是数组格式”
 """
-def validate_dataset_format(json_path):
-    try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            content = f.read().strip()
-            
-            # 首先尝试作为标准 JSON 数组解析
+
+# 并行进程数（0 表示自动：CPU 核数）
+WORKERS = 0
+# JSON Lines 每个并行区间的字节数
+RANGE_BYTES = 64 * 1024 * 1024
+# 每个文件最多记录多少条错误（None 表示不限）
+MAX_ERRORS = None
+# 报告输出路径（None 表示只打印）
+REPORT_PATH = None
+
+REQUIRED_FIELDS = ["instruction", "output"]
+
+STAGE = "07check_dataset"
+
+def check_record(item):
+    """检查一条记录，返回问题列表（空列表表示通过）"""
+    if not isinstance(item, dict):
+        return ["不是字典格式"]
+    errors = []
+    # 检查必填字段是否存在
+    if not all(key in item for key in REQUIRED_FIELDS):
+        errors.append("缺少必填字段（instruction/output）")
+    # 可选：检查input字段类型（允许为空字符串）
+    if "input" in item and not isinstance(item["input"], str):
+        errors.append("input字段非字符串类型")
+    return errors
+
+def detect_format(path):
+    """
+    目录为 .rstore 记录库；文件根据第一个非空白字符判断格式：[ 开头为 JSON 数组；
+    { 开头且顶层是单个对象时为 "object"（第一行读到行尾仍不完整，即对象跨了多行；或不是 .jsonl 文件、全文只有这一个对象），
+    按“不是数组”报错，与 dataset_io.NotArrayError 一致；其余按 JSON Lines 处理
+    """
+    if os.path.isdir(path):
+        return "store"
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(4096)
+            if not block:
+                return "jsonl"
+            stripped = block.lstrip(b" \t\r\n\xef\xbb\xbf")
+            if stripped:
+                break
+        if stripped[:1] == b"[":
+            return "array"
+        if stripped[:1] != b"{":
+            return "jsonl"
+        f.seek(f.tell() - len(stripped))
+        try:
+            first = f.readline(RANGE_BYTES).decode("utf-8")
+            json.loads(first)
+        except UnicodeDecodeError:
+            return "jsonl"  # 由逐行检查报告解码错误的位置
+        except json.JSONDecodeError as e:
+            # 在行尾之前就出错是这一行本身损坏；一直到行尾都没出错只是不完整，说明对象跨了多行
+            return "object" if e.pos >= len(first.rstrip()) else "jsonl"
+        if is_jsonl(path):
+            return "jsonl"
+        while True:
+            block = f.read(4096)
+            if not block:
+                return "object"
+            if block.strip(b" \t\r\n"):
+                return "jsonl"
+
+def _first_invalid_utf8(path):
+    """第一处不合法的 UTF-8 字节：返回 (字节偏移, 所在行号, 原因)；全文合法时返回 None"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    offset, line = 0, 1
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(1 << 20)
+            pending = decoder.getstate()[0]  # 上一块末尾还没解码完的多字节字符
             try:
-                data = json.loads(content)
-                if isinstance(data, list):
-                    # 标准 JSON 数组格式
-                    print(f"检测到标准 JSON 数组格式，共 {len(data)} 条记录")
-                    for idx, item in enumerate(data):
-                        if not isinstance(item, dict):
-                            raise ValueError(f"第{idx+1}条记录不是字典格式")
-                        # 检查必填字段是否存在
-                        if not all(key in item for key in ["instruction", "output"]):
-                            raise ValueError(f"第{idx+1}条记录缺少必填字段（instruction/output）")
-                        # 可选：检查input字段类型（允许为空字符串）
-                        if "input" in item and not isinstance(item["input"], str):
-                            raise ValueError(f"第{idx+1}条记录input字段非字符串类型")
-                    print("✅ 数据集格式验证通过！")
-                    return True
-                else:
-                    raise ValueError("JSON 内容不是数组格式")
-            except json.JSONDecodeError:
-                # 如果标准 JSON 解析失败，尝试 JSON Lines 格式
-                print("尝试 JSON Lines 格式...")
-                f.seek(0)  # 重置文件指针
-                for idx, line in enumerate(f):
-                    line = line.strip()
-                    if not line:
-                        continue  # 跳过空行
-                    data = json.loads(line)
-                    # 检查必填字段是否存在
-                    if not all(key in data for key in ["instruction", "output"]):
-                        raise ValueError(f"第{idx+1}行缺少必填字段（instruction/output）")
-                    # 可选：检查input字段类型（允许为空字符串）
-                    if "input" in data and not isinstance(data["input"], str):
-                        raise ValueError(f"第{idx+1}行input字段非字符串类型")
-                print("✅ 数据集格式验证通过！")
-                return True
-    except json.JSONDecodeError as e:
-        print(f"❌ JSON解析错误：{e.msg}，位置：第{e.lineno}行第{e.colno}列")
-        return False
+                decoder.decode(block, final=not block)
+            except UnicodeDecodeError as e:
+                return offset - len(pending) + e.start, line + (pending + block).count(b"\n", 0, e.start), e.reason
+            if not block:
+                return None
+            offset += len(block)
+            line += block.count(b"\n")
+
+def _utf8_error(offset, reason):
+    return f"UTF-8 解码错误：{reason}，位置：第{offset}字节"
+
+def _add_error(errors, **err):
+    if MAX_ERRORS is None or len(errors) < MAX_ERRORS:
+        errors.append(err)
+
+# ================== 并行任务（在子进程中执行） ==================
+
+def scan_array(path):
+    """流式检查 JSON 数组文件，返回 (记录数, 错误列表)"""
+    errors = []
+    count = 0
+    with open(path, "r", encoding="utf-8-sig") as f:
+        try:
+            for line, item in iter_json_array(f, with_lines=True):
+                count += 1
+                for msg in check_record(item):
+                    _add_error(errors, line=line, record=count, error=msg)
+        except NotArrayError as e:
+            _add_error(errors, line=1, record=None, error=str(e))
+        except json.JSONDecodeError as e:
+            # 语法错误之后无法可靠地继续解析
+            _add_error(errors, line=e.lineno, record=count + 1, error=f"JSON解析错误：{e.msg}，位置：第{e.lineno}行第{e.colno}列")
+        except UnicodeDecodeError:
+            # 严格按 UTF-8 解码；文本模式下的出错位置是解码缓冲区里的，另外扫一遍找出字节偏移
+            offset, line, reason = _first_invalid_utf8(path)
+            _add_error(errors, line=line, record=count + 1, error=_utf8_error(offset, reason))
+    return count, errors
+
+def scan_store(path):
+    """检查 .rstore 记录库，返回 (记录数, 错误列表)；标准 Alpaca 记录写入时已按列存放，只需检查以整条 JSON 存放的记录"""
+    from record_store import RecordStore, EXTRA  # 只有检查记录库时才需要 numpy
+    errors = []
+    with RecordStore(path) as store:
+        for i, extra in enumerate(store.column(EXTRA), 1):
+            if extra:
+                for msg in check_record(json.loads(extra)):
+                    _add_error(errors, line=None, record=i, error=msg)
+        return len(store), errors
+
+def _size(path):
+    if os.path.isdir(path):
+        return sum(e.stat().st_size for e in os.scandir(path) if e.is_file())
+    return os.path.getsize(path)
+
+def scan_jsonl_range(path, start, end):
+    """
+    检查 JSON Lines 文件中起始位置落在 [start, end) 内的行。
+    返回 (本区间行数, 本区间记录数, 错误列表)，错误里的行号/记录序号是区间内的相对值，由主进程换算成全局值。
+    """
+    errors = []
+    lines = records = 0
+    with open(path, "rb") as f:
+        if start > 0:
+            f.seek(start - 1)
+            if f.read(1) != b"\n":
+                f.readline()  # 上一个区间负责这行的剩余部分
+        while f.tell() < end:
+            line_start = f.tell()
+            raw = f.readline()
+            if not raw:
+                break
+            lines += 1
+            if not raw.strip():
+                continue  # 跳过空行
+            try:
+                text = raw.decode("utf-8").strip()
+            except UnicodeDecodeError as e:
+                records += 1
+                _add_error(errors, line=lines, record=records, error=_utf8_error(line_start + e.start, e.reason))
+                continue
+            if start == 0 and lines == 1:
+                text = text.lstrip("\ufeff")
+                if not text:
+                    continue
+            records += 1
+            try:
+                item = json.loads(text)
+            except json.JSONDecodeError as e:
+                _add_error(errors, line=lines, record=records, error=f"JSON解析错误：{e.msg}，位置：第{e.colno}列")
+                continue
+            for msg in check_record(item):
+                _add_error(errors, line=lines, record=records, error=msg)
+    return lines, records, errors
+
+# ================== 主流程 ==================
+
+def validate_files(paths, workers=WORKERS, metrics=None):
+    """并行检查多个文件，返回 {路径: 报告}；报告含 format / records / errors / ok
+    传入 metrics 时每个文件记一条事件（文件并行检查，耗时记为从开始到该文件结果汇总完成）"""
+    start = time.perf_counter()
+    max_workers = workers if workers and workers > 0 else (os.cpu_count() or 4)
+    reports = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as ex:
+        jobs = {}
+        for path in paths:
+            path = str(path)
+            fmt = detect_format(path)
+            if fmt == "array":
+                jobs[path] = (fmt, [ex.submit(scan_array, path)])
+            elif fmt == "store":
+                jobs[path] = (fmt, [ex.submit(scan_store, path)])
+            elif fmt == "object":
+                jobs[path] = (fmt, [])
+            else:
+                size = os.path.getsize(path)
+                ranges = range(0, max(size, 1), RANGE_BYTES)
+                jobs[path] = (fmt, [ex.submit(scan_jsonl_range, path, s, min(s + RANGE_BYTES, size)) for s in ranges])
+
+        for path, (fmt, futures) in jobs.items():
+            if fmt == "object":
+                count, errors = 0, [{"line": 1, "record": None, "error": "JSON 内容不是数组格式（顶层是单个对象）"}]
+            elif fmt in ("array", "store"):
+                count, errors = futures[0].result()
+            else:
+                # 按区间顺序把相对行号/记录序号换算成全局值
+                count, errors, line_base = 0, [], 0
+                for fut in futures:
+                    lines, records, part = fut.result()
+                    for err in part:
+                        err["line"] += line_base
+                        err["record"] += count
+                        _add_error(errors, **err)
+                    line_base += lines
+                    count += records
+            reports[path] = {"format": fmt, "records": count, "errors": errors, "ok": not errors}
+            if metrics is not None:
+                metrics.event(STAGE, "file", path=path, seconds=time.perf_counter() - start, records=count,
+                              bytes_in=_size(path), ok=not errors, error_count=len(errors))
+    return reports
+
+def print_report(path, report):
+    name = {"array": "标准 JSON 数组", "store": ".rstore 记录库", "object": "单个 JSON 对象"}.get(report["format"], "JSON Lines")
+    print(f"{path}\n检测到{name}格式，共 {report['records']} 条记录")
+    if report["ok"]:
+        print("✅ 数据集格式验证通过！")
+        return
+    print(f"❌ 发现 {len(report['errors'])} 处问题：")
+    for err in report["errors"]:
+        if err["line"] is None:
+            where = f"第{err['record']}条记录"
+        else:
+            where = f"第{err['line']}行" + (f"（第{err['record']}条记录）" if err.get("record") else "")
+        print(f"  {where}：{err['error']}")
+
+def validate_dataset_format(json_path, workers=WORKERS):
+    """检查单个文件，打印全部问题，返回是否通过"""
+    try:
+        report = validate_files([json_path], workers)[str(json_path)]
     except Exception as e:
         print(f"❌ 其他错误：{e}")
         return False
+    print_report(json_path, report)
+    return report["ok"]
 
-# 调用验证函数
-validate_dataset_format(r"F:\PhD-item-experment\answer\knowledge\knowledgecode\Code\dataset_processing\zhishifinal\test.json")
\ No newline at end of file
+if __name__ == "__main__":
+    # 可在命令行传入多个文件；不传时检查默认文件
+    targets = sys.argv[1:] or [r"F:\PhD-item-experment\answer\knowledge\knowledgecode\Code\dataset_processing\zhishifinal\test.json"]
+    metrics = Metrics()
+    try:
+        all_reports = validate_files(targets, metrics=metrics)
+        for target, rep in all_reports.items():
+            print_report(target, rep)
+            print()
+        if REPORT_PATH:
+            with open(REPORT_PATH, "w", encoding="utf-8") as f:
+                json.dump(all_reports, f, ensure_ascii=False, indent=2)
+            print(f"报告已写入：{REPORT_PATH}")
+        metrics.print_summary()
+    finally:
+        metrics.close()
@@ -0,0 +1,773 @@
+"""
+性能基准
+用法：python benchmark.py [项目 ...] [--scale small|medium|large] [--save] [--label 名称] [--compare [版本]]
+不写项目时全部运行；语料全部合成在临时目录里，固定随机种子，同一规模下每次生成的内容相同
+- word_to_txt：合成 .docx 语料（有 LibreOffice 时再加 .doc），比较 02word_to_txt.batch_convert 线程池与进程池的吞吐
+- docx_extract：表格密集的 .docx 上比较 python-docx 与 lxml 两种解析方式，并逐字核对输出（以 python-docx 输出为基准）；
+  另测同时写出块索引（.blocks.jsonl）的开销并核对两种方式的块索引
+- pdf_to_txt：合成多页 PDF（需要 reportlab），01pdf_to_word.convert_all_pdfs_to_txt
+- read_text：不同大小的 UTF-8 / GB18030 文本，03text_to_qa.read_text（含编码检测）
+- text_to_qa：03 的切块、生成、质量过滤全流程，大模型用 qa_engine.FakeGeneration 模拟（固定延迟）
+- qa_policy：合成四类文档（正文、套话多、表格填充多、英文为主），各含已知数量的不重复知识点，
+  比较 03 的两种问答数量策略：计划生成的问答数、其中有用的（不超过知识点数）、token 用量与每个有用问答对的估算费用
+- qa_packing：小文件为主的语料上，03 请求合并关 / 开时的请求数与输入 token 数
+- qa_profiles：四类文件夹（政策、论文、维修、其他）混合的语料一次跑完，按提示词配置统计文件与请求数；
+  另比较预编译模板与 str.format 的渲染速度
+- split：04 的哈希划分与按比例划分（split_by_ratio，需要 sklearn）
+- merge：05 merge_json_files（去重开/关）与 06 merge_trains
+- check：07check_dataset.validate_dataset_format，JSON 数组与 JSONL 各一份
+- count_qa：count_qa_pairs.count_qa_pairs_in_folder，首次（扫描全部文件）与再次（查统计索引）
+- record_store：.rstore 打包、整库遍历、按列遍历与随机读单条，对比流式解析 JSON 数组
+问答数据集的规模随 --scale 变化（small 1e3–1e4 条，medium 到 1e6，large 到 1e7）
+结果保存（--save）：每个计时项追加一行到 benchmark_results.jsonl，带版本（git 提交号，或 --label）、规模与机器信息
+回归对比（--compare）：与指定版本（不写时为结果文件里最近的另一个版本）同规模、同条目数的结果比较速率，
+变慢超过 REGRESSION_TOLERANCE 的标 ⚠️
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+from pipeline_manifest import Manifest
+from pipeline_metrics import Metrics
+
+# 合成语料规模
+DOCX_COUNT = 64          # 文档数
+DOCX_PARAGRAPHS = 400    # 每个文档的段落数
+DOCX_TABLES = 6          # 每个文档的表格数
+DOCX_TABLE_ROWS = 60     # 每个表格的行数
+DOCX_TABLE_COLS = 6      # 每个表格的列数
+SEED = 42
+
+# 各规模下：问答数据集条数、文本文件大小（字节）、PDF 数与页数、03 生成用的文本文件数
+SCALES = {
+    "small": {"qa_records": (10 ** 3, 10 ** 4), "text_bytes": (64 * 1024, 1024 ** 2), "pdfs": (8, 20), "qa_files": 16},
+    "medium": {"qa_records": (10 ** 3, 10 ** 5, 10 ** 6), "text_bytes": (64 * 1024, 1024 ** 2, 16 * 1024 ** 2),
+               "pdfs": (32, 40), "qa_files": 64},
+    "large": {"qa_records": (10 ** 3, 10 ** 5, 10 ** 6, 10 ** 7),
+              "text_bytes": (64 * 1024, 1024 ** 2, 16 * 1024 ** 2, 128 * 1024 ** 2), "pdfs": (128, 60), "qa_files": 256},
+}
+SCALE = SCALES["small"]
+
+# 结果文件与回归判定：速率比基准低这么多即视为变慢
+BENCH_RESULTS = Path(__file__).resolve().parent / "benchmark_results.jsonl"
+REGRESSION_TOLERANCE = 0.10
+# 模拟大模型的单次调用延迟（秒）
+FAKE_LATENCY = 0.02
+
+# 本次运行的计时结果：report() 追加，--save / --compare 使用
+RESULTS = []
+_current = None
+
+# 合成文本用的常见字
+_CHARS = "污水处理厂运行出水水质监测氨氮总磷化学需氧量曝气池污泥回流沉淀消毒设备检修规程标准限值应当不得采样频率"
+
+
+def random_text(rng, n):
+    return "".join(rng.choice(_CHARS) for _ in range(n))
+
+
+def _add_hyperlink(paragraph, text):
+    """python-docx 没有现成接口，直接拼一个 w:hyperlink"""
+    from docx.oxml import OxmlElement
+    from docx.oxml.ns import qn
+    link = OxmlElement("w:hyperlink")
+    link.set(qn("w:anchor"), "_bench")
+    run = OxmlElement("w:r")
+    t = OxmlElement("w:t")
+    t.text = text
+    run.append(t)
+    link.append(run)
+    paragraph._p.append(link)
+
+
+def _add_rich_content(doc, rng):
+    """各种容易出错的结构：标题与大纲级别、制表符、换行/分页、超链接、不规则合并、嵌套表格、行首空网格"""
+    from docx.enum.text import WD_BREAK
+    from docx.oxml import OxmlElement
+    from docx.oxml.ns import qn
+    doc.add_heading(random_text(rng, 8), level=0)
+    doc.add_heading(random_text(rng, 8), level=1)
+    doc.add_heading(random_text(rng, 8), level=2)
+    outline = OxmlElement("w:outlineLvl")            # 段落上直接设置的大纲级别
+    outline.set(qn("w:val"), "2")
+    doc.add_paragraph(random_text(rng, 8))._p.get_or_add_pPr().append(outline)
+    p = doc.add_paragraph(random_text(rng, 10) + "\t" + random_text(rng, 5))
+    run = p.add_run(random_text(rng, 8))
+    run.add_break()
+    run.add_text(random_text(rng, 4))
+    run.add_break(WD_BREAK.PAGE)
+    _add_hyperlink(p, "链接" + random_text(rng, 3))
+    doc.add_paragraph("")  # 空段落
+    table = doc.add_table(rows=5, cols=5)
+    for r, row in enumerate(table.rows):
+        for c, cell in enumerate(row.cells):
+            cell.text = f"{random_text(rng, 3)}{r}{c}"
+    table.cell(0, 0).merge(table.cell(2, 1))          # 2x3 块合并
+    table.cell(3, 2).merge(table.cell(4, 4))          # 右下角块合并
+    cell = table.cell(1, 3)
+    cell.add_paragraph("")                            # 单元格内空段落
+    cell.add_paragraph(" 第二段 ")
+    _add_hyperlink(cell.paragraphs[0], "格内链接")
+    cell.add_table(rows=2, cols=2).cell(0, 0).text = "嵌套表格不输出"
+    tr_pr = table.rows[4]._tr.get_or_add_trPr()
+    grid_before = OxmlElement("w:gridBefore")
+    grid_before.set(qn("w:val"), "0")
+    tr_pr.append(grid_before)
+
+
+def make_docx(path, rng, paragraphs=None, tables=None, rows=None, cols=None, merged=True, rich=False):
+    """生成一个包含段落与表格（可含合并单元格）的 .docx；规模参数缺省时取模块顶部的配置"""
+    from docx import Document
+    paragraphs = DOCX_PARAGRAPHS if paragraphs is None else paragraphs
+    tables = DOCX_TABLES if tables is None else tables
+    rows = rows or DOCX_TABLE_ROWS
+    cols = cols or DOCX_TABLE_COLS
+    doc = Document()
+    table_at = set(rng.sample(range(paragraphs), min(tables, paragraphs)))
+    for i in range(paragraphs):
+        doc.add_paragraph(random_text(rng, rng.randint(20, 200)))
+        if i in table_at:
+            table = doc.add_table(rows=rows, cols=cols)
+            for r, row in enumerate(table.rows):
+                for c, cell in enumerate(row.cells):
+                    cell.text = f"{random_text(rng, 6)}{r}.{c}"
+            if merged and rows > 2 and cols > 2:
+                table.cell(0, 0).merge(table.cell(0, 1))   # 横向合并
+                table.cell(1, 2).merge(table.cell(2, 2))   # 纵向合并
+    if rich:
+        _add_rich_content(doc, rng)
+    doc.save(str(path))
+
+
+def make_docx_corpus(root, count=None, seed=SEED, **kwargs):
+    """在 root 下生成 count 个合成 .docx，返回文件列表"""
+    count = count or DOCX_COUNT
+    rng = random.Random(seed)
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    files = []
+    for i in range(count):
+        path = root / f"doc_{i:04d}.docx"
+        make_docx(path, rng, **kwargs)
+        files.append(path)
+    return files
+
+
+def make_text(rng, size, pool_bytes=1024 ** 2):
+    """约 size 字节（UTF-8）的中文文本；先合成一块约 1 MB 的段落池，再随机拼接，大文件也能很快生成"""
+    pool = []
+    pool_size = 0
+    while pool_size < min(size, pool_bytes):
+        para = random_text(rng, rng.randint(40, 400)) + "。"
+        pool.append(para)
+        pool_size += len(para.encode("utf-8")) + 1
+    out = []
+    total = 0
+    while total < size:
+        para = pool[rng.randrange(len(pool))]
+        out.append(para)
+        total += len(para.encode("utf-8")) + 1
+    return "\n".join(out) + "\n"
+
+
+def make_text_file(path, rng, size, encoding="utf-8"):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(make_text(rng, size).encode(encoding))
+    return path
+
+
+def make_qa_records(rng, n, pool_size=4096):
+    """逐条产出 n 条 Alpaca 记录；问题与答案从固定大小的池里取，再拼上序号保证每条不同"""
+    questions = [random_text(rng, rng.randint(10, 40)) + "？" for _ in range(min(n, pool_size))]
+    answers = [random_text(rng, rng.randint(30, 200)) + "。" for _ in range(min(n, pool_size))]
+    for i in range(n):
+        yield {"instruction": f"{questions[i % len(questions)]}（{i}）", "input": "",
+               "output": answers[rng.randrange(len(answers))]}
+
+
+def make_qa_set(path, rng, n):
+    """写出一个 n 条记录的问答数据集，格式由后缀决定（.json 数组 / .jsonl）"""
+    from dataset_io import open_writer
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open_writer(path) as writer:
+        for record in make_qa_records(rng, n):
+            writer.write(record)
+    return path
+
+
+def make_qa_folder(root, rng, files, records):
+    """root 下 files 个 .json 问答文件，共约 records 条"""
+    per_file = max(1, records // files)
+    return [make_qa_set(Path(root) / f"qa_{i:04d}.json", rng, per_file) for i in range(files)]
+
+
+def make_pdf_corpus(root, count, pages, seed=SEED):
+    """用 reportlab 合成 count 个多页 PDF（英文字体内置，内容为随机单词）；没有 reportlab 时返回空列表"""
+    try:
+        from reportlab.pdfgen import canvas
+    except ImportError:
+        return []
+    rng = random.Random(seed)
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    files = []
+    for i in range(count):
+        path = root / f"pdf_{i:04d}.pdf"
+        c = canvas.Canvas(str(path))
+        for _ in range(pages):
+            for line in range(45):
+                c.drawString(40, 800 - line * 17, " ".join(_random_word(rng) for _ in range(12)) + ".")
+            c.showPage()
+        c.save()
+        files.append(path)
+    return files
+
+
+def make_doc_corpus(root, docx_files):
+    """有 LibreOffice 时把合成的 .docx 另存为 .doc 放到 root 下；没有时返回空列表"""
+    from soffice_pool import find_soffice
+    soffice = find_soffice()
+    if not soffice:
+        return []
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    subprocess.run([soffice, "--headless", "--convert-to", "doc", "--outdir", str(root)] + [str(f) for f in docx_files],
+                   capture_output=True, timeout=600)
+    return sorted(root.glob("*.doc"))
+
+
+def report(name, seconds, items, unit="个"):
+    rate = items / seconds if seconds > 0 else float("inf")
+    print(f"{name:<36} {seconds:8.2f} 秒  {items} {unit}  {rate:8.1f} {unit}/秒")
+    RESULTS.append({"bench": _current, "name": name, "seconds": round(seconds, 4), "items": items, "unit": unit,
+                    "rate": round(rate, 3) if seconds > 0 else None})
+
+
+@contextlib.contextmanager
+def quiet():
+    """屏蔽被测函数逐文件的打印，避免输出本身影响计时"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+@contextlib.contextmanager
+def workdir(prefix):
+    tmp = Path(tempfile.mkdtemp(prefix=prefix))
+    try:
+        yield tmp
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def bench_word_to_txt():
+    """02word_to_txt.batch_convert：线程池 vs 进程池"""
+    w2t = importlib.import_module("02word_to_txt")
+    tmp = Path(tempfile.mkdtemp(prefix="bench_w2t_"))
+    try:
+        files = make_docx_corpus(tmp / "docx")
+        print(f"合成语料：{len(files)} 个 .docx，共 {sum(f.stat().st_size for f in files) / 1024 / 1024:.1f} MB")
+        docs = make_doc_corpus(tmp / "docx" / "doc", files[:max(1, len(files) // 8)])
+        if docs:
+            print(f"另有 {len(docs)} 个 .doc（LibreOffice 另存）")
+            files += docs
+        else:
+            print("未检测到 LibreOffice，不含 .doc")
+        for executor in ("thread", "process"):
+            out = tmp / f"txt_{executor}"
+            manifest = Manifest(tmp / f"manifest_{executor}.json")
+            t0 = time.perf_counter()
+            w2t.batch_convert(tmp / "docx", out, workers=0, overwrite=True, executor=executor, manifest=manifest,
+                              metrics=Metrics(None))
+            report(f"batch_convert[{executor}]", time.perf_counter() - t0, len(files), "文档")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def bench_docx_extract():
+    """02word_to_txt：python-docx 对象遍历 vs lxml 流式解析，表格密集文档"""
+    w2t = importlib.import_module("02word_to_txt")
+    tmp = Path(tempfile.mkdtemp(prefix="bench_extract_"))
+    try:
+        files = make_docx_corpus(tmp / "docx", count=max(4, DOCX_COUNT // 4),
+                                 paragraphs=DOCX_PARAGRAPHS // 4, tables=DOCX_TABLES * 3,
+                                 rows=DOCX_TABLE_ROWS * 2, rich=True)
+        print(f"合成语料：{len(files)} 个表格密集 .docx，共 {sum(f.stat().st_size for f in files) / 1024 / 1024:.1f} MB")
+        timings = {}
+        for name, extract in (("python-docx", w2t.docx_to_txt), ("lxml", w2t.docx_to_txt_fast)):
+            t0 = time.perf_counter()
+            for f in files:
+                extract(f, tmp / name / (f.stem + ".txt"))
+            timings[name] = time.perf_counter() - t0
+            report(f"docx_to_txt[{name}]", timings[name], len(files), "文档")
+        print(f"加速比：{timings['python-docx'] / timings['lxml']:.1f}x")
+
+        # 逐字核对：python-docx 输出为基准
+        mismatched = [f.name for f in files
+                      if (tmp / "python-docx" / (f.stem + ".txt")).read_bytes() != (tmp / "lxml" / (f.stem + ".txt")).read_bytes()]
+        if mismatched:
+            print(f"❌ 输出不一致：{len(mismatched)} 个，例如 {mismatched[:5]}")
+        else:
+            print(f"✅ {len(files)} 个文档输出逐字一致")
+
+        # 同一遍解析里顺带写出块索引的开销；两种解析方式的 txt 与块索引都应逐字一致
+        for name, extract in (("python-docx", w2t.docx_to_txt), ("lxml", w2t.docx_to_txt_fast)):
+            t0 = time.perf_counter()
+            for f in files:
+                extract(f, tmp / f"{name}+blocks" / (f.stem + ".txt"), tmp / f"{name}+blocks" / (f.stem + ".blocks.jsonl"))
+            report(f"docx_to_txt+blocks[{name}]", time.perf_counter() - t0, len(files), "文档")
+        mismatched = [f.name for f in files for suffix in (".txt", ".blocks.jsonl")
+                      if (tmp / "python-docx+blocks" / (f.stem + suffix)).read_bytes()
+                      != (tmp / "lxml+blocks" / (f.stem + suffix)).read_bytes()
+                      or suffix == ".txt" and (tmp / "lxml+blocks" / (f.stem + suffix)).read_bytes()
+                      != (tmp / "lxml" / (f.stem + suffix)).read_bytes()]
+        if mismatched:
+            print(f"❌ 块索引输出不一致：{len(mismatched)} 个，例如 {mismatched[:5]}")
+        else:
+            print(f"✅ {len(files)} 个文档的块索引逐字一致，txt 与不写块索引时相同")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+# qa_policy 基准：每类文档的份数、每份的知识点数范围、每个问答对的典型输出 token 数
+POLICY_DOCS = 40
+POLICY_FACTS = (3, 60)
+PAIR_OUTPUT_TOKENS = 120
+
+
+def _random_word(rng):
+    return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 9)))
+
+
+def make_policy_doc(rng, kind, facts):
+    """合成一个含 facts 个不重复知识点的文档；kind 决定填充方式"""
+    # 一个知识点是一段 6 句左右的话
+    if kind == "ascii":
+        lines = [" ".join(" ".join(_random_word(rng) for _ in range(10)) + f" {rng.randint(1, 999)} mg/L."
+                          for _ in range(6)) for _ in range(facts)]
+    else:
+        # 常用汉字区随机取字，信息量接近真实中文
+        lines = ["".join("".join(chr(0x4E00 + rng.randrange(3000)) for _ in range(40)) + "。" for _ in range(6))
+                 for _ in range(facts)]
+    if kind == "boilerplate":
+        header = "本标准由生态环境部提出并归口。本标准起草单位：某某市排水有限公司。"
+        footer = "第 页 共 页　　仅供内部参考，不得外传。"
+        lines = [x for i, line in enumerate(lines) for x in ([header, footer, line] if i % 3 == 0 else [line])]
+    elif kind == "table":
+        rows = [f"{i}\t—\tmg/L\t≤\t—\t每日" for i in range(facts * 30)]
+        lines = lines + rows
+    return "\n".join(lines)
+
+
+def bench_qa_policy():
+    """03 的问答数量策略：按字节数分档 vs 按信息密度"""
+    from qa_chunking import chunk_text
+    from qa_engine import estimate_tokens
+    from qa_policy import SizePolicy, DensityPolicy
+    from pipeline_metrics import PRICES
+    qa = importlib.import_module("03text_to_qa")
+    price_in, price_out = PRICES[qa.MODEL]
+    prompt_tokens = estimate_tokens(qa.PROMPT_TEMPLATE + qa.SYSTEM_PROMPT)
+    rng = random.Random(SEED)
+    docs = [(kind, n, make_policy_doc(rng, kind, n))
+            for kind in ("prose", "boilerplate", "table", "ascii")
+            for n in (rng.randint(*POLICY_FACTS) for _ in range(POLICY_DOCS))]
+    chunked = [(kind, n, text, chunk_text(text, qa.CHUNK_TOKENS, qa.CHUNK_OVERLAP)) for kind, n, text in docs]
+    print(f"合成语料：{len(docs)} 个文档，共 {sum(len(t.encode('utf-8')) for _, _, t in docs) / 1024 / 1024:.1f} MB，"
+          f"知识点 {sum(n for _, n, _ in docs)} 个")
+    policies = [SizePolicy(qa.MAX_QA_PER_CHUNK, qa.GEN_PARAMS["max_tokens"]),
+                DensityPolicy(max_per_chunk=qa.MAX_QA_PER_CHUNK, max_tokens=qa.GEN_PARAMS["max_tokens"])]
+    print(f"{'策略':<10}{'类型':<14}{'问答数':>8}{'有用':>8}{'多余':>8}{'缺少':>8}{'输入token':>12}{'输出token':>12}"
+          f"{'TPM预占':>12}{'元/有用对':>12}")
+    for policy in policies:
+        t0 = time.perf_counter()
+        totals = {kind: [0] * 7 for kind in ("prose", "boilerplate", "table", "ascii", "合计")}
+        for kind, facts, text, chunks in chunked:
+            counts, budgets, _ = policy.plan(text, chunks, len(text.encode("utf-8")))
+            pairs = sum(counts)
+            tokens_in = sum(prompt_tokens + estimate_tokens(c) for c, n in zip(chunks, counts) if n)
+            tokens_out = pairs * PAIR_OUTPUT_TOKENS
+            reserved = tokens_in + sum(b for b, n in zip(budgets, counts) if n)
+            row = [pairs, min(pairs, facts), max(0, pairs - facts), max(0, facts - pairs), tokens_in, tokens_out, reserved]
+            for key in (kind, "合计"):
+                totals[key] = [a + b for a, b in zip(totals[key], row)]
+        for kind, (pairs, useful, extra, missing, tokens_in, tokens_out, reserved) in totals.items():
+            cost = (tokens_in * price_in + tokens_out * price_out) / 1000
+            print(f"{policy.name:<10}{kind:<14}{pairs:>8}{useful:>8}{extra:>8}{missing:>8}{tokens_in:>12}{tokens_out:>12}"
+                  f"{reserved:>12}{cost / max(1, useful):>12.5f}")
+        report(f"plan[{policy.name}]", time.perf_counter() - t0, len(docs), "文档")
+
+
+def bench_pdf_to_txt():
+    """01pdf_to_word.convert_all_pdfs_to_txt：按页区间并行抽取"""
+    pdf = importlib.import_module("01pdf_to_word")
+    count, pages = SCALE["pdfs"]
+    with workdir("bench_pdf_") as tmp:
+        files = make_pdf_corpus(tmp / "pdf", count, pages)
+        if not files:
+            print("⚠️ 未安装 reportlab，跳过")
+            return
+        print(f"合成语料：{len(files)} 个 PDF × {pages} 页，共 {sum(f.stat().st_size for f in files) / 1024 / 1024:.1f} MB")
+        t0 = time.perf_counter()
+        with quiet():
+            pdf.convert_all_pdfs_to_txt(str(tmp / "pdf"), str(tmp / "txt"), manifest=Manifest(tmp / "manifest.json"),
+                                        metrics=Metrics(None))
+        report("convert_all_pdfs_to_txt", time.perf_counter() - t0, len(files) * pages, "页")
+
+
+def bench_read_text():
+    """03text_to_qa.read_text：UTF-8 快速路径与需要检测编码的 GB18030"""
+    qa = importlib.import_module("03text_to_qa")
+    rng = random.Random(SEED)
+    with workdir("bench_read_") as tmp:
+        for size in SCALE["text_bytes"]:
+            for encoding in ("utf-8", "gb18030"):
+                path = make_text_file(tmp / f"{encoding}_{size}.txt", rng, size, encoding)
+                t0 = time.perf_counter()
+                qa.read_text(path)
+                report(f"read_text[{encoding}, {size // 1024} KB]", time.perf_counter() - t0,
+                       round(path.stat().st_size / 1024 ** 2, 2), "MB")
+
+
+def bench_text_to_qa():
+    """03 的单文件全流程（读入、切块、策略、生成、质量过滤、写出），大模型调用用 FakeGeneration 模拟"""
+    qa = importlib.import_module("03text_to_qa")
+    from qa_engine import FakeGeneration
+    rng = random.Random(SEED)
+    saved = qa.OUTPUT_DIR, qa.CACHE_PATH, qa.REJECTED_DIR
+    with workdir("bench_qa_") as tmp:
+        files = [make_text_file(tmp / "txt" / f"t_{i:04d}.txt", rng, rng.randint(8, 64) * 1024)
+                 for i in range(SCALE["qa_files"])]
+        qa.OUTPUT_DIR, qa.CACHE_PATH, qa.REJECTED_DIR = tmp / "qa", None, tmp / "qa" / "_rejected"
+        try:
+            metrics = Metrics(None)
+            engine, cache = qa.open_generation(metrics, call_fn=FakeGeneration(latency=FAKE_LATENCY, seed=SEED, pairs=5))
+            manifest = Manifest(tmp / "manifest.json")
+            t0 = time.perf_counter()
+            with quiet():
+                results = list(engine.map(lambda p: qa.process_file(p, engine, cache, manifest, metrics), files))
+            seconds = time.perf_counter() - t0
+            failed = sum(1 for _, _, error in results if error is not None)
+            report("process_file[fake LLM]", seconds, len(files), "文件")
+            print(f"API 调用 {engine.stats['calls']} 次，失败文件 {failed} 个")
+        finally:
+            qa.OUTPUT_DIR, qa.CACHE_PATH, qa.REJECTED_DIR = saved
+
+
+def bench_qa_packing():
+    """03 的请求合并：小文件为主的语料上，关 / 开合并时的请求数、输入 token 数与耗时（FakeGeneration 模拟）"""
+    qa = importlib.import_module("03text_to_qa")
+    from qa_engine import FakeGeneration
+    rng = random.Random(SEED)
+    saved = qa.OUTPUT_DIR, qa.CACHE_PATH, qa.REJECTED_DIR, qa.PACK_REQUESTS
+    with workdir("bench_pack_") as tmp:
+        files = [make_text_file(tmp / "txt" / f"s_{i:04d}.txt", rng, rng.randint(1, 5) * 1024)
+                 for i in range(SCALE["qa_files"] * 4)]
+        print(f"合成语料：{len(files)} 个 1–5 KB 的小文件")
+        try:
+            for packing in (False, True):
+                qa.OUTPUT_DIR, qa.CACHE_PATH = tmp / f"qa_{packing}", None
+                qa.REJECTED_DIR, qa.PACK_REQUESTS = qa.OUTPUT_DIR / "_rejected", packing
+                metrics = Metrics(None)
+                engine, cache = qa.open_generation(metrics, call_fn=FakeGeneration(latency=FAKE_LATENCY, seed=SEED,
+                                                                                   pairs=3))
+                manifest = Manifest(tmp / f"manifest_{packing}.json")
+                t0 = time.perf_counter()
+                with quiet():
+                    results = list(engine.map(lambda p: qa.process_file(p, engine, cache, manifest, metrics), files))
+                    qa.close_generation(engine, cache)
+                seconds = time.perf_counter() - t0
+                row = metrics.summary()[qa.STAGE]
+                report(f"process_file[pack={packing}]", seconds, len(files), "文件")
+                print(f"请求 {row['api_calls']} 个，输入 token {row['input_tokens']}，输出 token {row['output_tokens']}，"
+                      f"失败文件 {sum(1 for _, _, e in results if e is not None)} 个")
+        finally:
+            qa.OUTPUT_DIR, qa.CACHE_PATH, qa.REJECTED_DIR, qa.PACK_REQUESTS = saved
+
+
+def bench_qa_profiles():
+    """03 按目录路由提示词配置：混合语料递归一次跑完（FakeGeneration 模拟），以及模板渲染速度"""
+    qa = importlib.import_module("03text_to_qa")
+    from qa_engine import FakeGeneration
+    from qa_profiles import PROFILES
+    rng = random.Random(SEED)
+    saved = qa.OUTPUT_DIR, qa.CACHE_PATH, qa.REJECTED_DIR
+    with workdir("bench_profiles_") as tmp:
+        files = []
+        for folder in ("standard", "paper", "weixiu", "misc"):
+            files += [make_text_file(tmp / "txt" / folder / f"{folder}_{i:03d}.txt", rng, rng.randint(1, 12) * 1024)
+                      for i in range(SCALE["qa_files"])]
+        print(f"合成语料：{len(files)} 个文件，分在 4 个文件夹")
+        try:
+            qa.OUTPUT_DIR, qa.CACHE_PATH = tmp / "qa", None
+            qa.REJECTED_DIR = qa.OUTPUT_DIR / "_rejected"
+            metrics = Metrics(None)
+            engine, cache = qa.open_generation(metrics, call_fn=FakeGeneration(latency=FAKE_LATENCY, seed=SEED, pairs=3))
+            manifest = Manifest(tmp / "manifest.json")
+            t0 = time.perf_counter()
+            with quiet():
+                results = list(engine.map(lambda p: qa.process_file(p, engine, cache, manifest, metrics,
+                                                                    root=tmp / "txt"), files))
+            used = {name: dict(p.stats) for name, p in PROFILES.items()}
+            with quiet():
+                qa.close_generation(engine, cache)
+            report("process_file[mixed]", time.perf_counter() - t0, len(files), "文件")
+            print(f"失败文件 {sum(1 for _, _, e in results if e is not None)} 个；"
+                  + "，".join(f"{name} {st['files']} 个文件 / {st['requests']} 次请求" for name, st in used.items()))
+        finally:
+            qa.OUTPUT_DIR, qa.CACHE_PATH, qa.REJECTED_DIR = saved
+
+    profile = PROFILES["operations"]
+    text = make_text(rng, 12 * 1024)
+    n = 20000
+    t0 = time.perf_counter()
+    for _ in range(n):
+        profile.template.format(qa_count=10, text=text)
+    report("template str.format", time.perf_counter() - t0, n, "次")
+    t0 = time.perf_counter()
+    for _ in range(n):
+        profile.render(10, text)
+    report("template compiled", time.perf_counter() - t0, n, "次")
+
+
+def bench_split():
+    """04：哈希划分（流式，直接写出合并结果）与按比例划分（整文件读入 + sklearn）"""
+    split = importlib.import_module("04dataset_split")
+    from dataset_io import iter_records
+    saved = split.MERGED_DIR, split.OUTPUT_ROOT
+    rng = random.Random(SEED)
+    try:
+        for n in SCALE["qa_records"]:
+            with workdir("bench_split_") as tmp:
+                src = make_qa_set(tmp / "qa" / "data.json", rng, n)
+                split.MERGED_DIR = str(tmp / "merged")
+                t0 = time.perf_counter()
+                with quiet():
+                    split.hash_split([src], Manifest(tmp / "manifest.json"), Metrics(None))
+                report(f"hash_split[{n}]", time.perf_counter() - t0, n, "条")
+                try:
+                    import sklearn  # noqa: F401
+                except ImportError:
+                    continue
+                split.OUTPUT_ROOT = str(tmp / "ratio")
+                for sub in split.SPLITS:
+                    os.makedirs(os.path.join(split.OUTPUT_ROOT, sub), exist_ok=True)
+                t0 = time.perf_counter()
+                with quiet():
+                    split.split_by_ratio(list(iter_records(src)), "data")
+                report(f"split_by_ratio[{n}]", time.perf_counter() - t0, n, "条")
+    finally:
+        split.MERGED_DIR, split.OUTPUT_ROOT = saved
+    try:
+        import sklearn  # noqa: F401
+    except ImportError:
+        print("未安装 sklearn，跳过 split_by_ratio")
+
+
+def bench_merge():
+    """05 merge_json_files（近似去重开 / 关）与 06 merge_trains；每个来源一个文件"""
+    merge = importlib.import_module("05dataset_merge")
+    final = importlib.import_module("06dataset_final_merge")
+    from qa_dedup import DedupIndex
+    saved = merge.INPUT_ROOT, merge.OUTPUT_DIR
+    rng = random.Random(SEED)
+    try:
+        for n in SCALE["qa_records"]:
+            with workdir("bench_merge_") as tmp:
+                sources = [tmp / "src" / f"s{i}" for i in range(4)]
+                for d in sources:
+                    make_qa_set(d / "val" / "part.json", rng, n // len(sources))
+                    shutil.copy(d / "val" / "part.json", d / "val.json")
+                merge.INPUT_ROOT = str(tmp / "src" / "s0")
+                for dedup in (False, True):
+                    merge.OUTPUT_DIR = str(tmp / f"merged_{dedup}")
+                    index = DedupIndex(str(tmp / f"dedup_{dedup}.sqlite")) if dedup else None
+                    t0 = time.perf_counter()
+                    with quiet():
+                        merge.merge_json_files("val", dedup=index)
+                    report(f"merge_json_files[dedup={dedup}, {n // len(sources)}]", time.perf_counter() - t0,
+                           n // len(sources), "条")
+                    if index is not None:
+                        index.close()
+                (tmp / "final").mkdir()
+                t0 = time.perf_counter()
+                with quiet():
+                    final.merge_trains([str(d) for d in sources], str(tmp / "final" / "val.json"))
+                report(f"merge_trains[{n}]", time.perf_counter() - t0, n, "条")
+    finally:
+        merge.INPUT_ROOT, merge.OUTPUT_DIR = saved
+
+
+def bench_check():
+    """07check_dataset.validate_dataset_format：JSON 数组（单进程流式）与 JSONL（按字节区间并行）"""
+    check = importlib.import_module("07check_dataset")
+    rng = random.Random(SEED)
+    for n in SCALE["qa_records"]:
+        with workdir("bench_check_") as tmp:
+            for suffix in (".json", ".jsonl"):
+                path = make_qa_set(tmp / f"data{suffix}", rng, n)
+                t0 = time.perf_counter()
+                with quiet():
+                    ok = check.validate_dataset_format(path)
+                report(f"validate_dataset_format[{suffix}, {n}]", time.perf_counter() - t0, n, "条")
+                if not ok:
+                    print(f"❌ 合成数据没有通过检查：{path.name}")
+
+
+def bench_count_qa():
+    """count_qa_pairs.count_qa_pairs_in_folder：一个目录下若干 .json 问答文件"""
+    from count_qa_pairs import count_qa_pairs_in_folder
+    rng = random.Random(SEED)
+    for n in SCALE["qa_records"]:
+        with workdir("bench_count_") as tmp:
+            files = make_qa_folder(tmp, rng, min(64, max(1, n // 100)), n)
+            # 首次统计要扫描全部文件；第二次文件没变，直接查索引
+            for run in ("cold", "warm"):
+                t0 = time.perf_counter()
+                with quiet():
+                    result = count_qa_pairs_in_folder(tmp)
+                report(f"count_qa_pairs_in_folder[{run}, {len(files)} 个文件]", time.perf_counter() - t0,
+                       result["total_pairs"], "条")
+
+
+def bench_record_store():
+    """record_store：打包、随机读单条、顺序读一列，与流式解析 JSON 数组对比"""
+    from dataset_io import iter_records
+    from record_store import RecordStore, pack
+    rng = random.Random(SEED)
+    for n in SCALE["qa_records"]:
+        with workdir("bench_store_") as tmp:
+            src = make_qa_set(tmp / "data.json", rng, n)
+            t0 = time.perf_counter()
+            pack(src, tmp / "data.rstore")
+            report(f"pack[{n}]", time.perf_counter() - t0, n, "条")
+            t0 = time.perf_counter()
+            for _ in iter_records(src):
+                pass
+            report(f"iter_records[.json, {n}]", time.perf_counter() - t0, n, "条")
+            with RecordStore(tmp / "data.rstore") as store:
+                t0 = time.perf_counter()
+                for _ in store:
+                    pass
+                report(f"RecordStore iter[{n}]", time.perf_counter() - t0, n, "条")
+                t0 = time.perf_counter()
+                for _ in store.column("output"):
+                    pass
+                report(f"RecordStore column[{n}]", time.perf_counter() - t0, n, "条")
+                picks = [rng.randrange(n) for _ in range(min(n, 10000))]
+                t0 = time.perf_counter()
+                for i in picks:
+                    store[i]
+                report(f"RecordStore random get[{n}]", time.perf_counter() - t0, len(picks), "条")
+
+
+BENCHMARKS = {
+    "word_to_txt": bench_word_to_txt,
+    "docx_extract": bench_docx_extract,
+    "pdf_to_txt": bench_pdf_to_txt,
+    "read_text": bench_read_text,
+    "text_to_qa": bench_text_to_qa,
+    "qa_policy": bench_qa_policy,
+    "qa_packing": bench_qa_packing,
+    "qa_profiles": bench_qa_profiles,
+    "split": bench_split,
+    "merge": bench_merge,
+    "check": bench_check,
+    "count_qa": bench_count_qa,
+    "record_store": bench_record_store,
+}
+
+
+# ================== 结果保存与回归对比 ==================
+
+def current_version():
+    """git 提交号（工作区有改动时加 -dirty）；不在 git 仓库里时为 unknown"""
+    root = Path(__file__).resolve().parent
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root, capture_output=True, text=True,
+                             check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root, capture_output=True,
+                               text=True).stdout.strip()
+        return rev + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def save_results(results, version, scale, path=BENCH_RESULTS):
+    machine = {"cpus": os.cpu_count(), "python": platform.python_version(), "platform": platform.platform()}
+    ts = time.strftime("%Y-%m-%d %H:%M:%S")
+    with open(path, "a", encoding="utf-8") as f:
+        for r in results:
+            f.write(json.dumps({"ts": ts, "version": version, "scale": scale, **r, **machine}, ensure_ascii=False) + "\n")
+    print(f"💾 已保存 {len(results)} 条结果到 {path}（版本 {version}）")
+
+
+def load_results(path=BENCH_RESULTS):
+    if not Path(path).exists():
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare_results(results, version, scale, baseline=None, path=BENCH_RESULTS):
+    """与基准版本同规模、同条目数的结果比较速率；baseline 为空时取结果文件里最近的另一个版本"""
+    history = [r for r in load_results(path) if r["scale"] == scale and r["version"] != version]
+    if baseline is None:
+        if not history:
+            print("⚠️ 结果文件里没有其他版本可对比")
+            return
+        baseline = history[-1]["version"]
+    base = {}
+    for r in history:
+        if r["version"] == baseline:
+            base[(r["bench"], r["name"], r["items"])] = r  # 同一版本多次运行取最近一次
+    if not base:
+        print(f"⚠️ 没有版本 {baseline} 在 {scale} 规模下的结果")
+        return
+    print(f"\n===== 对比 {baseline} → {version}（{scale}） =====")
+    print(f"{'项目':<44}{'基准 秒':>10}{'本次 秒':>10}{'速率比':>8}")
+    slower = 0
+    for r in results:
+        old = base.get((r["bench"], r["name"], r["items"]))
+        if old is None or not old["rate"] or not r["rate"]:
+            continue
+        ratio = r["rate"] / old["rate"]
+        flag = "⚠️" if ratio < 1 - REGRESSION_TOLERANCE else ("🚀" if ratio > 1 + REGRESSION_TOLERANCE else "")
+        slower += ratio < 1 - REGRESSION_TOLERANCE
+        print(f"{r['name']:<44}{old['seconds']:>10.2f}{r['seconds']:>10.2f}{ratio:>7.2f}x {flag}")
+    print(f"变慢超过 {REGRESSION_TOLERANCE:.0%} 的项目：{slower} 个")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="WWT 问答数据处理性能基准")
+    parser.add_argument("names", nargs="*", metavar="项目", help=f"要运行的项目，不写时全部运行：{'、'.join(BENCHMARKS)}")
+    parser.add_argument("--scale", choices=list(SCALES), default="small", help="合成语料规模")
+    parser.add_argument("--save", action="store_true", help=f"把结果追加到 {BENCH_RESULTS.name}")
+    parser.add_argument("--label", help="结果的版本名，默认为 git 提交号")
+    parser.add_argument("--compare", nargs="?", const="", metavar="版本", help="与指定版本（不写时为最近的另一个版本）对比")
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"未知项目：{'、'.join(unknown)}")
+    SCALE = SCALES[args.scale]
+    version = args.label or current_version()
+    print(f"CPU 核数：{os.cpu_count()}，规模：{args.scale}，版本：{version}")
+    for name in args.names or list(BENCHMARKS):
+        print(f"\n===== {name} =====")
+        _current = name
+        BENCHMARKS[name]()
+    if args.save:
+        save_results(RESULTS, version, args.scale)
+    if args.compare is not None:
+        compare_results(RESULTS, version, args.scale, args.compare or None)
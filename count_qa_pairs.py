@@ -1,84 +1,224 @@
+"""
+统计问答数据集的规模
+- 每个文件的记录数、字节数、问题/答案平均长度与修改时间记在文件夹下的 SQLite 索引（.qa_stats.sqlite）里
+- 再次统计时只重新扫描大小或修改时间变了的文件，删除的文件从索引中去掉；首次统计时多进程并行扫描
+- 之后的总数、按文件夹、按来源（同名文件，即同一源文档在 train/val/test 等不同目录下的输出）汇总都直接查索引
+用法：python count_qa_pairs.py [文件夹] [--recursive] [--by folder|source] [--rebuild]
+"""
+import argparse
 import json
 import os
+import sqlite3
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+from dataset_io import iter_records, JSON_SUFFIXES, NotArrayError
+
 # 设置输出编码为UTF-8
 if sys.platform == 'win32':
     sys.stdout.reconfigure(encoding='utf-8')
 
-def count_qa_pairs_in_folder(folder_path):
+# 索引文件名（放在被统计的文件夹下）
+STATS_INDEX = ".qa_stats.sqlite"
+# 并行扫描的进程数（0 表示 CPU 核数）；待扫描文件少于 PARALLEL_MIN 个时直接在当前进程里扫
+WORKERS = 0
+PARALLEL_MIN = 8
+
+
+def scan_file(path):
+    """
+    流式读一个问答文件，返回 (记录数, 问题总字数, 答案总字数, 错误信息)
+    顶层不是数组的 .json 与原来一样按 1 条（非空对象）或 0 条计
+    """
+    count = q_chars = a_chars = 0
+    try:
+        for record in iter_records(path):
+            count += 1
+            if isinstance(record, dict):
+                q_chars += len(str(record.get("instruction", "")))
+                a_chars += len(str(record.get("output", "")))
+    except NotArrayError:
+        with open(path, 'r', encoding='utf-8') as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError as e:
+                return 0, 0, 0, str(e)
+        return (1 if data else 0), 0, 0, None
+    except Exception as e:
+        return 0, 0, 0, f"{type(e).__name__}: {e}"
+    return count, q_chars, a_chars, None
+
+
+def collect_files(folder, recursive=False):
+    """文件夹下的 .json/.jsonl；递归时跳过以 _ 或 . 开头的子目录（03 的 _rejected 报告、转换中间文件等）"""
+    folder = Path(folder)
+    if not recursive:
+        return sorted(p for p in folder.iterdir() if p.is_file() and p.suffix.lower() in JSON_SUFFIXES)
+    files = []
+    for root, dirs, names in os.walk(folder):
+        dirs[:] = [d for d in dirs if not d.startswith(("_", "."))]
+        files.extend(Path(root) / n for n in names if Path(n).suffix.lower() in JSON_SUFFIXES)
+    return sorted(files)
+
+
+class StatsIndex:
     """
-    统计指定文件夹中所有JSON文件的问答对数
-    
+    一个文件夹的统计索引；路径按相对文件夹记录，整个文件夹移动后索引仍然有效
+    folder：所在子目录（相对路径，根目录为 "."）；source：去掉后缀的文件名
+    """
+
+    def __init__(self, folder, path=None):
+        self.folder = Path(folder)
+        self.path = str(path or self.folder / STATS_INDEX)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY,"
+            " folder TEXT NOT NULL,"
+            " source TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " records INTEGER NOT NULL,"
+            " q_chars INTEGER NOT NULL,"
+            " a_chars INTEGER NOT NULL,"
+            " error TEXT,"
+            " scanned_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_folder ON files(folder)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_source ON files(source)")
+
+    def refresh(self, recursive=False, workers=WORKERS, rebuild=False):
+        """
+        同步索引与磁盘：新文件和变了的文件重新扫描，消失的文件删除
+        返回 {"scanned": 重新扫描数, "unchanged": 沿用数, "removed": 删除数, "seconds": 耗时}
+        """
+        start = time.perf_counter()
+        if rebuild:
+            self.conn.execute("DELETE FROM files")
+        known = {row[0]: (row[1], row[2]) for row in self.conn.execute("SELECT path, size, mtime_ns FROM files")}
+        todo = []
+        present = set()
+        for p in collect_files(self.folder, recursive):
+            rel = p.relative_to(self.folder).as_posix()
+            st = p.stat()
+            present.add(rel)
+            if known.get(rel) != (st.st_size, st.st_mtime_ns):
+                todo.append((p, rel, st))
+        removed = [(rel,) for rel in known if rel not in present]
+
+        paths = [str(p) for p, _, _ in todo]
+        if len(paths) >= PARALLEL_MIN:
+            max_workers = workers if workers and workers > 0 else (os.cpu_count() or 4)
+            with ProcessPoolExecutor(max_workers=max_workers) as ex:
+                results = list(ex.map(scan_file, paths, chunksize=max(1, len(paths) // (max_workers * 4))))
+        else:
+            results = [scan_file(p) for p in paths]
+
+        now = time.time()
+        rows = []
+        for (p, rel, st), (records, q_chars, a_chars, error) in zip(todo, results):
+            parent = Path(rel).parent.as_posix()
+            rows.append((rel, parent, p.stem, st.st_size, st.st_mtime_ns, records, q_chars, a_chars, error, now))
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.conn.executemany("DELETE FROM files WHERE path = ?", removed)
+        return {"scanned": len(todo), "unchanged": len(present) - len(todo), "removed": len(removed),
+                "seconds": time.perf_counter() - start}
+
+    def _summary(self, group=None):
+        cols = ("COUNT(*), COALESCE(SUM(records), 0), COALESCE(SUM(size), 0), COALESCE(SUM(q_chars), 0), "
+                "COALESCE(SUM(a_chars), 0), COALESCE(SUM(error IS NOT NULL), 0)")
+        if group is None:
+            rows = [("",) + self.conn.execute(f"SELECT {cols} FROM files").fetchone()]
+        else:
+            rows = self.conn.execute(f"SELECT {group}, {cols} FROM files GROUP BY {group} ORDER BY {group}").fetchall()
+        return [{
+            "key": key,
+            "files": files,
+            "pairs": records,
+            "bytes": size,
+            "avg_question_chars": q / records if records else 0,
+            "avg_answer_chars": a / records if records else 0,
+            "errors": errors,
+        } for key, files, records, size, q, a, errors in rows]
+
+    def totals(self):
+        return self._summary()[0]
+
+    def by_folder(self):
+        return self._summary("folder")
+
+    def by_source(self):
+        return self._summary("source")
+
+    def file_stats(self):
+        rows = self.conn.execute("SELECT path, records, error FROM files ORDER BY path").fetchall()
+        return [{'filename': path, 'count': records, **({'error': error} if error else {})}
+                for path, records, error in rows]
+
+    def close(self):
+        self.conn.close()
+
+
+def print_breakdown(rows, title):
+    print(f"\n{title}")
+    print(f"{'':<40}{'文件数':>8}{'问答对数':>12}{'MB':>10}{'问题均长':>10}{'答案均长':>10}")
+    for r in rows:
+        print(f"{r['key']:<40}{r['files']:>8}{r['pairs']:>12}{r['bytes'] / 1024 / 1024:>10.2f}"
+              f"{r['avg_question_chars']:>10.1f}{r['avg_answer_chars']:>10.1f}")
+
+
+def count_qa_pairs_in_folder(folder_path, recursive=False, workers=WORKERS, rebuild=False):
+    """
+    统计指定文件夹中所有JSON文件的问答对数（通过统计索引，只重新扫描有变化的文件）
+
     Args:
         folder_path: 文件夹路径
-    
+        recursive: 是否包含子文件夹
+        workers: 首次统计等大量文件需要扫描时的并行进程数
+        rebuild: 丢弃索引全部重新扫描
+
     Returns:
         dict: 包含统计信息的字典
     """
     folder = Path(folder_path)
-    
+
     if not folder.exists():
         print(f"错误：文件夹 {folder_path} 不存在")
         return None
-    
-    total_pairs = 0
-    file_stats = []
-    
-    # 遍历文件夹中的所有JSON文件
-    json_files = list(folder.glob("*.json"))
-    
-    if not json_files:
+
+    index = StatsIndex(folder)
+    try:
+        refreshed = index.refresh(recursive, workers, rebuild)
+        totals = index.totals()
+        file_stats = index.file_stats()
+        by_folder = index.by_folder()
+        by_source = index.by_source()
+    finally:
+        index.close()
+
+    if not file_stats:
         print(f"警告：在 {folder_path} 中未找到JSON文件")
         return None
-    
-    print(f"开始统计 {folder_path} 中的问答对...")
-    print(f"找到 {len(json_files)} 个JSON文件\n")
-    
-    # 统计每个文件的问答对数
-    for json_file in sorted(json_files):
-        try:
-            with open(json_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                
-            # 如果数据是列表，统计列表长度
-            if isinstance(data, list):
-                qa_count = len(data)
-            else:
-                # 如果不是列表，可能是单个对象
-                qa_count = 1 if data else 0
-            
-            total_pairs += qa_count
-            file_stats.append({
-                'filename': json_file.name,
-                'count': qa_count
-            })
-            
-        except json.JSONDecodeError as e:
-            print(f"警告：文件 {json_file.name} JSON解析失败: {e}")
-            file_stats.append({
-                'filename': json_file.name,
-                'count': 0,
-                'error': str(e)
-            })
-        except Exception as e:
-            print(f"警告：读取文件 {json_file.name} 时出错: {e}")
-            file_stats.append({
-                'filename': json_file.name,
-                'count': 0,
-                'error': str(e)
-            })
-    
+
+    print(f"统计 {folder_path} 中的问答对：共 {len(file_stats)} 个文件，重新扫描 {refreshed['scanned']} 个，"
+          f"沿用索引 {refreshed['unchanged']} 个，移除 {refreshed['removed']} 个（{refreshed['seconds']:.2f} 秒）\n")
+    for s in file_stats:
+        if 'error' in s:
+            print(f"警告：文件 {s['filename']} 读取失败: {s['error']}")
+
     # 输出统计结果
     print("=" * 80)
     print("统计结果")
     print("=" * 80)
-    print(f"总文件数: {len(json_files)}")
-    print(f"总问答对数: {total_pairs}")
-    print(f"平均每个文件问答对数: {total_pairs / len(json_files):.2f}")
-    print()
-    
+    print(f"总文件数: {totals['files']}")
+    print(f"总问答对数: {totals['pairs']}")
+    print(f"平均每个文件问答对数: {totals['pairs'] / totals['files']:.2f}")
+    print(f"问题平均长度: {totals['avg_question_chars']:.1f} 字，答案平均长度: {totals['avg_answer_chars']:.1f} 字")
+
     # 找出问答对数最多和最少的文件
     valid_stats = [s for s in file_stats if 'error' not in s]
     if valid_stats:
@@ -87,23 +227,36 @@ def count_qa_pairs_in_folder(folder_path):
         print()
         print(f"问答对数最多的文件: {max_file['count']} 对")
         print(f"问答对数最少的文件: {min_file['count']} 对")
-    
+
     return {
-        'total_files': len(json_files),
-        'total_pairs': total_pairs,
-        'average_pairs': total_pairs / len(json_files) if json_files else 0,
-        'file_stats': file_stats
+        'total_files': totals['files'],
+        'total_pairs': totals['pairs'],
+        'average_pairs': totals['pairs'] / totals['files'] if totals['files'] else 0,
+        'total_bytes': totals['bytes'],
+        'avg_question_chars': totals['avg_question_chars'],
+        'avg_answer_chars': totals['avg_answer_chars'],
+        'file_stats': file_stats,
+        'by_folder': by_folder,
+        'by_source': by_source,
     }
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="统计问答对数量（带增量索引）")
     # paper1240文件夹路径
-    paper1240_path = Path(__file__).parent / "text_to_qa" / "weixiu139"
-    
+    parser.add_argument("folder", nargs="?", default=Path(__file__).parent / "text_to_qa" / "weixiu139")
+    parser.add_argument("--recursive", action="store_true", help="包含子文件夹（跳过 _ 或 . 开头的目录）")
+    parser.add_argument("--by", choices=["folder", "source"], help="按文件夹或按来源文档汇总")
+    parser.add_argument("--rebuild", action="store_true", help="丢弃索引，全部重新扫描")
+    args = parser.parse_args()
+
     # 执行统计
-    result = count_qa_pairs_in_folder(paper1240_path)
-    
+    result = count_qa_pairs_in_folder(args.folder, args.recursive, rebuild=args.rebuild)
+
     if result:
+        if args.by == "folder":
+            print_breakdown(result["by_folder"], "按文件夹")
+        elif args.by == "source":
+            print_breakdown(result['by_source'], "按来源")
         print()
         print("=" * 80)
         print("统计完成！")
-
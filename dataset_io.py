@@ -0,0 +1,242 @@
+"""
+数据集文件读写工具
+- 逐条流式读取 JSON 数组文件或 JSON Lines 文件，内存占用与文件大小无关
+- 逐条流式写出 JSON 数组（与 json.dump(data, f, ensure_ascii=False, indent=2) 逐字节一致）或 JSON Lines
+- 在已有输出末尾追加记录，不重读整个文件
+文件格式由后缀决定：.jsonl 为 JSON Lines，其余按 JSON 数组处理
+"""
+import json
+import os
+from contextlib import contextmanager
+
+JSON_SUFFIXES = (".json", ".jsonl")
+
+_WHITESPACE = " \t\r\n"
+
+
+class NotArrayError(ValueError):
+    """JSON 文件顶层不是数组"""
+
+
+def is_jsonl(path):
+    return str(path).lower().endswith(".jsonl")
+
+
+def dump_record(record):
+    """按 indent=2 数组元素的格式序列化一条记录（整体再缩进 2 格）。"""
+    text = json.dumps(record, ensure_ascii=False, indent=2)
+    return "  " + text.replace("\n", "\n  ")
+
+
+# ================== 读取 ==================
+
+def iter_json_array(f, chunk_size=1 << 16, with_lines=False):
+    """
+    从文本文件对象 f 中逐个解析顶层 JSON 数组的元素，不把整个文件读进内存。
+    with_lines=True 时产出 (元素起始行号, 元素)，行号从 1 开始。
+    顶层不是数组时抛出 NotArrayError，内容损坏时抛出 json.JSONDecodeError（lineno/colno 为全文位置）。
+    """
+    decoder = json.JSONDecoder()
+    buf = f.read(chunk_size)
+    pos = 0
+    eof = not buf
+    base_line = 1    # buf[0] 所在的行号
+    counted = 0      # buf[:counted] 中的换行已计入 lines
+    lines = 0
+
+    def line_at(i):
+        nonlocal counted, lines
+        lines += buf.count("\n", counted, i)
+        counted = i
+        return base_line + lines
+
+    def refill(size):
+        nonlocal buf, pos, eof, base_line, counted, lines
+        more = f.read(size)
+        eof = not more
+        base_line += lines + buf.count("\n", counted, pos)
+        buf, pos, counted, lines = buf[pos:] + more, 0, 0, 0
+
+    def fail(msg, err_pos):
+        line = line_at(err_pos)
+        col = err_pos - (buf.rfind("\n", 0, err_pos) + 1) + 1
+        err = json.JSONDecodeError(msg, buf, err_pos)
+        err.lineno, err.colno = line, col
+        err.args = (f"{msg}: line {line} column {col}",)
+        return err
+
+    def skip_ws():
+        while True:
+            nonlocal pos
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            refill(chunk_size)
+
+    skip_ws()
+    if pos >= len(buf) or buf[pos] != "[":
+        raise NotArrayError("JSON 内容不是数组格式")
+    pos += 1
+    skip_ws()
+    if pos < len(buf) and buf[pos] == "]":
+        return
+    read_size = chunk_size
+    while True:
+        skip_ws()
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+            complete = end < len(buf) or eof  # 恰好解析到缓冲区末尾时可能被截断（例如数字），需要再读一些确认
+        except json.JSONDecodeError as e:
+            if eof:
+                raise fail(e.msg, e.pos) from None
+            complete = False
+        if not complete:
+            refill(read_size)
+            read_size *= 2  # 大对象时成倍加读，避免反复从头解析
+            continue
+        read_size = chunk_size
+        yield (line_at(pos), obj) if with_lines else obj
+        pos = end
+        skip_ws()
+        if pos >= len(buf):
+            raise fail("数组未闭合", pos)
+        if buf[pos] == "]":
+            return
+        if buf[pos] != ",":
+            raise fail("缺少逗号分隔符", pos)
+        pos += 1
+
+
+def iter_jsonl(f):
+    """逐行解析 JSON Lines，空行跳过。"""
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def iter_records(path):
+    """按后缀流式读取一个数据集文件里的全部记录；.rstore 记录库目录也可以直接读。"""
+    if str(path).lower().rstrip("/\\").endswith(".rstore"):
+        from record_store import RecordStore  # record_store 依赖本模块，用到时再导入
+        with RecordStore(path) as store:
+            yield from store
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        if is_jsonl(path):
+            yield from iter_jsonl(f)
+        else:
+            yield from iter_json_array(f)
+
+
+# ================== 写出 ==================
+
+class JsonArrayWriter:
+    """逐条写 JSON 数组，结果与 json.dump(list, f, ensure_ascii=False, indent=2) 一致。"""
+
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def write(self, record):
+        self.f.write(("[\n" if self.count == 0 else ",\n") + dump_record(record))
+        self.count += 1
+
+    def close(self):
+        self.f.write("\n]" if self.count else "[]")
+
+
+class JsonlWriter:
+    """逐条写 JSON Lines，每行一条记录。"""
+
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def write(self, record):
+        self.f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.count += 1
+
+    def close(self):
+        pass
+
+
+@contextmanager
+def open_writer(path):
+    """按后缀打开对应的流式写出器，退出时补全数组结尾。"""
+    with open(path, "w", encoding="utf-8") as f:
+        writer = JsonlWriter(f) if is_jsonl(path) else JsonArrayWriter(f)
+        try:
+            yield writer
+        finally:
+            writer.close()
+
+
+def write_records(path, records):
+    """把 records 写入 path（格式由后缀决定），返回写出条数。"""
+    with open_writer(path) as writer:
+        for record in records:
+            writer.write(record)
+    return writer.count
+
+
+# ================== 追加 ==================
+
+class _JsonArrayAppender:
+    """在已有 JSON 数组的 ] 之前逐条续写，close 时重新补上结尾。"""
+
+    def __init__(self, f, empty):
+        self.f = f
+        self.empty = empty
+        self.count = 0
+
+    def write(self, record):
+        self.f.write((("\n" if self.empty and self.count == 0 else ",\n") + dump_record(record)).encode("utf-8"))
+        self.count += 1
+
+    def close(self):
+        self.f.write(b"\n]" if self.count or not self.empty else b"]")
+        self.f.truncate()
+
+
+@contextmanager
+def open_appender(path):
+    """
+    按后缀打开已有输出的追加写出器，不重读整个文件。
+    JSON 数组的结果与对合并后的整个列表调用 json.dump(..., ensure_ascii=False, indent=2) 逐字节一致；
+    中途出错也会补上结尾，保证文件仍是合法数组。
+    """
+    if is_jsonl(path):
+        with open(path, "a", encoding="utf-8") as f:
+            yield JsonlWriter(f)
+        return
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        tail_start = max(0, end - 4096)
+        f.seek(tail_start)
+        tail = f.read()
+        close = tail.rfind(b"]")
+        if close < 0:
+            raise ValueError(f"不是 JSON 数组文件：{path}")
+        # 跳过 ] 前面的空白，找到上一个有效字符（[ 表示空数组，否则是上一条记录的结尾）
+        prev = close - 1
+        while prev >= 0 and tail[prev:prev + 1] in b" \t\r\n":
+            prev -= 1
+        if prev < 0:
+            raise ValueError(f"不是 JSON 数组文件：{path}")
+        f.seek(tail_start + prev + 1)
+        writer = _JsonArrayAppender(f, empty=tail[prev:prev + 1] == b"[")
+        try:
+            yield writer
+        finally:
+            writer.close()
+
+
+def append_records(path, records):
+    """按后缀把 records 追加到已有输出末尾，返回追加条数。"""
+    with open_appender(path) as writer:
+        for record in records:
+            writer.write(record)
+    return writer.count
@@ -0,0 +1,396 @@
+"""
+大模型后端：把 03 与具体接口解耦，所有后端都是与 dashscope.Generation.call 同签名的可调用对象，
+返回与 dashscope GenerationResponse 同形的 qa_engine.Response，可直接交给 GenerationEngine
+- DashScopeBackend：通义千问 SDK
+- OpenAICompatibleBackend：任意 OpenAI 兼容的 /chat/completions 接口（DashScope 兼容模式、OpenAI、本地 vLLM / llama.cpp 等），
+  http.client 连接池 + keep-alive，避免每个请求重新握手；429/5xx 原样返回状态码，由引擎分类重试
+- BatchBackend：离线批量任务。调用时命中已取回的结果就直接返回，否则把请求写进待提交的 JSONL 并抛出 BatchDeferred；
+  一轮跑完后 submit() 打包上传（OpenAI 兼容的 /files + /batches 接口），下次运行先 collect() 取回已完成的批次。
+  整夜跑语料时不占实时配额，批量接口通常也比实时调用便宜
+- FakeGeneration / FakeBatchClient：进程内模拟，离线测试用
+用法：make_backend(name, **options)，name 为 "dashscope" / "openai" / "batch" / "fake" / "fake-batch"
+"""
+import hashlib
+import http.client
+import json
+import queue
+import threading
+import time
+import urllib.parse
+import uuid
+from pathlib import Path
+
+from qa_engine import Response, FakeGeneration, GenerationError
+
+# 只对 dashscope SDK 有意义的参数，发往 OpenAI 兼容接口时去掉
+DASHSCOPE_ONLY = {"result_format", "incremental_output"}
+# 批量接口单个文件的请求数上限（DashScope / OpenAI 均为 5 万行）
+BATCH_MAX_REQUESTS = 50000
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_WINDOW = "24h"
+# 批次的终态
+BATCH_DONE = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchDeferred(GenerationError):
+    """请求已加入（或已在）批量任务，结果要等批次完成后重跑时取回"""
+
+
+# ================== DashScope SDK ==================
+
+class DashScopeBackend:
+    def __init__(self, api_key=None):
+        import dashscope  # 只有用到这个后端时才需要安装 SDK
+        self.generation = dashscope.Generation
+        self.api_key = api_key
+
+    def __call__(self, **kwargs):
+        if self.api_key:
+            kwargs.setdefault("api_key", self.api_key)
+        return self.generation.call(**kwargs)
+
+
+# ================== OpenAI 兼容接口 ==================
+
+class ConnectionPool:
+    """
+    同一主机的 http.client 长连接池：空闲连接放回 LIFO 队列复用，最多保留 size 个。
+    复用的连接可能已被服务端按 keep-alive 超时关闭，此时换新连接重发一次。
+    """
+
+    def __init__(self, base_url, size=8, timeout=120):
+        url = urllib.parse.urlsplit(base_url)
+        self.https = url.scheme == "https"
+        self.host = url.hostname
+        self.port = url.port
+        self.prefix = url.path.rstrip("/")
+        self.timeout = timeout
+        self.idle = queue.LifoQueue(maxsize=size)
+        self.opened = 0
+
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        self.opened += 1
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method, path, body=None, headers=None):
+        """发送请求并读完响应体，返回 (状态码, 响应字节)；网络错误统一抛 ConnectionError（引擎会重试）"""
+        for attempt in range(2):
+            try:
+                conn, reused = self.idle.get_nowait(), True
+            except queue.Empty:
+                conn, reused = self._connect(), False
+            try:
+                conn.request(method, self.prefix + path, body=body, headers=headers or {})
+                resp = conn.getresponse()
+                data = resp.read()
+            except (ConnectionError, http.client.HTTPException) as e:
+                conn.close()
+                if reused and attempt == 0:
+                    continue  # 空闲连接已失效，换新连接重发
+                raise e if isinstance(e, OSError) else ConnectionError(f"{type(e).__name__}: {e}")
+            except BaseException:
+                conn.close()
+                raise
+            if resp.will_close:
+                conn.close()
+            else:
+                try:
+                    self.idle.put_nowait(conn)
+                except queue.Full:
+                    conn.close()
+            return resp.status, data
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def to_response(status, payload):
+    """把 OpenAI 格式的响应（或错误）转换成 dashscope 同形的 Response"""
+    if status != 200 or "choices" not in payload:
+        error = payload.get("error") or {}
+        if not isinstance(error, dict):
+            error = {"message": str(error)}
+        return Response(status_code=status, code=error.get("code") or error.get("type") or "",
+                        message=error.get("message") or payload.get("message", ""), output=None)
+    usage = payload.get("usage") or {}
+    return Response(
+        status_code=200,
+        code="",
+        message="",
+        output={"choices": [{"finish_reason": c.get("finish_reason"), "message": c.get("message", {})}
+                            for c in payload["choices"]]},
+        usage={"input_tokens": usage.get("prompt_tokens", 0), "output_tokens": usage.get("completion_tokens", 0)},
+    )
+
+
+def to_openai_body(response):
+    """反方向：dashscope 同形的 Response 转成 OpenAI 的 chat.completion（模拟批量接口用）"""
+    usage = response.get("usage") or {}
+    return {
+        "object": "chat.completion",
+        "choices": [{"index": i, "finish_reason": c.get("finish_reason"), "message": c.get("message")}
+                    for i, c in enumerate(response["output"]["choices"])],
+        "usage": {"prompt_tokens": usage.get("input_tokens", 0), "completion_tokens": usage.get("output_tokens", 0)},
+    }
+
+
+def chat_body(model, messages, **params):
+    """与 dashscope.Generation.call 同样的参数 → /chat/completions 的请求体"""
+    body = {"model": model, "messages": messages}
+    body.update((k, v) for k, v in params.items() if k not in DASHSCOPE_ONLY and v is not None)
+    return body
+
+
+class OpenAICompatibleBackend:
+    """
+    base_url：接口根地址，例如 https://dashscope.aliyuncs.com/compatible-mode/v1、http://127.0.0.1:8000/v1
+    pool_size：保留的空闲长连接数，一般与 GenerationEngine 的并发数相同
+    """
+
+    def __init__(self, base_url, api_key=None, timeout=120, pool_size=8):
+        self.pool = ConnectionPool(base_url, pool_size, timeout)
+        self.headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        if api_key:
+            self.headers["Authorization"] = f"Bearer {api_key}"
+
+    def __call__(self, model=None, messages=None, **params):
+        data = json.dumps(chat_body(model, messages, **params), ensure_ascii=False).encode("utf-8")
+        status, raw = self.pool.request("POST", "/chat/completions", data, self.headers)
+        return to_response(status, _loads(raw))
+
+    # ---------- 批量接口（/files + /batches） ----------
+
+    def _json(self, method, path, payload=None):
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        status, raw = self.pool.request(method, path, data, self.headers)
+        body = _loads(raw)
+        if status != 200:
+            raise GenerationError(f"{method} {path} 失败：status={status} {body.get('error') or body}")
+        return body
+
+    def upload_file(self, path, purpose="batch"):
+        """multipart 上传 JSONL 文件，返回文件 id"""
+        boundary = uuid.uuid4().hex
+        head = (f'--{boundary}\r\nContent-Disposition: form-data; name="purpose"\r\n\r\n{purpose}\r\n'
+                f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{Path(path).name}"\r\n'
+                f'Content-Type: application/jsonl\r\n\r\n').encode("utf-8")
+        data = head + Path(path).read_bytes() + f"\r\n--{boundary}--\r\n".encode("utf-8")
+        headers = dict(self.headers, **{"Content-Type": f"multipart/form-data; boundary={boundary}"})
+        status, raw = self.pool.request("POST", "/files", data, headers)
+        body = _loads(raw)
+        if status != 200:
+            raise GenerationError(f"上传 {Path(path).name} 失败：status={status} {body.get('error') or body}")
+        return body["id"]
+
+    def create_batch(self, file_id, endpoint=BATCH_ENDPOINT, window=BATCH_WINDOW):
+        return self._json("POST", "/batches", {"input_file_id": file_id, "endpoint": endpoint,
+                                               "completion_window": window})
+
+    def get_batch(self, batch_id):
+        return self._json("GET", f"/batches/{batch_id}")
+
+    def download_file(self, file_id):
+        status, raw = self.pool.request("GET", f"/files/{file_id}/content", headers=self.headers)
+        if status != 200:
+            raise GenerationError(f"下载结果文件 {file_id} 失败：status={status}")
+        return raw
+
+    def close(self):
+        self.pool.close()
+
+
+def _loads(raw):
+    try:
+        body = json.loads(raw or b"{}")
+    except ValueError:
+        return {"message": raw[:200].decode("utf-8", "replace")}
+    return body if isinstance(body, dict) else {"message": str(body)}
+
+
+# ================== 离线批量任务 ==================
+
+def request_key(body):
+    """请求体的稳定哈希，作为批量任务里的 custom_id；同样的请求重跑时能对上已取回的结果"""
+    payload = json.dumps(body, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+class BatchBackend:
+    """
+    workdir 下的文件：
+    pending.jsonl 本轮新排队、尚未提交的请求；submitted/<批次>.jsonl 已提交的请求；
+    results/<批次>.jsonl 取回的结果；batches.json 批次清单（id、状态、请求数、是否已取回）
+    client：提供 upload_file / create_batch / get_batch / download_file 的对象（OpenAICompatibleBackend 或 FakeBatchClient）
+    """
+
+    def __init__(self, workdir, client):
+        self.workdir = Path(workdir)
+        self.client = client
+        (self.workdir / "submitted").mkdir(parents=True, exist_ok=True)
+        (self.workdir / "results").mkdir(exist_ok=True)
+        self.pending_path = self.workdir / "pending.jsonl"
+        self.list_path = self.workdir / "batches.json"
+        self.batches = json.loads(self.list_path.read_text("utf-8")) if self.list_path.exists() else []
+        self.lock = threading.Lock()
+        self.results = {}
+        self.waiting = set()  # 已排队或已提交、还没有结果的请求
+        self.queued = 0
+        for path in sorted((self.workdir / "results").glob("*.jsonl")):
+            self._load_results(path)
+        for batch in self.batches:
+            if not batch.get("collected"):
+                self.waiting.update(self._keys(self.workdir / "submitted" / f"{batch['id']}.jsonl"))
+        self.waiting.update(self._keys(self.pending_path))
+
+    @staticmethod
+    def _keys(path):
+        if not path.exists():
+            return set()
+        with open(path, "r", encoding="utf-8") as f:
+            return {json.loads(line)["custom_id"] for line in f if line.strip()}
+
+    def _load_results(self, path):
+        """只收成功的结果；失败的请求不登记，重跑时会重新排队"""
+        failed = 0
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                resp = item.get("response") or {}
+                if resp.get("status_code") == 200:
+                    self.results[item["custom_id"]] = to_response(200, resp.get("body") or {})
+                else:
+                    failed += 1
+        return failed
+
+    def __call__(self, model=None, messages=None, **params):
+        body = chat_body(model, messages, **params)
+        key = request_key(body)
+        with self.lock:
+            response = self.results.get(key)
+            if response is not None:
+                return response
+            if key not in self.waiting:
+                self.waiting.add(key)
+                self.queued += 1
+                with open(self.pending_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"custom_id": key, "method": "POST", "url": BATCH_ENDPOINT, "body": body},
+                                       ensure_ascii=False) + "\n")
+        raise BatchDeferred("已加入批量任务，等待批次完成")
+
+    def _save(self):
+        tmp = self.list_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.batches, ensure_ascii=False, indent=2), encoding="utf-8")
+        tmp.replace(self.list_path)
+
+    def submit(self, max_requests=BATCH_MAX_REQUESTS):
+        """把 pending.jsonl 按 max_requests 行一份上传并创建批次，返回新批次 id 列表"""
+        if not self.pending_path.exists():
+            return []
+        with open(self.pending_path, "r", encoding="utf-8") as f:
+            lines = [line for line in f if line.strip()]
+        created = []
+        for start in range(0, len(lines), max_requests):
+            part = self.workdir / "submitting.jsonl"
+            part.write_text("".join(lines[start:start + max_requests]), encoding="utf-8")
+            batch = self.client.create_batch(self.client.upload_file(part))
+            part.replace(self.workdir / "submitted" / f"{batch['id']}.jsonl")
+            self.batches.append({"id": batch["id"], "status": batch.get("status"), "requests": len(lines[start:start + max_requests]),
+                                 "created": time.strftime("%Y-%m-%d %H:%M:%S"), "collected": False})
+            self._save()
+            created.append(batch["id"])
+        self.pending_path.unlink()
+        return created
+
+    def collect(self):
+        """查询未取回的批次，已完成的下载结果；返回 (取回的批次数, 仍在进行的批次数)"""
+        done = running = 0
+        for batch in self.batches:
+            if batch.get("collected"):
+                continue
+            info = self.client.get_batch(batch["id"])
+            batch["status"] = info.get("status")
+            if batch["status"] not in BATCH_DONE:
+                running += 1
+                continue
+            path = self.workdir / "results" / f"{batch['id']}.jsonl"
+            with open(path, "wb") as f:
+                for field in ("output_file_id", "error_file_id"):
+                    if info.get(field):
+                        f.write(self.client.download_file(info[field]).rstrip(b"\n") + b"\n")
+            with self.lock:
+                batch["failed"] = self._load_results(path)
+                self.waiting.difference_update(self._keys(self.workdir / "submitted" / f"{batch['id']}.jsonl"))
+            batch["collected"] = True
+            done += 1
+        self._save()
+        return done, running
+
+
+class FakeBatchClient:
+    """进程内模拟的批量接口：创建批次时立即用 FakeGeneration 逐条生成，结果存在内存里"""
+
+    def __init__(self, generation=None, delay_polls=0):
+        self.generation = generation or FakeGeneration(latency=0)
+        self.delay_polls = delay_polls  # 前几次查询返回 in_progress
+        self.files = {}
+        self.batches = {}
+
+    def upload_file(self, path, purpose="batch"):
+        file_id = f"file-{uuid.uuid4().hex[:12]}"
+        self.files[file_id] = Path(path).read_bytes()
+        return file_id
+
+    def create_batch(self, file_id, endpoint=BATCH_ENDPOINT, window=BATCH_WINDOW):
+        lines = []
+        for line in self.files[file_id].decode("utf-8").splitlines():
+            item = json.loads(line)
+            body = dict(item["body"])
+            resp = self.generation(model=body.pop("model"), messages=body.pop("messages"), **body)
+            if resp.status_code == 200:
+                out = {"status_code": 200, "body": to_openai_body(resp)}
+            else:
+                out = {"status_code": resp.status_code, "body": {"error": {"code": resp.code, "message": resp.message}}}
+            lines.append(json.dumps({"custom_id": item["custom_id"], "response": out}, ensure_ascii=False))
+        output_id = f"file-{uuid.uuid4().hex[:12]}"
+        self.files[output_id] = "\n".join(lines).encode("utf-8")
+        batch = {"id": f"batch-{uuid.uuid4().hex[:12]}", "status": "in_progress", "output_file_id": output_id,
+                 "polls": 0}
+        self.batches[batch["id"]] = batch
+        return dict(batch)
+
+    def get_batch(self, batch_id):
+        batch = self.batches[batch_id]
+        batch["polls"] += 1
+        if batch["polls"] > self.delay_polls:
+            batch["status"] = "completed"
+        return dict(batch)
+
+    def download_file(self, file_id):
+        return self.files[file_id]
+
+
+# ================== 工厂 ==================
+
+def make_backend(name, **options):
+    """按名字创建后端；options 即各后端构造参数（batch 另需 workdir，其余参数传给 OpenAI 兼容客户端）"""
+    if name == "dashscope":
+        return DashScopeBackend(**options)
+    if name == "openai":
+        return OpenAICompatibleBackend(**options)
+    if name == "batch":
+        options = dict(options)
+        workdir = options.pop("workdir")
+        return BatchBackend(workdir, OpenAICompatibleBackend(**options))
+    if name == "fake":
+        return FakeGeneration(**options)
+    if name == "fake-batch":
+        options = dict(options)
+        return BatchBackend(options.pop("workdir"), FakeBatchClient(FakeGeneration(**options)))
+    raise ValueError(f"未知的后端：{name}")
@@ -0,0 +1,488 @@
+"""
+流水线统一入口：python -m pipeline <命令> [-c 配置文件]
+- init：写出一份默认配置（JSON），改好各目录与并发后再 run
+- run：按配置把各阶段组成有向无环图（DAG）流式运行：
+      PDF ─ pdf_to_txt ──┐
+      .doc ─ doc_to_docx ─ word_to_txt ─┼─ text_to_qa ─ split ─ check
+      .docx ─────────────┘
+  一个文档一转出 txt 就立刻进入问答生成，不用等整批转换结束；问答全部生成后再统一做哈希划分（含近似去重）与格式检查
+  split 阶段即 04 的 hash 方式：直接写出 train/val/test，并用 qa_dedup 去掉近似重复（评估集优先），代替 05 的合并与去重
+  每个阶段有自己的并发预算（workers）：抽取类 CPU 密集阶段用进程池，调用 API 的生成阶段用线程池
+  --watch 秒数：跑完一轮后每隔若干秒重新扫描输入目录，新文档到来后很快就能出问答
+- 各阶段脚本仍可单独运行；这里只是按配置替换它们模块顶部的常量（路径、参数），再调用其中的函数
+- 配置里每个阶段的 settings 会原样设置到对应模块的大写常量上，例如 {"MODEL": "qwen-plus"}
+- 清单（pipeline_manifest）与指标日志（pipeline_metrics）全流程共用一份，没变化的文档直接跳过
+"""
+import argparse
+import copy
+import importlib
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+
+from pipeline_manifest import Manifest
+from pipeline_metrics import Metrics
+
+DEFAULT_CONFIG_PATH = "pipeline.json"
+
+DEFAULT_CONFIG = {
+    # 下面相对路径的根目录；本身为相对路径时相对配置文件所在目录
+    "root": ".",
+    "paths": {
+        "pdf": "pdf",                  # 放 PDF 的目录
+        "word": "word",                # 放 .doc/.docx 的目录
+        "txt": "wordtxt",              # 01/02 的输出、03 的输入
+        "qa": "text_to_qa",            # 03 的输出、04 的输入
+        "dataset": "dataset",          # 04 直接写出的 train/val/test
+    },
+    "manifest": "pipeline_manifest.json",
+    "metrics": "pipeline_metrics.jsonl",
+    "stages": {
+        "pdf_to_txt": {"enabled": True, "workers": 2, "settings": {}},
+        "doc_to_docx": {"enabled": True, "settings": {"SOFFICE_WORKERS": 2}},
+        "word_to_txt": {"enabled": True, "workers": 2, "settings": {"EXTRACTOR": "lxml"}},
+        # workers：同时在生成的文档数；concurrency：同时在途的 API 请求数（所有文档共用）
+        "text_to_qa": {"enabled": True, "workers": 4, "concurrency": 8, "settings": {}},
+        # DEDUP：近似去重，索引默认放在 dataset 目录下
+        "split": {"enabled": True, "settings": {"GROUP_BY": "record", "OUTPUT_SUFFIX": ".json", "DEDUP": True}},
+        "check": {"enabled": True, "workers": 0, "settings": {}},
+    },
+}
+
+# 阶段 → 实现它的模块
+MODULES = {
+    "pdf_to_txt": "01pdf_to_word",
+    "doc_to_docx": "02word_to_txt",
+    "word_to_txt": "02word_to_txt",
+    "text_to_qa": "03text_to_qa",
+    "split": "04dataset_split",
+    "check": "07check_dataset",
+}
+
+
+# ================== 配置 ==================
+
+def _merge(base, override):
+    out = copy.deepcopy(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(out.get(key), dict):
+            out[key] = _merge(out[key], value)
+        else:
+            out[key] = value
+    return out
+
+
+def load_config(path):
+    """读取配置并与默认值合并，路径统一解析成绝对路径"""
+    path = Path(path)
+    config = _merge(DEFAULT_CONFIG, json.loads(path.read_text(encoding="utf-8")))
+    root = Path(config["root"])
+    if not root.is_absolute():
+        root = path.resolve().parent / root
+    config["paths"] = {k: root / v for k, v in config["paths"].items()}
+    for key in ("manifest", "metrics"):
+        config[key] = root / config[key] if config[key] else None
+    return config
+
+
+def apply_settings(module, settings):
+    """把配置里的常量设置到模块上；只接受模块里已有的大写常量，拼错时直接报错"""
+    for key, value in (settings or {}).items():
+        if not key.isupper() or not hasattr(module, key):
+            raise KeyError(f"{module.__name__} 没有常量 {key}")
+        setattr(module, key, value)
+
+
+def _call(module_name, func_name, settings, *args):
+    """在（可能是新启动的）子进程里导入阶段模块、应用配置后调用其中的函数"""
+    module = importlib.import_module(module_name)
+    apply_settings(module, settings)
+    return getattr(module, func_name)(*args)
+
+
+# ================== DAG 调度 ==================
+
+class Stage:
+    """
+    DAG 中的一个阶段
+    run(item)：在该阶段的执行器里处理单个条目（进程池时必须是可 pickle 的顶层函数调用）
+    finish(item, result, error, seconds)：在调度线程里收尾（记清单、指标、打印），返回交给下游的条目列表
+    reduce=True：等上游全部结束后，把收到的全部条目作为一个列表调用一次 run；always=True 时没有条目也运行
+    """
+
+    def __init__(self, name, run, finish, workers=1, executor="thread", reduce=False, always=False):
+        self.name = name
+        self.run = run
+        self.finish = finish
+        self.workers = max(1, workers or 1)
+        self.executor = executor
+        self.reduce = reduce
+        self.always = always
+        self.upstream = []
+        self.downstream = []
+        self.queue = deque()
+        self.seen = set()
+        self.items = []
+        self.inflight = 0
+        self.done = False
+        self.count = 0
+
+    def push(self, item):
+        key = str(item)
+        if key in self.seen:
+            return
+        self.seen.add(key)
+        if self.reduce:
+            self.items.append(item)
+        else:
+            self.queue.append(item)
+
+    def upstream_done(self):
+        return all(s.done for s in self.upstream)
+
+
+class Dag:
+    def __init__(self):
+        self.stages = {}
+        self.order = []
+
+    def add(self, stage, after=()):
+        for name in after:
+            if name in self.stages:
+                self.stages[name].downstream.append(stage)
+                stage.upstream.append(self.stages[name])
+        self.stages[stage.name] = stage
+        self.order.append(stage)
+        return stage
+
+    def run(self, sources):
+        """sources：{阶段名: [初始条目]}；各阶段按自己的并发预算流式处理，直到全部结束"""
+        for name, items in sources.items():
+            if name in self.stages:
+                for item in items:
+                    self.stages[name].push(item)
+        executors = {}
+        for stage in self.order:
+            pool = ProcessPoolExecutor if stage.executor == "process" else ThreadPoolExecutor
+            executors[stage.name] = pool(max_workers=stage.workers)
+        futures = {}
+        try:
+            while True:
+                # 按拓扑顺序调度，一轮之内上游的结束状态就能传到下游
+                for stage in self.order:
+                    if stage.done:
+                        continue
+                    ex = executors[stage.name]
+                    if stage.reduce:
+                        if stage.inflight == 0 and stage.upstream_done():
+                            if stage.items or stage.always:
+                                futures[ex.submit(stage.run, list(stage.items))] = (stage, stage.items, time.perf_counter())
+                                stage.inflight = 1
+                                stage.items = []
+                            else:
+                                stage.done = True
+                        continue
+                    while stage.queue and stage.inflight < stage.workers:
+                        item = stage.queue.popleft()
+                        futures[ex.submit(stage.run, item)] = (stage, item, time.perf_counter())
+                        stage.inflight += 1
+                    if not stage.queue and stage.inflight == 0 and stage.upstream_done():
+                        stage.done = True
+                if not futures:
+                    break
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    stage, item, started = futures.pop(fut)
+                    stage.inflight -= 1
+                    stage.count += 1
+                    try:
+                        result, error = fut.result(), None
+                    except Exception as e:
+                        result, error = None, e
+                    seconds = time.perf_counter() - started
+                    outputs = stage.finish(item, result, error, seconds)
+                    if stage.reduce:
+                        stage.done = not stage.items
+                    for out in outputs or []:
+                        for down in stage.downstream:
+                            down.push(out)
+        finally:
+            for ex in executors.values():
+                ex.shutdown(wait=True)
+
+
+# ================== 阶段定义 ==================
+
+class Pipeline:
+    def __init__(self, config):
+        self.config = config
+        self.paths = config["paths"]
+        self.stage_config = config["stages"]
+        self.manifest = Manifest(config["manifest"]) if config["manifest"] else Manifest()
+        self.metrics = Metrics(config["metrics"])
+        self.modules = {}
+        for name, module_name in MODULES.items():
+            if self.enabled(name):
+                module = importlib.import_module(module_name)
+                apply_settings(module, self.settings(name))
+                self.modules[name] = module
+        self._configure_paths()
+
+    def enabled(self, name):
+        return self.stage_config.get(name, {}).get("enabled", False)
+
+    def settings(self, name):
+        return self.stage_config.get(name, {}).get("settings", {})
+
+    def workers(self, name):
+        return self.stage_config.get(name, {}).get("workers") or os.cpu_count() or 1
+
+    def _configure_paths(self):
+        """各阶段模块里与目录有关的常量统一改成配置里的目录"""
+        qa = self.modules.get("text_to_qa")
+        if qa is not None:
+            settings = self.settings("text_to_qa")
+            qa.OUTPUT_DIR = self.paths["qa"]
+            if "CACHE_PATH" not in settings:
+                qa.CACHE_PATH = self.paths["qa"] / ".qa_cache.sqlite"
+            if "REJECTED_DIR" not in settings:
+                qa.REJECTED_DIR = self.paths["qa"] / "_rejected"
+        split = self.modules.get("split")
+        if split is not None:
+            split.SPLIT_MODE = "hash"
+            split.INPUT_DIR = str(self.paths["qa"])
+            split.MERGED_DIR = str(self.paths["dataset"])
+            if "DEDUP_INDEX" not in self.settings("split"):
+                split.DEDUP_INDEX = str(self.paths["dataset"] / ".dedup_index.sqlite")
+
+    # ---------- 扫描输入 ----------
+
+    def scan(self):
+        """扫描输入目录，返回 {阶段名: [条目]}；没有变化的文档不再处理，其 txt 直接交给 text_to_qa"""
+        sources = {"pdf_to_txt": [], "doc_to_docx": [], "word_to_txt": [], "text_to_qa": []}
+        produced = set()
+        txt_root = self.paths["txt"]
+        if self.enabled("pdf_to_txt") and self.paths["pdf"].exists():
+            pdf = self.modules["pdf_to_txt"]
+            for src, dst in pdf._collect_pdfs(str(self.paths["pdf"]), str(txt_root), ".txt"):
+                produced.add(os.path.normpath(dst))
+                if self.manifest.is_fresh(pdf.TXT_STAGE, src, [dst]):
+                    sources["text_to_qa"].append(Path(dst))
+                else:
+                    sources["pdf_to_txt"].append((src, dst))
+        if self.enabled("word_to_txt") and self.paths["word"].exists():
+            word = self.modules["word_to_txt"]
+            for src in word.collect_inputs(self.paths["word"]):
+                dst = word.map_dst(src, self.paths["word"], txt_root)
+                produced.add(os.path.normpath(dst))
+                if self.manifest.is_fresh(word.STAGE, src, word.outputs_for(dst)):
+                    sources["text_to_qa"].append(dst)
+                elif src.suffix.lower() == ".doc" and self.enabled("doc_to_docx"):
+                    sources["doc_to_docx"].append((src, dst))
+                else:
+                    sources["word_to_txt"].append((src, dst, src))
+        # txt 目录里其他来源的文件（手工放入的等）直接进入问答生成
+        if txt_root.exists():
+            sources["text_to_qa"].extend(p for p in txt_root.rglob("*.txt") if os.path.normpath(p) not in produced)
+        return sources
+
+    # ---------- 各阶段的收尾 ----------
+
+    def _file_event(self, stage, src, dst, error, seconds, **fields):
+        self.metrics.event(stage, "file", path=str(src), seconds=seconds, ok=error is None,
+                           bytes_in=os.path.getsize(src) if os.path.exists(src) else 0,
+                           bytes_out=os.path.getsize(dst) if error is None and os.path.exists(dst) else 0,
+                           **fields, **({"error": str(error) or type(error).__name__} if error else {}))
+
+    def _finish_pdf(self, item, result, error, seconds):
+        src, dst = item
+        stage = self.modules["pdf_to_txt"].TXT_STAGE
+        self._file_event(stage, src, dst, error, seconds, **({"pages": result[0], "records": result[1]} if result else {}))
+        if error is not None:
+            print(f"❌ [pdf_to_txt] {src}：{error}")
+            return []
+        self.manifest.record(stage, src, [dst])
+        print(f"✅ [pdf_to_txt] {src} → {dst}")
+        return [Path(dst)]
+
+    def _finish_docs(self, items, result, error, seconds):
+        """LibreOffice 批量转换完成：转好的 .docx 交给 word_to_txt，失败的记一条事件"""
+        outputs = []
+        for src, dst in items:
+            got = error if error is not None else result.get(src)
+            if isinstance(got, Exception) or got is None:
+                self._file_event(self.modules["word_to_txt"].STAGE, src, dst, got or RuntimeError("未被转换"), seconds)
+                print(f"❌ [doc_to_docx] {src}：{got}")
+            else:
+                outputs.append((got, dst, src))
+        return outputs
+
+    def _finish_word(self, item, result, error, seconds):
+        src, dst, origin = item
+        stage = self.modules["word_to_txt"].STAGE
+        self._file_event(stage, origin, dst, error, seconds)
+        if error is not None:
+            print(f"❌ [word_to_txt] {origin}：{error}")
+            return []
+        self.manifest.record(stage, origin, self.modules["word_to_txt"].outputs_for(dst))
+        print(f"✅ [word_to_txt] {origin} → {dst}")
+        return [dst]
+
+    def _finish_qa(self, item, result, error, seconds):
+        qa = self.modules["text_to_qa"]
+        if isinstance(error, qa.BatchDeferred):
+            self.deferred += 1
+            return []
+        if error is not None:
+            print(f"❌ [text_to_qa] {item.name}：{error}")
+            return []
+        out = qa.OUTPUT_DIR / f"{qa.output_stem(item, self.paths['txt'])}{qa.OUTPUT_SUFFIX}"
+        return [out] if out.exists() else []
+
+    def _finish_split(self, items, result, error, seconds):
+        if error is not None:
+            print(f"❌ [split] {error}")
+            return []
+        return result
+
+    def _finish_check(self, items, result, error, seconds):
+        if error is not None:
+            print(f"❌ [check] {error}")
+            return []
+        for path, report in result.items():
+            self.modules["check"].print_report(path, report)
+        return []
+
+    # ---------- 组装与运行 ----------
+
+    def _split(self, items):
+        split = self.modules["split"]
+        files = sorted(p for p in self.paths["qa"].iterdir() if p.suffix.lower() in split.JSON_SUFFIXES) \
+            if self.paths["qa"].exists() else []
+        if not files:
+            print("⚠️ [split] 没有问答文件")
+            return []
+        os.makedirs(split.MERGED_DIR, exist_ok=True)
+        dedup = split.DedupIndex(split.DEDUP_INDEX) if split.DEDUP else None
+        try:
+            split.hash_split(files, self.manifest, self.metrics, dedup)
+        finally:
+            if dedup is not None:
+                dedup.close()
+        return [Path(split.MERGED_DIR) / f"{name}{split.OUTPUT_SUFFIX}" for name in split.SPLITS]
+
+    def build(self, engine=None, cache=None):
+        dag = Dag()
+        if self.enabled("pdf_to_txt"):
+            dag.add(Stage("pdf_to_txt", _Bound("01pdf_to_word", "convert_pdf_to_txt", self.settings("pdf_to_txt")),
+                          self._finish_pdf, self.workers("pdf_to_txt"), "process"))
+        if self.enabled("word_to_txt"):
+            if self.enabled("doc_to_docx"):
+                word = self.modules["doc_to_docx"]
+
+                def convert_docs(items):
+                    pool = word.SofficePool(word.SOFFICE_WORKERS, word.SOFFICE_BATCH, word.SOFFICE_TIMEOUT)
+                    try:
+                        return pool.convert_all([src for src, _ in items])
+                    finally:
+                        pool.close()
+
+                dag.add(Stage("doc_to_docx", convert_docs, self._finish_docs, reduce=True))
+            dag.add(Stage("word_to_txt", _Bound("02word_to_txt", "convert_one", self.settings("word_to_txt")),
+                          self._finish_word, self.workers("word_to_txt"), "process"), after=["doc_to_docx"])
+        if self.enabled("text_to_qa"):
+            qa = self.modules["text_to_qa"]
+            dag.add(Stage("text_to_qa", lambda p: qa.process_file(p, engine, cache, self.manifest, self.metrics,
+                                                                     root=self.paths["txt"]),
+                          self._finish_qa, self.workers("text_to_qa")), after=["pdf_to_txt", "word_to_txt"])
+        if self.enabled("split"):
+            dag.add(Stage("split", self._split, self._finish_split, reduce=True, always=True), after=["text_to_qa"])
+        if self.enabled("check"):
+            check = self.modules["check"]
+            workers = self.stage_config["check"].get("workers", 0)
+            dag.add(Stage("check", lambda paths: check.validate_files([p for p in paths if p.exists()], workers,
+                                                                      self.metrics),
+                          self._finish_check, reduce=True), after=["split"])
+        return dag
+
+    def run_once(self):
+        started = time.perf_counter()
+        self.deferred = 0
+        sources = self.scan()
+        print(f"🔎 扫描：PDF {len(sources['pdf_to_txt'])} 个、.doc {len(sources['doc_to_docx'])} 个、"
+              f".docx {len(sources['word_to_txt'])} 个待转换，txt {len(sources['text_to_qa'])} 个待检查")
+        engine = cache = None
+        qa = self.modules.get("text_to_qa")
+        if qa is not None:
+            engine, cache = qa.open_generation(self.metrics, self.stage_config["text_to_qa"].get("concurrency",
+                                                                                                 qa.CONCURRENCY))
+        dag = self.build(engine, cache)
+        try:
+            dag.run(sources)
+        finally:
+            if qa is not None:
+                qa.close_generation(engine, cache, self.deferred)
+            self.manifest.save()
+        counts = "，".join(f"{s.name} {s.count}" for s in dag.order)
+        print(f"🏁 本轮完成，用时 {time.perf_counter() - started:.1f} 秒（{counts}）")
+
+    def close(self):
+        self.metrics.print_summary()
+        self.metrics.close()
+
+
+class _Bound:
+    """可 pickle 的“模块.函数 + 配置”调用，供进程池阶段使用；条目为元组时取前 arity 个作为参数"""
+
+    def __init__(self, module_name, func_name, settings, arity=2):
+        self.module_name = module_name
+        self.func_name = func_name
+        self.settings = settings
+        self.arity = arity
+
+    def __call__(self, item):
+        return _call(self.module_name, self.func_name, self.settings, *item[:self.arity])
+
+
+# ================== 命令行 ==================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pipeline", description="WWT 问答数据处理流水线")
+    sub = parser.add_subparsers(dest="command", required=True)
+    init = sub.add_parser("init", help="写出默认配置")
+    init.add_argument("-c", "--config", default=DEFAULT_CONFIG_PATH)
+    run = sub.add_parser("run", help="按配置流式运行全部阶段")
+    run.add_argument("-c", "--config", default=DEFAULT_CONFIG_PATH)
+    run.add_argument("--watch", type=float, default=0, help="每隔多少秒重新扫描输入目录，0 表示只跑一轮")
+    args = parser.parse_args(argv)
+
+    if args.command == "init":
+        path = Path(args.config)
+        if path.exists():
+            print(f"⚠️ 已存在：{path}，未覆盖")
+            return 1
+        path.write_text(json.dumps(DEFAULT_CONFIG, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        print(f"✅ 已写出默认配置：{path}")
+        return 0
+
+    pipeline = Pipeline(load_config(args.config))
+    try:
+        while True:
+            pipeline.run_once()
+            if not args.watch:
+                break
+            print(f"⏳ {args.watch:g} 秒后重新扫描（Ctrl+C 结束）")
+            time.sleep(args.watch)
+    except KeyboardInterrupt:
+        print("\n⏹️ 已停止")
+    finally:
+        pipeline.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
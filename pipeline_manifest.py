@@ -0,0 +1,168 @@
+"""
+流水线清单（manifest）：记录每个阶段每个输入/产物的内容哈希、修改时间和输出路径
+- 各阶段据此只处理新增或变化的上游文件，不再只看“输出文件是否存在”
+- 合并阶段据此判断：无变化直接跳过；只有新增输入时追加写入；有输入变化/删除时才全量重建
+- 判断变化时先比较大小和 mtime，只有 mtime 变了才重新计算哈希，日常增量刷新只需几秒
+结构：
+{
+  "<阶段名>": {
+    "<输入文件或合并产物的绝对路径>": {
+      "size": ..., "mtime": ..., "sha256": "...",
+      "outputs": {"<产物路径>": {"size":..., "mtime":..., "sha256":...}},
+      "inputs": {"<合并输入路径>": {...}},   # 仅合并阶段
+      "count": ...                          # 仅合并阶段：产物中的样本数
+    }
+  }
+}
+"""
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+# 所有阶段共用一个清单文件
+DEFAULT_MANIFEST = Path(__file__).resolve().parent / "pipeline_manifest.json"
+
+
+def file_sha256(path, block_size=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class Manifest:
+    def __init__(self, path=DEFAULT_MANIFEST, autosave_every=100):
+        self.path = Path(path)
+        self.autosave_every = autosave_every
+        self.lock = threading.RLock()
+        self._dirty = 0
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.data = json.load(f)
+        else:
+            self.data = {}
+
+    # ---------------- 指纹 ----------------
+
+    def fingerprint(self, path, previous=None):
+        """返回文件指纹；大小和 mtime 都与 previous 相同时沿用旧哈希，不再读文件。"""
+        st = os.stat(path)
+        fp = {"size": st.st_size, "mtime": st.st_mtime_ns}
+        if previous and previous.get("size") == fp["size"] and previous.get("mtime") == fp["mtime"]:
+            fp["sha256"] = previous.get("sha256")
+        else:
+            fp["sha256"] = file_sha256(path)
+        return fp
+
+    def unchanged(self, path, previous):
+        """path 的内容是否与 previous 记录一致（mtime 变了但哈希相同也算未变）。"""
+        if not previous or not os.path.exists(path):
+            return False
+        st = os.stat(path)
+        if st.st_size != previous.get("size"):
+            return False
+        if st.st_mtime_ns == previous.get("mtime"):
+            return True
+        return file_sha256(path) == previous.get("sha256")
+
+    # ---------------- 单文件阶段 ----------------
+
+    def entry(self, stage, src):
+        return self.data.get(stage, {}).get(str(Path(src).resolve()))
+
+    def is_fresh(self, stage, src, outputs):
+        """
+        src 自上次记录以来未变化且 outputs 全部存在，则无需重做。
+        没有记录但产物都已存在且不比源文件旧（清单启用前的历史产物），直接收录为已完成。
+        """
+        outputs = [Path(o) for o in outputs]
+        if not all(o.exists() for o in outputs):
+            return False
+        old = self.entry(stage, src)
+        if old is None:
+            src_mtime = os.stat(src).st_mtime_ns
+            if all(os.stat(o).st_mtime_ns >= src_mtime for o in outputs):
+                self.record(stage, src, outputs)
+                return True
+            return False
+        return self.unchanged(src, old)
+
+    def record(self, stage, src, outputs, **extra):
+        """处理完成后登记 src 及其产物的指纹。"""
+        key = str(Path(src).resolve())
+        with self.lock:
+            old = self.data.get(stage, {}).get(key)
+            entry = self.fingerprint(src, old)
+            entry["outputs"] = {str(Path(o).resolve()): self.fingerprint(o) for o in outputs if Path(o).exists()}
+            entry.update(extra)
+            self.data.setdefault(stage, {})[key] = entry
+            self._touch()
+
+    def prune(self, stage, keep):
+        """删除 keep 之外（上游已删除）的记录，返回被删除的条目 {路径: 条目}。"""
+        keep = {str(Path(k).resolve()) for k in keep}
+        with self.lock:
+            entries = self.data.get(stage, {})
+            removed = {k: v for k, v in entries.items() if k not in keep}
+            for k in removed:
+                del entries[k]
+            if removed:
+                self._touch()
+            return removed
+
+    # ---------------- 合并阶段 ----------------
+
+    def plan_merge(self, stage, output, inputs):
+        """
+        判断合并产物 output 该如何更新，返回 (动作, 需要读取的输入列表)：
+        - ("skip", [])：输入集合与内容都没变
+        - ("append", 新增输入)：只多了新文件，旧输入都没变，追加即可
+        - ("rebuild", 全部输入)：有输入变化或被删除，或从未合并过
+        """
+        inputs = [Path(p) for p in inputs]
+        old = self.entry(stage, output)
+        if old is None or not Path(output).exists() or not self.unchanged(output, old):
+            return "rebuild", inputs
+        old_inputs = old.get("inputs", {})
+        current = {str(p.resolve()): p for p in inputs}
+        if any(k not in current for k in old_inputs):
+            return "rebuild", inputs
+        if not all(self.unchanged(k, v) for k, v in old_inputs.items()):
+            return "rebuild", inputs
+        new = [p for k, p in current.items() if k not in old_inputs]
+        return ("append", new) if new else ("skip", [])
+
+    def record_merge(self, stage, output, inputs, count):
+        """登记合并产物及其全部输入的指纹。"""
+        key = str(Path(output).resolve())
+        with self.lock:
+            old = self.data.get(stage, {}).get(key) or {}
+            old_inputs = old.get("inputs", {})
+            entry = self.fingerprint(output)
+            entry["inputs"] = {}
+            for p in inputs:
+                k = str(Path(p).resolve())
+                entry["inputs"][k] = self.fingerprint(p, old_inputs.get(k))
+            entry["outputs"] = {}
+            entry["count"] = count
+            self.data.setdefault(stage, {})[key] = entry
+            self._touch()
+
+    # ---------------- 持久化 ----------------
+
+    def _touch(self):
+        self._dirty += 1
+        if self._dirty >= self.autosave_every:
+            self.save()
+
+    def save(self):
+        """先写临时文件再原子替换，中途崩溃不会留下半截清单。"""
+        with self.lock:
+            tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, ensure_ascii=False, indent=1)
+            os.replace(tmp, self.path)
+            self._dirty = 0
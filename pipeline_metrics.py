@@ -0,0 +1,219 @@
+"""
+流水线指标：各阶段共用的结构化事件日志 + 运行结束时的汇总表
+- 事件逐行追加写入 JSONL（默认仓库根目录 pipeline_metrics.jsonl），每行带运行编号、阶段、事件类型和时间戳
+- file 事件：单个文件/产物的耗时、输入输出字节数、记录数、成功与否
+- api 事件：单次大模型调用的延迟、重试次数、状态码，以及响应 usage 中的输入/输出 token 数
+- 汇总：每个阶段的文件数、失败数、累计耗时、吞吐、API 延迟分位数、token 用量与估算费用
+用法：python pipeline_metrics.py [日志路径] [运行编号]，汇总日志里的全部运行（或指定运行）
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+# 所有阶段共用一个事件日志
+DEFAULT_LOG = Path(__file__).resolve().parent / "pipeline_metrics.jsonl"
+
+# 模型单价（元 / 千 token：输入，输出），按实际账单修改；不在表中的模型不计费用
+PRICES = {
+    "qwen-turbo": (0.0003, 0.0006),
+    "qwen-plus": (0.0008, 0.002),
+    "qwen-max": (0.0024, 0.0096),
+}
+
+
+def percentile(values, q):
+    """线性插值分位数，q 取 0~100"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    pos = (len(values) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+class StageStats:
+    """单个阶段的累计值"""
+
+    def __init__(self):
+        self.files = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.records = 0
+        self.api_calls = 0
+        self.api_errors = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cost = 0.0
+        self.latencies = []
+        self.first = None
+        self.last = None
+
+    def add(self, event):
+        ts = event.get("ts")
+        if ts is not None:
+            self.first = ts if self.first is None else min(self.first, ts)
+            self.last = ts if self.last is None else max(self.last, ts)
+        kind = event.get("event")
+        if kind == "file":
+            self.files += 1
+            self.errors += 0 if event.get("ok", True) else 1
+            self.seconds += event.get("seconds", 0.0)
+            self.bytes_in += event.get("bytes_in", 0)
+            self.bytes_out += event.get("bytes_out", 0)
+            self.records += event.get("records", 0)
+        elif kind == "api":
+            self.api_calls += 1
+            self.api_errors += 0 if event.get("ok", True) else 1
+            self.retries += event.get("retries", 0)
+            self.latencies.append(event.get("latency", 0.0))
+            self.input_tokens += event.get("input_tokens", 0)
+            self.output_tokens += event.get("output_tokens", 0)
+            price = PRICES.get(event.get("model"))
+            if price:
+                self.cost += (event.get("input_tokens", 0) * price[0] + event.get("output_tokens", 0) * price[1]) / 1000
+        elif kind == "cache_hit":
+            self.cache_hits += 1
+
+    def row(self):
+        elapsed = (self.last - self.first) if self.first is not None else 0.0
+        return {
+            "files": self.files,
+            "errors": self.errors,
+            "seconds": round(self.seconds, 3),
+            "elapsed": round(elapsed, 3),
+            "files_per_s": round(self.files / elapsed, 3) if elapsed > 0 else None,
+            "mb_in": round(self.bytes_in / 1024 / 1024, 3),
+            "mb_out": round(self.bytes_out / 1024 / 1024, 3),
+            "records": self.records,
+            "api_calls": self.api_calls,
+            "api_errors": self.api_errors,
+            "retries": self.retries,
+            "cache_hits": self.cache_hits,
+            "latency_p50": round(percentile(self.latencies, 50), 3),
+            "latency_p90": round(percentile(self.latencies, 90), 3),
+            "latency_p99": round(percentile(self.latencies, 99), 3),
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cost": round(self.cost, 4),
+        }
+
+
+class Metrics:
+    """
+    事件记录器，多线程安全；path=None 时只在内存里汇总，不写日志
+    同一次运行的事件共用 run_id（默认：启动时间 + 进程号）
+    """
+
+    def __init__(self, path=DEFAULT_LOG, run_id=None):
+        self.path = Path(path) if path else None
+        self.run_id = run_id or time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+        self.stages = defaultdict(StageStats)
+        self.lock = threading.Lock()
+        self._f = open(self.path, "a", encoding="utf-8") if self.path else None
+
+    def event(self, stage, kind, **fields):
+        """记录一个事件：写一行 JSONL，并计入本次运行的汇总"""
+        event = {"ts": time.time(), "run": self.run_id, "stage": stage, "event": kind, **fields}
+        with self.lock:
+            self.stages[stage].add(event)
+            if self._f:
+                self._f.write(json.dumps(event, ensure_ascii=False, default=str) + "\n")
+                self._f.flush()
+
+    @contextmanager
+    def timer(self, stage, kind="file", **fields):
+        """
+        计时一个文件/产物的处理过程，退出时记一条事件。
+        产出一个字典，处理过程中可往里填 bytes_in / bytes_out / records 等字段；抛出异常时记为失败并继续抛出。
+        """
+        info = dict(fields)
+        start = time.perf_counter()
+        try:
+            yield info
+        except BaseException as e:
+            info["ok"] = False
+            info.setdefault("error", str(e) or type(e).__name__)
+            raise
+        finally:
+            info.setdefault("ok", True)
+            self.event(stage, kind, seconds=time.perf_counter() - start, **info)
+
+    def api_call(self, stage, model, latency, response=None, retries=0, error=None):
+        """记录一次大模型调用；token 数取自响应的 usage（dashscope 为 input_tokens / output_tokens）"""
+        usage = _get(response, "usage") or {}
+        status = _get(response, "status_code")
+        self.event(stage, "api", model=model, latency=latency, retries=retries, status=status,
+                   ok=error is None and status in (None, 200),
+                   input_tokens=_get(usage, "input_tokens") or _get(usage, "prompt_tokens") or 0,
+                   output_tokens=_get(usage, "output_tokens") or _get(usage, "completion_tokens") or 0,
+                   **({"error": error} if error else {}))
+
+    def summary(self):
+        with self.lock:
+            return {stage: st.row() for stage, st in self.stages.items()}
+
+    def print_summary(self):
+        print_table(self.summary(), title=f"📊 运行 {self.run_id} 指标汇总")
+
+    def close(self):
+        with self.lock:
+            if self._f:
+                self._f.close()
+                self._f = None
+
+
+def _get(obj, key):
+    """同时兼容字典与属性访问（dashscope 的响应对象两种都支持）"""
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(key)
+    try:
+        return obj[key]
+    except (KeyError, TypeError, IndexError):
+        return getattr(obj, key, None)
+
+
+def print_table(rows, title="📊 指标汇总"):
+    """把 {阶段: 汇总} 打印成表格，只显示有数据的列"""
+    if not rows:
+        print(f"{title}：没有记录")
+        return
+    columns = [c for c in next(iter(rows.values()))
+               if any(r.get(c) not in (0, 0.0, None) for r in rows.values())]
+    width = max(len("stage"), *(len(s) for s in rows))
+    print(f"\n{title}")
+    print("stage".ljust(width) + "".join(f"{c:>14}" for c in columns))
+    for stage, r in rows.items():
+        print(stage.ljust(width) + "".join(f"{'' if r[c] is None else r[c]:>14}" for c in columns))
+
+
+def summarize_log(path=DEFAULT_LOG, run_id=None):
+    """汇总日志文件：返回 {运行编号: {阶段: 汇总}}"""
+    runs = defaultdict(lambda: defaultdict(StageStats))
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            event = json.loads(line)
+            if run_id is None or event.get("run") == run_id:
+                runs[event.get("run")][event.get("stage")].add(event)
+    return {run: {stage: st.row() for stage, st in stages.items()} for run, stages in runs.items()}
+
+
+if __name__ == "__main__":
+    log = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_LOG
+    only = sys.argv[2] if len(sys.argv) > 2 else None
+    for run, rows in summarize_log(log, only).items():
+        print_table(rows, title=f"📊 运行 {run}")
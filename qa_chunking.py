@@ -0,0 +1,179 @@
+"""
+文本分块：按 02word_to_txt.py 产出的段落/表格边界，把长文本切成受 token 预算约束的窗口
+- 每行是一个段落；连续的含制表符(\\t)的行视为同一张表格
+- 相邻窗口之间保留 overlap_tokens 的重叠，避免条款被切断
+- 按各块大小把目标问答对数量按比例分配到每个块
+- txt 旁边有 02 写出的块索引（<同名>.blocks.jsonl）时，直接按索引里的字符偏移取块（load_block_index），
+  标题与其后的块合在一起，窗口不会以孤立的标题结尾
+"""
+import re
+from pathlib import Path
+
+from dataset_io import iter_records
+from qa_engine import estimate_tokens
+
+# 块索引的文件后缀（与 txt 同名，见 02word_to_txt.py 的 BLOCKS_SIDECAR）
+BLOCKS_SUFFIX = ".blocks.jsonl"
+
+# 超长段落按句末标点切分
+_SENTENCE_END = re.compile(r"(?<=[。！？；!?;])")
+
+
+def split_blocks(text):
+    """把文本切成块列表：普通段落一行一块，连续的表格行合成一块。"""
+    blocks = []
+    table = []
+    for line in text.split("\n"):
+        if not line.strip():
+            continue
+        if "\t" in line:
+            table.append(line)
+            continue
+        if table:
+            blocks.append("\n".join(table))
+            table = []
+        blocks.append(line)
+    if table:
+        blocks.append("\n".join(table))
+    return blocks
+
+
+def blocks_path_for(txt_path):
+    return Path(txt_path).with_suffix(BLOCKS_SUFFIX)
+
+
+def load_block_index(txt_path, text):
+    """
+    读取 txt 的块索引，返回与 split_blocks 相同形式的块列表；text 为 txt 的内容（换行统一为 \n）
+    没有索引，或索引与文本对不上（txt 被其他方式重新生成过）时返回 None，调用方退回 split_blocks
+    """
+    path = blocks_path_for(txt_path)
+    if not path.exists():
+        return None
+    blocks = []
+    heading = None  # 还没有接上正文的标题块的起点
+    last = 0
+    try:
+        for record in iter_records(path):
+            start, end = record["start"], record["end"]
+            if not last <= start <= end <= len(text) or text[start:end] != record["text"]:
+                return None
+            last = end
+            if heading is None:
+                heading = start
+            if record["type"] != "heading":
+                blocks.append(text[heading:end])
+                heading = None
+    except (ValueError, KeyError, TypeError):
+        return None
+    if heading is not None:
+        blocks.append(text[heading:last])
+    return blocks
+
+
+def _split_oversized(block, max_tokens):
+    """单块超过预算时继续拆分：表格按行，段落按句，最后按字符硬切。"""
+    if "\t" in block:
+        pieces = block.split("\n")
+    else:
+        pieces = [s for s in _SENTENCE_END.split(block) if s]
+    out = []
+    for piece in pieces:
+        if estimate_tokens(piece) <= max_tokens:
+            out.append(piece)
+            continue
+        step = max(1, max_tokens)  # 最坏情况（全中文）1 字 1 token
+        out.extend(piece[i:i + step] for i in range(0, len(piece), step))
+    # 把拆出来的小片重新拼成不超过预算的块
+    merged, current, size = [], [], 0
+    sep = "\n" if "\t" in block else ""
+    for piece in out:
+        t = estimate_tokens(piece)
+        if current and size + t > max_tokens:
+            merged.append(sep.join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += t
+    if current:
+        merged.append(sep.join(current))
+    return merged
+
+
+def chunk_text(text, max_tokens=3000, overlap_tokens=200, blocks=None):
+    """
+    按块边界贪心打包，返回文本窗口列表。
+    max_tokens：每个窗口的 token 上限（不含提示词）
+    overlap_tokens：下一个窗口开头重复上一个窗口末尾的块，总量不超过该值
+    blocks：现成的块列表（load_block_index 的结果），不传时由 split_blocks 从文本推断
+    """
+    source = blocks if blocks is not None else split_blocks(text)
+    blocks = []
+    for block in source:
+        if estimate_tokens(block) > max_tokens:
+            blocks.extend(_split_oversized(block, max_tokens))
+        else:
+            blocks.append(block)
+
+    chunks = []
+    current = []  # [(块文本, token 数)]
+    size = 0
+    for block in blocks:
+        t = estimate_tokens(block)
+        if current and size + t > max_tokens:
+            chunks.append("\n".join(b for b, _ in current))
+            # 从末尾取块作为重叠，且要给新块留出空间
+            overlap, kept = [], 0
+            for b, bt in reversed(current):
+                if kept + bt > overlap_tokens or kept + bt + t > max_tokens:
+                    break
+                overlap.insert(0, (b, bt))
+                kept += bt
+            current, size = overlap, kept
+        current.append((block, t))
+        size += t
+    if current:
+        chunks.append("\n".join(b for b, _ in current))
+    return chunks
+
+
+def allocate_qa_counts(chunks, total, max_per_chunk=None, weights=None):
+    """
+    按各块 token 数占比分配 total 个问答对（最大余数法），每块至少 1 个。
+    块数多于 total 时，在全文中等间隔挑 total 个块各分 1 个，其余为 0。
+    max_per_chunk：单块上限（受模型最大输出长度限制），超出部分按同样的比例再分给未到上限的块，
+    所有块都到上限时才少分（实际数量以 sum(counts) 为准）。
+    weights：按这些权重而不是 token 数分配（见 qa_policy），权重为 0 的块不分配。
+    """
+    counts = [0] * len(chunks)
+    sizes = weights if weights is not None else [max(1, estimate_tokens(c)) for c in chunks]
+    active = [i for i, s in enumerate(sizes) if s > 0]
+    if not active or total <= 0:
+        return counts
+    if total <= len(active):
+        for k in range(total):
+            counts[active[int((k + 0.5) * len(active) / total)]] = 1
+        return counts
+
+    # 先每块保底 1 个，剩余按比例分配
+    for i in active:
+        counts[i] = 1
+    room = active
+    while True:
+        _add_shares(counts, room, sizes, total - sum(counts))
+        if not max_per_chunk:
+            return counts
+        counts = [min(c, max_per_chunk) for c in counts]
+        room = [i for i in active if counts[i] < max_per_chunk]
+        if sum(counts) >= total or not room:
+            return counts
+
+
+def _add_shares(counts, indices, sizes, amount):
+    """把 amount 个按 sizes 的占比加到 indices 这些块上（最大余数法）"""
+    whole = sum(sizes[i] for i in indices)
+    shares = {i: amount * sizes[i] / whole for i in indices}
+    for i in indices:
+        counts[i] += int(shares[i])
+    left = amount - sum(int(s) for s in shares.values())
+    for i in sorted(indices, key=lambda i: -(shares[i] - int(shares[i])))[:left]:
+        counts[i] += 1
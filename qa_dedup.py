@@ -0,0 +1,216 @@
+"""
+问答对近似去重索引（MinHash + LSH，持久化到 SQLite）
+- 文本：instruction + input + output，NFKC 归一化、转小写、去掉空白和标点后取字符 n-gram
+- MinHash 签名：num_perm 个 (a*x+b) mod p 哈希的最小值（numpy 向量化）
+- LSH：签名切成 bands 段，每段一个桶；只和同桶的候选比较，估计的 Jaccard 相似度 >= threshold 判为重复，
+  整体是次二次复杂度，百万级问答对也能跑
+- 增量：索引落盘，新文件到来时只处理新记录；每条记录登记所属输出（owner），
+  输出重建前用 forget(owner) 清掉旧登记，索引始终等于“当前各输出里保留下来的记录”
+- 可作为 05/06 合并阶段里的过滤器：DedupIndex.filter(records, owner)
+用法：python qa_dedup.py 文件 [文件 ...]，在原文件旁写出 xxx.dedup.json(l)
+"""
+import re
+import sqlite3
+import sys
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+
+from dataset_io import iter_records, write_records
+
+# 默认参数：128 个哈希，16 段 × 8 行（LSH 的召回拐点约在相似度 0.71），判重阈值 0.8
+NUM_PERM = 128
+BANDS = 16
+NGRAM = 3
+THRESHOLD = 0.8
+SEED = 1
+
+_PRIME = (1 << 31) - 1
+_MIX = np.uint64(0x100000001B3)  # FNV 乘数，用于把 n 个字符码组合成一个 n-gram 哈希
+# 归一化时去掉的字符：空白、标点、符号
+_STRIP = re.compile(r"[\s\W_]+", re.UNICODE)
+
+
+def record_text(record):
+    """参与去重的文本：instruction + input + output"""
+    if not isinstance(record, dict):
+        return str(record)
+    return "\n".join(str(record.get(k) or "") for k in ("instruction", "input", "output"))
+
+
+def normalize(text):
+    return _STRIP.sub("", unicodedata.normalize("NFKC", text).lower())
+
+
+def shingles(text, n=NGRAM):
+    """归一化文本的字符 n-gram 集合（文本比 n 短时整体作为一个）；便于查看，签名计算走 numpy 版本"""
+    text = normalize(text)
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class DedupIndex:
+    def __init__(self, path, threshold=THRESHOLD, num_perm=NUM_PERM, bands=BANDS, ngram=NGRAM, seed=SEED,
+                 commit_every=1000):
+        if num_perm % bands:
+            raise ValueError("num_perm 必须能被 bands 整除")
+        self.path = str(path)
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.ngram = ngram
+        self.commit_every = commit_every
+        self.kept = 0
+        self.dropped = 0
+        self._pending = 0
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, _PRIME, size=num_perm).astype(np.uint64)[:, None]
+        self._b = rng.randint(0, _PRIME, size=num_perm).astype(np.uint64)[:, None]
+        self._band_mix = rng.randint(1, 2 ** 63, size=self.rows, dtype=np.int64).astype(np.uint64) | np.uint64(1)
+        self._band_salt = rng.randint(1, 2 ** 63, size=bands, dtype=np.int64).astype(np.uint64)
+
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS signatures ("
+            " id INTEGER PRIMARY KEY,"
+            " owner TEXT NOT NULL,"
+            " sig BLOB NOT NULL)"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS buckets (bucket INTEGER NOT NULL, id INTEGER NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_bucket ON buckets(bucket)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_bucket_id ON buckets(id)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_owner ON signatures(owner)")
+        # 索引参数写进库里，换参数后旧索引不可混用
+        params = f"{num_perm}/{bands}/{ngram}/{seed}"
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'params'").fetchone()
+        if row is None:
+            self.conn.execute("INSERT INTO meta VALUES ('params', ?)", (params,))
+            self.conn.commit()
+        elif row[0] != params:
+            raise ValueError(f"索引 {self.path} 的参数为 {row[0]}，与当前参数 {params} 不一致，请换一个索引文件")
+
+    # ---------------- 签名与分桶 ----------------
+
+    def signature(self, text):
+        """MinHash 签名（uint32 数组）；没有可比较的文字时返回 None"""
+        x = self._shingle_hashes(normalize(text))
+        if x is None:
+            return None
+        return ((self._a * x[None, :] + self._b) % _PRIME).min(axis=1).astype(np.uint32)
+
+    def _shingle_hashes(self, text):
+        """字符 n-gram 的哈希值（去重后），与 shingles() 的集合一一对应；整段用 numpy 计算"""
+        if not text:
+            return None
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        n = min(self.ngram, len(codes))
+        h = np.zeros(len(codes) - n + 1, dtype=np.uint64)
+        for j in range(n):
+            h = h * _MIX + codes[j:len(codes) - n + 1 + j]  # uint64 溢出回绕即可
+        if n < self.ngram:
+            h = h * _MIX + np.uint64(n)  # 短文本与长文本的 n-gram 区分开
+        return np.unique(h % _PRIME)
+
+    def _buckets(self, sig):
+        """每段签名哈希成一个 64 位桶号（段号参与哈希，不同段的桶互不相同）"""
+        bands = sig.reshape(self.bands, self.rows).astype(np.uint64)
+        keys = (bands * self._band_mix).sum(axis=1) + self._band_salt
+        return keys.view(np.int64).tolist()
+
+    # ---------------- 查询与登记 ----------------
+
+    def query(self, sig):
+        """返回与 sig 近似重复的已登记记录 id，没有则返回 None"""
+        keys = self._buckets(sig)
+        marks = ",".join("?" * len(keys))
+        ids = [r[0] for r in self.conn.execute(f"SELECT DISTINCT id FROM buckets WHERE bucket IN ({marks})", keys)]
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT id, sig FROM signatures WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+            for cid, blob in rows:
+                if np.mean(np.frombuffer(blob, dtype=np.uint32) == sig) >= self.threshold:
+                    return cid
+        return None
+
+    def add(self, sig, owner):
+        cur = self.conn.execute("INSERT INTO signatures (owner, sig) VALUES (?, ?)", (owner, sig.tobytes()))
+        self.conn.executemany("INSERT INTO buckets (bucket, id) VALUES (?, ?)",
+                              [(key, cur.lastrowid) for key in self._buckets(sig)])
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.commit()
+        return cur.lastrowid
+
+    def check(self, record, owner):
+        """不重复则登记并返回 True；与已登记记录近似重复返回 False"""
+        sig = self.signature(record_text(record))
+        if sig is None:
+            self.kept += 1
+            return True
+        if self.query(sig) is not None:
+            self.dropped += 1
+            return False
+        self.add(sig, owner)
+        self.kept += 1
+        return True
+
+    def filter(self, records, owner):
+        """逐条过滤，只产出不重复的记录"""
+        try:
+            for record in records:
+                if self.check(record, owner):
+                    yield record
+        finally:
+            self.commit()
+
+    def forget(self, owner):
+        """删除某个输出登记的全部记录（该输出要重建时调用）"""
+        self.conn.execute("DELETE FROM buckets WHERE id IN (SELECT id FROM signatures WHERE owner = ?)", (owner,))
+        self.conn.execute("DELETE FROM signatures WHERE owner = ?", (owner,))
+        self.commit()
+
+    # ---------------- 其他 ----------------
+
+    def commit(self):
+        self.conn.commit()
+        self._pending = 0
+
+    def stats(self):
+        entries = self.conn.execute("SELECT COUNT(*) FROM signatures").fetchone()[0]
+        return {"kept": self.kept, "dropped": self.dropped, "entries": entries}
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+def dedup_file(src, dst, index, owner=None):
+    """把 src 去重后写到 dst（格式由后缀决定），返回 (保留条数, 去掉条数)"""
+    owner = owner or str(dst)
+    dropped = index.dropped
+    kept = write_records(dst, index.filter(iter_records(src), owner))
+    return kept, index.dropped - dropped
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("用法：python qa_dedup.py 文件 [文件 ...]")
+        sys.exit(1)
+    paths = [Path(p) for p in sys.argv[1:]]
+    index = DedupIndex(paths[0].parent / ".dedup_index.sqlite")
+    try:
+        for path in paths:
+            out = path.with_name(f"{path.stem}.dedup{path.suffix}")
+            index.forget(str(out))
+            kept, dropped = dedup_file(path, out, index)
+            print(f"✅ {path.name} → {out.name} | 保留 {kept}，去掉近似重复 {dropped}")
+    finally:
+        print(f"📊 索引共 {index.stats()['entries']} 条")
+        index.close()
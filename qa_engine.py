@@ -0,0 +1,437 @@
+"""
+问答生成并发引擎
+- 有界线程池并发调用大模型（concurrency），网络等待期间不再空转
+- 全局并发槽：无论外层按文件、内层按分块怎样嵌套 map，同时在途的请求数都不超过 concurrency
+- 令牌桶限流：每分钟请求数（RPM）与每分钟 token 数（TPM）同时约束
+- 背压：在途任务数不超过并发上限的 2 倍；遇到限流(429)时全体暂停退避，避免 429 风暴
+- 错误分类：限流、服务端 5xx、超时/连接错误可重试（指数退避 + 抖动）；参数错误、鉴权失败、内容审核等直接失败
+- 熔断：连续多个请求出现可重试错误后暂停一段时间，再用单个探测请求确认恢复，不再把请求砸向已经降级的服务
+- parse_partial_array：容错解析模型输出的 JSON 数组，截断时也能取回已完整的元素
+- FakeGeneration：本地模拟 dashscope.Generation.call，可模拟延迟与限流错误，便于离线测试
+"""
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# 通义千问限流时返回的错误码
+RATE_LIMIT_CODES = {"Throttling", "Throttling.RateQuota", "Throttling.AllocationQuota", "Throttling.User"}
+# 其他可重试的错误：服务端内部错误、过载、超时
+RETRYABLE_STATUS = {408, 500, 502, 503, 504}
+RETRYABLE_CODES = {"InternalError", "InternalError.Algo", "InternalError.Timeout", "ServiceUnavailable",
+                   "RequestTimeOut", "SystemError"}
+
+
+class GenerationError(Exception):
+    """调用最终失败：不可重试的错误，或可重试错误的重试次数用尽"""
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：中日韩字符约 1 字 1 token，其余字符约 4 字符 1 token。"""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if "一" <= ch <= "鿿" or "　" <= ch <= "〿" or "＀" <= ch <= "￯")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class TokenBucket:
+    """令牌桶：按每分钟 rate 个的速度匀速补充，最多攒 capacity 个。"""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0  # 每秒补充量
+        self.capacity = capacity or rate_per_minute
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        """预占 amount 个令牌（允许透支），返回需要等待的秒数；透支部分由后来者排队偿还。"""
+        amount = min(amount, self.capacity)  # 单次请求超过桶容量时按容量计，避免永远等不到
+        with self.lock:
+            self._refill()
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self, amount=1):
+        delay = self.reserve(amount)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class RateLimiter:
+    """RPM + TPM 双令牌桶，外加一个全局暂停点（收到 429 后所有线程一起退避）。"""
+
+    def __init__(self, rpm=None, tpm=None):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.pause_until = 0.0
+        self.lock = threading.Lock()
+
+    def penalize(self, seconds):
+        """限流后全局暂停 seconds 秒（取已有暂停与本次暂停的较晚者）。"""
+        with self.lock:
+            self.pause_until = max(self.pause_until, time.monotonic() + seconds)
+
+    def acquire(self, token_count):
+        delay = self.pause_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        if self.requests:
+            self.requests.acquire(1)
+        if self.tokens:
+            self.tokens.acquire(token_count)
+
+
+def is_rate_limited(response):
+    """判断一次调用结果是否为限流（HTTP 429 或 Throttling 错误码）。"""
+    status = getattr(response, "status_code", None)
+    code = getattr(response, "code", None)
+    return status == 429 or code in RATE_LIMIT_CODES
+
+
+def classify(response=None, error=None):
+    """
+    判断一次调用的结果：
+    "ok" 成功；"throttled" 限流；"retry" 其他可重试错误（5xx、超时、连接中断）；"fatal" 不可重试（参数、鉴权、审核等）
+    """
+    if error is not None:
+        # requests / urllib / http.client 的网络异常都是 OSError 的子类
+        return "retry" if isinstance(error, (TimeoutError, ConnectionError, OSError)) else "fatal"
+    if is_rate_limited(response):
+        return "throttled"
+    status = getattr(response, "status_code", None)
+    if status in (None, 200):
+        return "ok"
+    if status in RETRYABLE_STATUS or getattr(response, "code", None) in RETRYABLE_CODES:
+        return "retry"
+    return "fatal"
+
+
+def describe(response):
+    return f"status={getattr(response, 'status_code', None)} code={getattr(response, 'code', None)} " \
+           f"message={getattr(response, 'message', None)}"
+
+
+class CircuitBreaker:
+    """
+    连续 threshold 个请求出现可重试错误（不含限流，限流由令牌桶与全局暂停处理；同一请求的多次重试只计一次）后熔断 cooldown 秒。
+    熔断只是暂停：wait() 让调用方等到冷却结束，和限流的全局暂停一样，排队中的请求不会因此失败。
+    冷却结束后先只放行一个探测请求（半开），其余继续等待；探测成功则恢复正常，失败则立刻重新熔断。
+    """
+
+    def __init__(self, threshold=10, cooldown=60.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self.tripped = False   # 熔断过且之后还没有成功过（半开）
+        self.probing = False   # 半开状态下已有探测请求在途
+        self.trips = 0
+        self.cond = threading.Condition()
+
+    def wait(self):
+        """等到可以发请求为止；返回 True 表示本次是半开状态下的探测请求，结束后必须调用 success/failure/release"""
+        with self.cond:
+            while True:
+                remaining = self.open_until - time.monotonic()
+                if remaining > 0:
+                    self.cond.wait(remaining)
+                elif not self.tripped:
+                    return False
+                elif not self.probing:
+                    self.probing = True
+                    return True
+                else:
+                    self.cond.wait()
+
+    def success(self, probe=False):
+        with self.cond:
+            self.failures = 0
+            self.tripped = False
+            if probe:
+                self.probing = False
+            self.cond.notify_all()
+
+    def failure(self, probe=False, counted=True):
+        """一次可重试错误；counted=False 表示该请求之前已经计过一次，只有探测失败时才起作用"""
+        with self.cond:
+            if probe:
+                self.probing = False
+            elif counted:
+                self.failures += 1
+            if probe or self.failures >= self.threshold:
+                self.open_until = time.monotonic() + self.cooldown
+                self.tripped = True
+                self.trips += 1
+                self.failures = 0
+            self.cond.notify_all()
+
+    def release(self, probe):
+        """探测请求既没成功也不是可重试错误（限流、不可重试错误）：让出探测资格，状态不变"""
+        if probe:
+            with self.cond:
+                self.probing = False
+                self.cond.notify_all()
+
+
+_END = object()  # map() 里 items 取完的标记
+
+
+class GenerationEngine:
+    """
+    对 call_fn（默认即 dashscope.Generation.call）做限流、限流重试与并发调度。
+    call_fn：与 dashscope.Generation.call 同签名的可调用对象
+    concurrency：同时在途的请求数上限
+    rpm / tpm：每分钟请求数 / token 数配额，None 表示不限
+    metrics / stage：传入 pipeline_metrics.Metrics 时，每次调用记一条 api 事件（延迟、重试次数、usage token 数）
+    """
+
+    def __init__(self, call_fn, concurrency=8, rpm=None, tpm=None, max_retries=5, backoff=2.0,
+                 metrics=None, stage="llm", max_backoff=60.0, breaker_threshold=10, breaker_cooldown=60.0):
+        self.call_fn = call_fn
+        self.metrics = metrics
+        self.stage = stage
+        self.concurrency = max(1, concurrency)
+        self.limiter = RateLimiter(rpm, tpm)
+        # 同一请求只计一次失败，在途请求最多 concurrency 个，阈值不能超过它，否则要等有请求重试用尽才会熔断
+        self.breaker = CircuitBreaker(min(breaker_threshold, self.concurrency), breaker_cooldown)
+        self.slots = threading.BoundedSemaphore(self.concurrency)  # 在途请求槽位
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stats = {"calls": 0, "rate_limited": 0, "retried": 0, "failed": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _delay(self, attempt):
+        """指数退避 + 抖动：取 [d/2, d] 之间的随机值，避免大量线程同时重试"""
+        d = min(self.max_backoff, self.backoff * (2 ** attempt))
+        return d / 2 + random.random() * d / 2
+
+    def call(self, **kwargs):
+        """
+        限流后调用 call_fn，按错误类型处理：
+        限流 → 全体暂停退避后重试；5xx/超时/连接错误 → 本请求退避后重试，并计入熔断；
+        不可重试的错误或重试用尽 → 抛 GenerationError；熔断中 → 等到冷却结束（不消耗重试次数）
+        """
+        prompt_tokens = sum(estimate_tokens(m.get("content", "")) for m in kwargs.get("messages", []))
+        budget = prompt_tokens + kwargs.get("max_tokens", 0)  # TPM 按输入 + 最大输出预占
+        last = ""
+        counted = False  # 本请求是否已计入熔断的连续失败数
+        for attempt in range(self.max_retries + 1):
+            probe = self.breaker.wait()
+            self.limiter.acquire(budget)
+            self._count("calls")
+            response = error = None
+            try:
+                with self.slots:
+                    start = time.perf_counter()  # 从拿到槽位开始计时，延迟不含排队等待
+                    response = self.call_fn(**kwargs)
+            except GenerationError:
+                self.breaker.release(probe)
+                raise  # 后端自己判定的结果（如批量模式的“已排队”），不重试也不计入熔断
+            except Exception as e:
+                error = e
+            latency = time.perf_counter() - start
+            kind = classify(response, error)
+            if kind == "ok":
+                self.breaker.success(probe)
+                self._record(kwargs, latency, response, attempt, None)
+                return response
+            last = (str(error) or type(error).__name__) if error is not None else describe(response)
+            if kind == "retry":
+                self.breaker.failure(probe, counted=not counted)
+                counted = True
+            else:
+                self.breaker.release(probe)
+            if kind == "fatal":
+                break
+            if kind == "throttled":
+                self._count("rate_limited")
+            if attempt == self.max_retries:
+                break
+            self._count("retried")
+            if kind == "throttled":
+                # 所有线程一起让出配额
+                self.limiter.penalize(self._delay(attempt))
+            else:
+                time.sleep(self._delay(attempt))
+        self._count("failed")
+        self._record(kwargs, latency, response, attempt, last)
+        raise GenerationError(f"调用失败（{kind}，已尝试 {attempt + 1} 次）：{last}")
+
+    def _record(self, kwargs, latency, response, retries, error):
+        if self.metrics is not None:
+            self.metrics.api_call(self.stage, kwargs.get("model"), latency, response, retries, error)
+
+    def map(self, fn, items, ordered=False):
+        """
+        用有界线程池对 items 逐个执行 fn(item)，按完成顺序产出 (item, result, error)。
+        items 可以是生成器：任务按需取出，在途任务数不超过 concurrency*2（背压）。
+        ordered=True 时按输入顺序产出：前面的任务没完成时，后面已完成的结果先留在窗口里（同样不超过 concurrency*2）。
+        """
+        items = iter(items)
+        limit = self.concurrency * 2
+        with ThreadPoolExecutor(max_workers=self.concurrency) as ex:
+            if ordered:
+                window = deque()
+                while True:
+                    while len(window) < limit:
+                        item = next(items, _END)
+                        if item is _END:
+                            break
+                        window.append((ex.submit(fn, item), item))
+                    if not window:
+                        return
+                    fut, item = window.popleft()
+                    try:
+                        yield item, fut.result(), None
+                    except Exception as e:
+                        yield item, None, e
+            pending = {}
+
+            def fill():
+                while len(pending) < limit:
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        return
+                    pending[ex.submit(fn, item)] = item
+
+            fill()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    item = pending.pop(fut)
+                    try:
+                        yield item, fut.result(), None
+                    except Exception as e:
+                        yield item, None, e
+                fill()
+
+
+# ================== 模型输出解析 ==================
+
+def parse_partial_array(content):
+    """
+    容错解析模型输出中的 JSON 数组（允许前后有说明文字或 ``` 代码块）。
+    返回 (已完整解析的元素列表, 数组是否完整闭合)；输出被截断或中途损坏时，返回损坏处之前的全部元素。
+    """
+    start = content.find("[")
+    if start < 0:
+        return [], False
+    decoder = json.JSONDecoder()
+    items = []
+    pos = start + 1
+    n = len(content)
+    while True:
+        while pos < n and content[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= n:
+            return items, False
+        if content[pos] == "]":
+            return items, True
+        try:
+            obj, pos = decoder.raw_decode(content, pos)
+        except json.JSONDecodeError:
+            return items, False
+        items.append(obj)
+
+
+# ================== 离线测试用的模拟接口 ==================
+
+class Response(dict):
+    """
+    与 dashscope 的 GenerationResponse 同形的调用结果：既能 response['output'] 取值，也能 response.status_code 取属性。
+    llm_backends 的各个后端都返回这种结构，引擎与 03 不必关心底层是哪家接口。
+    """
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+FakeResponse = Response
+
+
+class FakeGeneration:
+    """
+    dashscope.Generation.call 的本地替身
+    latency：每次调用的模拟延迟（秒），可为 (min, max) 区间
+    rpm：模拟服务端每分钟请求配额，超过即返回 429
+    error_rate：随机返回 429 的概率
+    server_error_rate：随机返回 500 的概率
+    truncate_rate：随机在输出中途截断（finish_reason="length"）的概率
+    pairs：每次返回的问答对个数（合并请求为每篇的个数）
+    """
+
+    def __init__(self, latency=(0.05, 0.2), rpm=None, error_rate=0.0, seed=None,
+                 server_error_rate=0.0, truncate_rate=0.0, pairs=1):
+        self.latency = latency
+        self.rpm = rpm
+        self.error_rate = error_rate
+        self.server_error_rate = server_error_rate
+        self.truncate_rate = truncate_rate
+        self.pairs = pairs
+        self.random = random.Random(seed)
+        self.history = []  # 最近一分钟内的调用时间
+        self.calls = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def _throttled(self):
+        now = time.monotonic()
+        with self.lock:
+            self.calls += 1
+            self.history = [t for t in self.history if now - t < 60]
+            over_quota = self.rpm is not None and len(self.history) >= self.rpm
+            if over_quota or self.random.random() < self.error_rate:
+                self.throttled += 1
+                return True
+            self.history.append(now)
+            return False
+
+    def call(self, model=None, messages=None, max_tokens=2048, **kwargs):
+        lo, hi = self.latency if isinstance(self.latency, tuple) else (self.latency, self.latency)
+        time.sleep(self.random.uniform(lo, hi))
+        if self._throttled():
+            return FakeResponse(status_code=429, code="Throttling.RateQuota", message="Requests rate limit exceeded", output=None)
+        with self.lock:
+            server_error = self.random.random() < self.server_error_rate
+            truncate = self.random.random() < self.truncate_rate
+            cut = self.random.random()
+        if server_error:
+            return FakeResponse(status_code=500, code="InternalError", message="Internal server error", output=None)
+        # 合并请求（带 <<<文档 N>>> 分隔）：每篇各返回 pairs 个，带 doc 编号
+        docs = re.findall(r"<<<文档 (\d+)>>>", "\n".join(m["content"] for m in messages or [] if m["role"] == "user"))
+        if docs:
+            pairs = [{"doc": int(d), "question": f"模拟问题{d}-{i}", "answer": "模拟答案"} for d in docs for i in range(self.pairs)]
+        else:
+            pairs = [{"question": f"模拟问题{i}", "answer": "模拟答案"} for i in range(self.pairs)]
+        content = json.dumps(pairs, ensure_ascii=False)
+        finish_reason = "stop"
+        if truncate:
+            content = content[:max(1, int(len(content) * cut))]
+            finish_reason = "length"
+        return FakeResponse(
+            status_code=200,
+            code="",
+            message="",
+            output={"choices": [{"finish_reason": finish_reason, "message": {"role": "assistant", "content": content}}]},
+            usage={"input_tokens": sum(estimate_tokens(m["content"]) for m in messages or []), "output_tokens": estimate_tokens(content)},
+        )
+
+    __call__ = call
@@ -0,0 +1,95 @@
+"""
+把多个小文本合并成一次大模型请求
+- RequestPacker：各生成线程提交自己的小请求后阻塞等待；攒够 max_items 篇、或总 token 数再加就超过 max_tokens、
+  或等待超过 linger 秒时，由其中一个线程把这一包发出去，结果按原顺序分回给各自的调用方
+- pack_documents / split_by_doc：合并请求的文本格式与输出拆分。每篇文本前加 <<<文档 N>>> 分隔，
+  模型输出一个 JSON 数组，每个元素带 "doc": N 注明来源，按编号拆回各篇，编号不对的元素丢弃，超出数量的截掉
+合并请求共用同一段静态提示词前缀（见 03 的 PROMPT_PREFIX），服务端的前缀缓存也能命中
+"""
+import threading
+from concurrent.futures import Future, TimeoutError
+
+DOC_MARK = "<<<文档 {n}>>>"
+
+
+def pack_documents(texts):
+    """把多篇文本按编号（从 1 开始）拼成一段"""
+    return "\n\n".join(DOC_MARK.format(n=i) + "\n" + text.strip() for i, text in enumerate(texts, 1))
+
+
+def split_by_doc(items, counts):
+    """
+    按 doc 编号把合并输出拆回各篇；counts 为各篇需要的数量
+    返回每篇的问答对列表（去掉 doc 字段）
+    """
+    out = [[] for _ in counts]
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        try:
+            n = int(str(item.get("doc", "")).strip()) - 1
+        except ValueError:
+            continue
+        if 0 <= n < len(counts) and len(out[n]) < counts[n]:
+            out[n].append({k: v for k, v in item.items() if k != "doc"})
+    return out
+
+
+class RequestPacker:
+    """
+    send(items)：把一包条目合成一次请求发出，返回与 items 等长的结果列表；抛出异常时这一包的调用方都收到该异常
+    max_items：每包最多条目数；max_tokens：每包条目 token 数之和的上限（单条超过上限时单独成包）
+    linger：包没攒满时最多等多久就发出；stats：包数与条目数
+    """
+
+    def __init__(self, send, max_items=8, max_tokens=6000, linger=0.2):
+        self.send = send
+        self.max_items = max(1, max_items)
+        self.max_tokens = max_tokens
+        self.linger = linger
+        self.lock = threading.Lock()
+        self.pending = []
+        self.pending_tokens = 0
+        self.stats = {"packs": 0, "items": 0}
+
+    def _take(self):
+        batch, self.pending, self.pending_tokens = self.pending, [], 0
+        return batch
+
+    def _send(self, batch):
+        with self.lock:
+            self.stats["packs"] += 1
+            self.stats["items"] += len(batch)
+        try:
+            results = self.send([item for item, _ in batch])
+        except BaseException as e:
+            for _, fut in batch:
+                fut.set_exception(e)
+            return
+        for (_, fut), result in zip(batch, results):
+            fut.set_result(result)
+
+    def run(self, item, tokens):
+        """提交一个条目并等到它所在的包完成，返回它自己的结果"""
+        fut = Future()
+        full = None
+        with self.lock:
+            if self.pending and self.pending_tokens + tokens > self.max_tokens:
+                full = self._take()  # 加上这一条会超限：先把已攒的发出去
+            self.pending.append((item, fut))
+            self.pending_tokens += tokens
+            mine = self._take() if len(self.pending) >= self.max_items else None
+        if full:
+            self._send(full)
+        if mine:
+            self._send(mine)
+        try:
+            return fut.result(timeout=self.linger)
+        except TimeoutError:
+            pass
+        # 等够了还没人发：自己所在的包仍在攒着，就由自己发出
+        with self.lock:
+            batch = self._take() if any(f is fut for _, f in self.pending) else None
+        if batch:
+            self._send(batch)
+        return fut.result()
@@ -0,0 +1,129 @@
+"""
+问答数量策略：决定每个文档、每个分块生成多少个问答对，以及给多少输出 token（max_tokens）
+- SizePolicy：原来的做法，按文件字节数分档定总数，再按各块 token 数分配；max_tokens 固定
+- DensityPolicy：先快速估计文档里“不重复的信息量”再定数量，避免按字节数计时的几种偏差：
+  表格（TSV）单元格里大量重复的单位、编号，页眉页脚和模板套话，中文与英文字节数/信息量不对等
+  · 句子去重：按句末标点与换行切句，归一化后重复出现的句子（含分块之间的重叠）只计一次
+  · token 数：qa_engine.estimate_tokens（中日韩 1 字 1 token，其余约 4 字符 1 token）
+  · 压缩率：去重后文本的 zlib 压缩率，越低说明越多近似重复的内容，信息量按比例打折
+  每块按它新增的信息量分配问答对，max_tokens 按该块的问答数给，TPM 配额不再为空余的输出预留
+用法：policy.plan(text, chunks, file_size) → (每块问答数, 每块 max_tokens, 统计信息)
+"""
+import re
+import zlib
+
+from qa_chunking import allocate_qa_counts
+from qa_dedup import normalize
+from qa_engine import estimate_tokens
+
+# 切句：句末标点与换行；表格一行算一句
+_SENTENCE = re.compile(r"[。！？；!?;\n]+")
+
+
+def decide_qa_count(file_size_bytes):
+    """按文件大小分档决定问答对数量（SizePolicy 使用）"""
+    kb = file_size_bytes / 1024
+    if kb < 5:
+        return 5
+    elif kb < 20:
+        return 10
+    elif kb < 50:
+        return 15
+    elif kb < 100:
+        return 20
+    elif kb < 300:
+        return 30
+    elif kb < 600:
+        return 40
+    else:
+        return 50
+
+
+def sentences(text):
+    return [s for s in _SENTENCE.split(text) if s.strip()]
+
+
+def compression_ratio(text):
+    """zlib 压缩后与原始 UTF-8 字节数之比；空文本返回 1"""
+    raw = text.encode("utf-8")
+    if not raw:
+        return 1.0
+    return len(zlib.compress(raw, 1)) / len(raw)
+
+
+class SizePolicy:
+    """原来的按字节数分档；max_tokens 固定为 max_tokens"""
+
+    name = "size"
+
+    def __init__(self, max_per_chunk=15, max_tokens=2048):
+        self.max_per_chunk = max_per_chunk
+        self.max_tokens = max_tokens
+
+    def plan(self, text, chunks, file_size=None):
+        size = file_size if file_size is not None else len(text.encode("utf-8"))
+        total = decide_qa_count(size)
+        counts = allocate_qa_counts(chunks, total, self.max_per_chunk)
+        return counts, [self.max_tokens] * len(chunks), {"target": sum(counts)}
+
+
+class DensityPolicy:
+    """
+    tokens_per_pair：每多少“有效 token”出一个问答对
+    reference_ratio：正常行文的压缩率，低于它的部分按比例打折（高于它不加分）
+    min_pairs / max_pairs：单个文档的问答数下限 / 上限
+    pair_tokens / base_tokens：每块 max_tokens = base_tokens + 问答数 × pair_tokens，不超过 max_tokens
+    """
+
+    name = "density"
+
+    def __init__(self, tokens_per_pair=300, reference_ratio=0.35, min_pairs=3, max_pairs=50,
+                 max_per_chunk=15, pair_tokens=130, base_tokens=100, max_tokens=2048):
+        self.tokens_per_pair = tokens_per_pair
+        self.reference_ratio = reference_ratio
+        self.min_pairs = min_pairs
+        self.max_pairs = max_pairs
+        self.max_per_chunk = max_per_chunk
+        self.pair_tokens = pair_tokens
+        self.base_tokens = base_tokens
+        self.max_tokens = max_tokens
+
+    def chunk_weights(self, chunks):
+        """每块新增的有效 token 数：前面出现过的句子不再计，再按该块新内容的压缩率打折"""
+        seen = set()
+        weights = []
+        stats = {"sentences": 0, "unique_sentences": 0, "tokens": 0, "unique_tokens": 0}
+        for chunk in chunks:
+            fresh = []
+            for s in sentences(chunk):
+                stats["sentences"] += 1
+                key = normalize(s)
+                if not key or key in seen:
+                    continue
+                seen.add(key)
+                fresh.append(s)
+            stats["unique_sentences"] += len(fresh)
+            stats["tokens"] += estimate_tokens(chunk)
+            text = "\n".join(fresh)
+            tokens = estimate_tokens(text)
+            stats["unique_tokens"] += tokens
+            factor = min(1.0, compression_ratio(text) / self.reference_ratio) if tokens else 0.0
+            weights.append(tokens * factor)
+        return weights, stats
+
+    def plan(self, text, chunks, file_size=None):
+        weights, stats = self.chunk_weights(chunks)
+        content = sum(weights)
+        total = round(content / self.tokens_per_pair)
+        total = max(self.min_pairs, min(self.max_pairs, total)) if content else 0
+        counts = allocate_qa_counts(chunks, total, self.max_per_chunk, weights=weights)
+        budgets = [min(self.max_tokens, self.base_tokens + n * self.pair_tokens) for n in counts]
+        stats.update(target=sum(counts), content_tokens=round(content))
+        return counts, budgets, stats
+
+
+POLICIES = {"size": SizePolicy, "density": DensityPolicy}
+
+
+def make_policy(name, **options):
+    return POLICIES[name](**options)
@@ -0,0 +1,275 @@
+"""
+问答生成的提示词配置（profile）与按目录/文件名的路由
+- PromptProfile：一类文档的系统提示词、静态前缀（角色、任务、涵盖范围与规则）及各自的并发与 token 预算；
+  单篇与合并请求的模板在创建时就拼好并预编译（拆成字面量与字段），每次请求只做拼接，不再解析格式串
+- PROFILES：运行知识（operations）、政策/法规/标准（policy）、科研论文（papers）、设备维修（maintenance）
+- ROUTES：(通配符, 配置名) 按顺序匹配，第一个匹配的生效，都不匹配时用 DEFAULT_PROFILE；不区分大小写
+  不含 / 的通配符只匹配文件夹名（所在文件夹；给定根目录时为根目录名及其下各级子文件夹），不看文件名，
+  例如 "*标准*" 让“国家标准/”下的文件用 policy，而“运行规范.txt”这样的文件名不受影响；
+  含 / 的通配符匹配完整的“所在文件夹/文件名”（给定根目录时为“根目录名/相对路径”），要按文件名路由时这样写，
+  例如 ("*/*规范*.txt", "policy")
+同一配置的所有请求前缀逐字节相同，服务端的前缀缓存照常命中；不同配置的小文本不会合并进同一个请求
+"""
+import string
+import threading
+from contextlib import contextmanager
+from fnmatch import fnmatch
+from pathlib import Path
+
+from qa_engine import TokenBucket, estimate_tokens
+
+# 单篇请求：{qa_count} 与 {text} 在调用时填入（模板本身参与缓存键计算）
+SINGLE_TAIL = (
+    "输出：\n"
+    "生成至少 {qa_count} 个问答对，仅返回一个 JSON 数组，例如：\n"
+    "[\n"
+    '{{"question":"...", "answer":"..."}},\n'
+    "...\n"
+    "]\n"
+    "文本：\n"
+    "{text}"
+)
+# 合并请求（见 qa_packing.py）：{docs} 篇数，{spec} 各篇数量，{text} 为带 <<<文档 N>>> 分隔的全部文本
+PACKED_TAIL = (
+    "输出：\n"
+    "下面有 {docs} 篇相互独立的文本，每篇以 <<<文档 N>>> 开头。各篇需要的问答对数量：{spec}。\n"
+    "每个问答对只能基于它所属的那一篇文本。把全部问答对放在一个 JSON 数组里返回，每个元素用 doc 注明文档编号，例如：\n"
+    "[\n"
+    '{{"doc":1, "question":"...", "answer":"..."}},\n'
+    "...\n"
+    "]\n"
+    "文本：\n"
+    "{text}"
+)
+
+
+class CompiledTemplate:
+    """str.format 模板预先拆成 (字面量, 字段名) 序列；render() 与 template.format() 结果相同（只支持简单的 {name} 字段）"""
+
+    def __init__(self, template):
+        self.template = template
+        self.parts = []
+        for literal, field, spec, conversion in string.Formatter().parse(template):
+            if spec or conversion:
+                raise ValueError(f"模板字段不支持格式说明或转换：{{{field}}}")
+            self.parts.append((literal, field))
+        self.fields = {f for _, f in self.parts if f is not None}
+
+    def render(self, **values):
+        out = []
+        for literal, field in self.parts:
+            out.append(literal)
+            if field is not None:
+                out.append(str(values[field]))
+        return "".join(out)
+
+    def __str__(self):
+        return self.template
+
+
+class PromptProfile:
+    """
+    name：配置名；prefix：静态前缀；system：系统提示词
+    concurrency：该配置同时在途的请求数上限（None 表示只受引擎的 CONCURRENCY 约束）
+    tpm：该配置每分钟 token 上限（输入 + 最大输出，None 表示只受引擎的 TPM_LIMIT 约束）
+    max_tokens：该配置单次请求的输出上限，问答策略算出的每块预算超过它时截到它
+    policy：该配置专用的问答数量策略（见 qa_policy.py），None 表示用 03 的 QA_POLICY
+    """
+
+    def __init__(self, name, prefix, system, concurrency=None, tpm=None, max_tokens=2048, policy=None):
+        self.name = name
+        self.prefix = prefix
+        self.system = system
+        self.template = prefix + SINGLE_TAIL        # 原始模板字符串，参与缓存键计算
+        self.single = CompiledTemplate(self.template)
+        self.packed = CompiledTemplate(prefix + PACKED_TAIL)
+        self.prefix_tokens = estimate_tokens(system + prefix)
+        self.concurrency = concurrency
+        self.tpm = tpm
+        self.max_tokens = max_tokens
+        self.policy = policy
+        self.slots = threading.BoundedSemaphore(concurrency) if concurrency else None
+        self.bucket = TokenBucket(tpm) if tpm else None
+        self.lock = threading.Lock()
+        self.stats = {"files": 0, "requests": 0, "tokens": 0}
+
+    def render(self, qa_count, text):
+        return self.single.render(qa_count=qa_count, text=text)
+
+    def render_packed(self, docs, spec, text):
+        return self.packed.render(docs=docs, spec=spec, text=text)
+
+    def budget(self, max_tokens):
+        return min(max_tokens, self.max_tokens) if self.max_tokens else max_tokens
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = dict.fromkeys(self.stats, 0)
+
+    def count_file(self):
+        with self.lock:
+            self.stats["files"] += 1
+
+    @contextmanager
+    def limit(self, tokens):
+        """在该配置的 token 预算与并发上限内发一次请求（引擎自身的限流仍然生效）"""
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["tokens"] += tokens
+        if self.bucket is not None:
+            self.bucket.acquire(tokens)
+        if self.slots is None:
+            yield
+            return
+        with self.slots:
+            yield
+
+    def __repr__(self):
+        return f"PromptProfile({self.name!r})"
+
+
+OPERATIONS = PromptProfile(
+    "operations",
+    prefix=(
+        "您是一位负责生成中文污水处理运行知识问答对的助手。\n\n"
+        "任务：\n"
+        "根据给出的文本，生成信息丰富、不冗余且严格基于文本的问答对。\n\n"
+        "涵盖范围：\n"
+        "- 定义/概念\n"
+        "- 原理/机制\n"
+        "- 工艺流程/步骤\n"
+        "- 效益/适用性\n"
+        "- 注意事项/限制/安全须知\n"
+        "- 常见问题/故障模式\n"
+        "- 控制策略/故障排除措施\n"
+        "规则：\n"
+        "1) 请勿添加文本中未提及的信息。请勿推断缺失的细节。\n"
+        "2) 请用中文撰写。\n"
+        "3) 优先选择涵盖关键原理和概念的问题，以及具有高度实用性和可操作性的问题（例如，参数、运行条件、程序/步骤、异常情况、可能原因、纠正措施和检查）。\n"
+        "4) 避免重复或近似重复；每个问答对应针对一个不同的要点。\n"
+        "5) 答案应简洁明了。请完全保留文本中的数字、单位和条件。\n"
+    ),
+    system='You are a question-answer pair generation assistant for Chinese wastewater-treatment operational knowledge.',
+)
+
+# 原来只写在 03 文档字符串里的政策问答提示词
+POLICY = PromptProfile(
+    "policy",
+    prefix=(
+        "您是中文污水处理政策/法规/标准问答生成助手。\n\n"
+        "任务：\n"
+        "根据给出的文本，生成高质量问答对，确保问答内容严格基于文本。\n\n"
+        "内容范围：\n"
+        "- 适用范围/适用性\n"
+        "- 主要要求\n"
+        "- 指标限值/阈值（包括单位和条件）\n"
+        "- 职责/角色\n"
+        "- 实施程序/工作流程（包括报告/记录/验收，如有提及）\n"
+        "规则：\n"
+        "1) 请勿添加文本中未提及的信息。如果文本中没有某个细节，请勿推断。\n"
+        "2) 请用中文撰写。\n"
+        '3) 优先选择可检查合规性的问题（例如，"应当/不应当"、"必须/不得"、"限值/阈值"、"监测/采样频率"、"责任方/实体"、"程序步骤/工作流程"）。\n'
+        "4) 避免重复或近似重复；每个问答对应针对不同的条款/要点。\n"
+        "5) 答案务必简洁明了。请完全保留原文中的数字、单位和条件。\n"
+    ),
+    system='您是中文污水处理政策/法规/标准问答生成助手。',
+    concurrency=4,
+)
+
+PAPERS = PromptProfile(
+    "papers",
+    prefix=(
+        "您是一位负责根据中文污水处理科研论文生成问答对的助手。\n\n"
+        "任务：\n"
+        "根据给出的论文文本，生成信息丰富、不冗余且严格基于文本的问答对。\n\n"
+        "涵盖范围：\n"
+        "- 研究对象/背景与要解决的问题\n"
+        "- 材料/方法/实验设计（包括工况与参数）\n"
+        "- 关键结果/数据（包括单位和条件）\n"
+        "- 机理/原因解释\n"
+        "- 结论/适用条件/局限性\n"
+        "规则：\n"
+        "1) 请勿添加文本中未提及的信息。请勿推断缺失的细节。\n"
+        "2) 请用中文撰写。\n"
+        "3) 优先选择有明确结论或数据支撑的问题；不要生成关于作者、单位、基金、期刊或参考文献的问题。\n"
+        "4) 避免重复或近似重复；每个问答对应针对一个不同的要点。\n"
+        "5) 答案应简洁明了。请完全保留文本中的数字、单位和条件。\n"
+    ),
+    system='You are a question-answer pair generation assistant for Chinese wastewater-treatment research papers.',
+    concurrency=3,
+    tpm=200000,     # 论文篇幅长，单独限额，避免挤占其他配置的 TPM_LIMIT
+)
+
+MAINTENANCE = PromptProfile(
+    "maintenance",
+    prefix=(
+        "您是一位负责生成中文污水处理设备维修保养问答对的助手。\n\n"
+        "任务：\n"
+        "根据给出的文本，生成信息丰富、不冗余且严格基于文本的问答对。\n\n"
+        "涵盖范围：\n"
+        "- 设备组成/结构/工作原理\n"
+        "- 点检/保养项目与周期\n"
+        "- 故障现象/可能原因/排除步骤\n"
+        "- 拆装/更换/调试的操作步骤与技术要求\n"
+        "- 安全操作/停机挂牌/防护措施\n"
+        "规则：\n"
+        "1) 请勿添加文本中未提及的信息。请勿推断缺失的细节。\n"
+        "2) 请用中文撰写。\n"
+        "3) 优先选择现场可直接执行的问题（例如，检查项目、判定标准、操作顺序、扭矩/间隙/油位等数值、更换周期）。\n"
+        "4) 避免重复或近似重复；每个问答对应针对一个不同的要点。\n"
+        "5) 答案应简洁明了。步骤按原文顺序给出，请完全保留文本中的数字、单位和条件。\n"
+    ),
+    system='You are a question-answer pair generation assistant for Chinese wastewater-treatment equipment maintenance.',
+    concurrency=4,
+)
+
+PROFILES = {p.name: p for p in (OPERATIONS, POLICY, PAPERS, MAINTENANCE)}
+DEFAULT_PROFILE = "operations"
+
+# 路由规则：按顺序匹配，第一个命中的生效；默认只按文件夹名路由（见文件开头说明）
+ROUTES = [
+    ("*standard*", "policy"),
+    ("*policy*", "policy"),
+    ("*标准*", "policy"),
+    ("*规范*", "policy"),
+    ("*法规*", "policy"),
+    ("*政策*", "policy"),
+    ("*paper*", "papers"),
+    ("*论文*", "papers"),
+    ("*weixiu*", "maintenance"),
+    ("*维修*", "maintenance"),
+    ("*检修*", "maintenance"),
+    ("*保养*", "maintenance"),
+]
+
+
+def get_profile(profile):
+    """配置名或 PromptProfile 转为 PromptProfile；未知的名字抛出 KeyError"""
+    if isinstance(profile, PromptProfile):
+        return profile
+    if profile not in PROFILES:
+        raise KeyError(f"未知的提示词配置：{profile}（可选 {', '.join(PROFILES)}）")
+    return PROFILES[profile]
+
+
+def route_key(path, root=None):
+    """含 / 的通配符匹配的字符串：有根目录时为“根目录名/相对路径”，否则为“所在文件夹名/文件名”"""
+    path = Path(path)
+    if root is not None:
+        root = Path(root)
+        try:
+            return (Path(root.name) / path.relative_to(root)).as_posix()
+        except ValueError:
+            pass
+    return f"{path.parent.name}/{path.name}"
+
+
+def route(path, routes=None, default=None, root=None):
+    """按路由规则为一个文件选择提示词配置"""
+    key = route_key(path, root).lower()
+    folders = key.split("/")[:-1]
+    for pattern, name in (ROUTES if routes is None else routes):
+        pattern = pattern.lower()
+        if fnmatch(key, pattern) if "/" in pattern else any(fnmatch(f, pattern) for f in folders):
+            return get_profile(name)
+    return get_profile(default or DEFAULT_PROFILE)
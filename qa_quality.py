@@ -0,0 +1,229 @@
+"""
+问答对质量过滤（numpy 向量化批量打分）
+每个问答对的分数：
+- q_chars / a_chars：问题、答案的字数（不含空白）；answer_ratio = 答案字数 / 问题字数，过小多为敷衍或答非所问
+- cjk：问题 + 答案里汉字占非空白字符的比例，过低说明输出不是中文
+- overlap：答案的字符二元组（去掉空白和标点后）出现在来源分块里的比例，过低说明答案不是基于原文
+- numbers：答案里的数值（连同紧跟的单位，如 2 mg/L、95%）在来源分块里能找到的比例；提示词要求原样保留数字、单位和条件
+没有来源文本时（对已生成的数据集单独过滤）overlap 与 numbers 记为 1，不参与判断
+实现：一批文本用 \\0 拼接后统一 NFKC、小写，一次编码成 UTF-32 码点数组，按分隔符得到每个字符属于哪条文本；
+各项计数都是整批数组运算 + bincount，二元组与数值串编码成带来源编号的 64 位键后用 np.isin 一次查表
+用法：python qa_quality.py 文件 [文件 ...]，在原文件旁写出 xxx.filtered.json(l)，被拒的记录及原因写到 xxx.rejected.jsonl
+"""
+import sys
+import threading
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+
+from dataset_io import iter_records, write_records
+
+# 判定阈值：低于（不满足）任一项即拒绝
+THRESHOLDS = {
+    "min_question_chars": 5,
+    "min_answer_chars": 4,
+    "min_answer_ratio": 0.1,
+    "min_cjk": 0.3,
+    "min_overlap": 0.4,
+    "min_numbers": 1.0,
+}
+# 每批打分的问答对数（来源编号占 22 位，一批内不同来源不超过 400 万）
+BATCH_SIZE = 200000
+
+# 拒绝原因，与判定顺序一致
+REASONS = ["short_question", "short_answer", "answer_ratio", "not_chinese", "not_grounded", "numbers_changed"]
+
+_SPACE = np.array([9, 10, 11, 12, 13, 32], dtype=np.uint32)
+# 数值后面可以紧跟的单位字符（小写后）：字母、/、%、‰、°、℃、μ、·、上标²³
+_UNIT = np.array([ord(c) for c in "/%‰°℃μ·²³"], dtype=np.uint32)
+_POW_BASE = np.uint64(0x100000001B3)
+_SID_SHIFT = np.uint64(42)  # 二元组占低 42 位（两个 21 位码点），来源编号放在高位
+
+
+def _encode(texts):
+    """整批文本 → (码点数组, 每个码点属于第几条文本)；统一 NFKC 与小写"""
+    joined = unicodedata.normalize("NFKC", "\0".join(t.replace("\0", " ") for t in texts)).lower()
+    codes = np.frombuffer(joined.encode("utf-32-le"), dtype=np.uint32)
+    sep = codes == 0
+    owner = np.cumsum(sep)
+    keep = ~sep
+    return codes[keep], owner[keep]
+
+
+def _is_cjk(codes):
+    return ((codes >= 0x4E00) & (codes <= 0x9FFF)) | ((codes >= 0x3400) & (codes <= 0x4DBF))
+
+
+def _is_word(codes):
+    """参与二元组的字符：汉字、数字、字母（标点、符号、空白不算）"""
+    ascii_alnum = ((codes >= 48) & (codes <= 57)) | ((codes >= 97) & (codes <= 122))
+    other_letter = (codes >= 0xC0) & ~((codes >= 0x2000) & (codes <= 0x2BFF)) & ~((codes >= 0x3000) & (codes <= 0x303F)) \
+        & ~((codes >= 0xFF00) & (codes <= 0xFFEF))
+    return ascii_alnum | _is_cjk(codes) | other_letter
+
+
+def _bigram_keys(codes, owner, sid):
+    """相邻两个有效字符组成的二元组键（同一条文本内），高位带上该文本的来源编号；返回 (键, 所属文本)"""
+    word = _is_word(codes)
+    w, wo = codes[word].astype(np.uint64), owner[word]
+    same = wo[1:] == wo[:-1]
+    keys = (w[:-1][same] << np.uint64(21)) | w[1:][same]
+    who = wo[:-1][same]
+    return keys | (sid[who].astype(np.uint64) << _SID_SHIFT), who
+
+
+def _number_keys(codes, owner, sid):
+    """数值串（数字、小数点及紧跟的单位，从第一个数字开始的连续一段；数字与单位之间的空格忽略）的哈希键；返回 (键, 所属文本)"""
+    space = np.isin(codes, _SPACE)
+    after_digit = np.zeros_like(space)
+    after_digit[1:] = (codes[:-1] >= 48) & (codes[:-1] <= 57)
+    keep = ~(space & after_digit)
+    codes, owner = codes[keep], owner[keep]
+    digit = (codes >= 48) & (codes <= 57)
+    part = digit | (codes == 46) | ((codes >= 97) & (codes <= 122)) | np.isin(codes, _UNIT)
+    idx = np.flatnonzero(part)
+    if not idx.size:
+        return np.zeros(0, np.uint64), np.zeros(0, np.int64)
+    # 先按“连续且同一条文本”切成段，段内第一个数字之前的字母（如 cod50 里的 cod）不算
+    brk = np.ones(idx.size, dtype=bool)
+    brk[1:] = (np.diff(idx) != 1) | (owner[idx[1:]] != owner[idx[:-1]])
+    run = np.cumsum(brk) - 1
+    seen = np.cumsum(digit[idx])
+    before = np.concatenate(([0], seen))[np.flatnonzero(brk)][run]
+    idx = idx[seen - before > 0]
+    if not idx.size:
+        return np.zeros(0, np.uint64), np.zeros(0, np.int64)
+    brk = np.ones(idx.size, dtype=bool)
+    brk[1:] = (np.diff(idx) != 1) | (owner[idx[1:]] != owner[idx[:-1]])
+    starts = np.flatnonzero(brk)
+    run = np.cumsum(brk) - 1
+    pos = np.arange(idx.size) - starts[run]
+    with np.errstate(over="ignore"):
+        powers = np.cumprod(np.full(int(pos.max()) + 1, _POW_BASE, dtype=np.uint64))
+        h = np.add.reduceat(codes[idx].astype(np.uint64) * powers[pos], starts)
+        who = owner[idx[starts]]
+        h = h * _POW_BASE + sid[who].astype(np.uint64)
+    return h, who
+
+
+def _hit_ratio(keys, who, table, n):
+    """每条文本的键在 table 里出现的比例；没有键的文本记 1"""
+    total = np.bincount(who, minlength=n)
+    hits = np.bincount(who, weights=np.isin(keys, table), minlength=n)
+    return np.where(total > 0, hits / np.maximum(total, 1), 1.0)
+
+
+def score(questions, answers, sources=None, source_ids=None):
+    """
+    对一批问答对打分，返回 {分数名: numpy 数组}
+    sources：来源文本列表；source_ids：每个问答对对应的来源下标（与 questions 等长）
+    """
+    n = len(questions)
+    qc, qo = _encode(questions)
+    ac, ao = _encode(answers)
+    q_space = np.isin(qc, _SPACE)
+    a_space = np.isin(ac, _SPACE)
+    q_chars = np.bincount(qo[~q_space], minlength=n)
+    a_chars = np.bincount(ao[~a_space], minlength=n)
+    cjk = np.bincount(qo, weights=_is_cjk(qc), minlength=n) + np.bincount(ao, weights=_is_cjk(ac), minlength=n)
+    scores = {
+        "q_chars": q_chars,
+        "a_chars": a_chars,
+        "answer_ratio": a_chars / np.maximum(q_chars, 1),
+        "cjk": cjk / np.maximum(q_chars + a_chars, 1),
+        "overlap": np.ones(n),
+        "numbers": np.ones(n),
+    }
+    if sources is None or n == 0:
+        return scores
+    # 只编码这一批用到的来源，并重新编号
+    used, local = np.unique(np.asarray(source_ids, dtype=np.int64), return_inverse=True)
+    sc, so = _encode([sources[i] for i in used])
+    src_sid = np.arange(len(used))
+    bk, bwho = _bigram_keys(ac, ao, local)
+    scores["overlap"] = _hit_ratio(bk, bwho, np.unique(_bigram_keys(sc, so, src_sid)[0]), n)
+    nk, nwho = _number_keys(ac, ao, local)
+    scores["numbers"] = _hit_ratio(nk, nwho, np.unique(_number_keys(sc, so, src_sid)[0]), n)
+    return scores
+
+
+class QualityFilter:
+    """按阈值判定并分流；stats 累计保留数、拒绝数与各原因的次数"""
+
+    def __init__(self, thresholds=None, batch_size=BATCH_SIZE):
+        self.thresholds = dict(THRESHOLDS, **(thresholds or {}))
+        self.batch_size = batch_size
+        self.stats = {"kept": 0, "rejected": 0, **dict.fromkeys(REASONS, 0)}
+        self.lock = threading.Lock()  # 03 里多个文件并发过滤，共用一份统计
+
+    def reasons(self, scores):
+        """每个问答对的拒绝原因位掩码（0 为通过）"""
+        t = self.thresholds
+        checks = [
+            scores["q_chars"] < t["min_question_chars"],
+            scores["a_chars"] < t["min_answer_chars"],
+            scores["answer_ratio"] < t["min_answer_ratio"],
+            scores["cjk"] < t["min_cjk"],
+            scores["overlap"] < t["min_overlap"],
+            scores["numbers"] < t["min_numbers"],
+        ]
+        mask = np.zeros(len(scores["q_chars"]), dtype=np.int64)
+        for bit, failed in enumerate(checks):
+            mask |= failed.astype(np.int64) << bit
+        return mask
+
+    def split(self, records, sources=None, source_ids=None):
+        """
+        records：Alpaca 记录列表（instruction 为问题，output 为答案）
+        返回 (保留的记录, 被拒的报告条目)；报告条目含原记录、原因与各项分数
+        """
+        kept, rejected = [], []
+        for start in range(0, len(records), self.batch_size):
+            batch = records[start:start + self.batch_size]
+            ids = source_ids[start:start + self.batch_size] if source_ids is not None else None
+            scores = score([str(r.get("instruction", "")) for r in batch], [str(r.get("output", "")) for r in batch],
+                           sources, ids)
+            mask = self.reasons(scores)
+            with self.lock:
+                for bit, name in enumerate(REASONS):
+                    self.stats[name] += int(np.count_nonzero(mask & (1 << bit)))
+            for i in np.flatnonzero(mask == 0):
+                kept.append(batch[i])
+            for i in np.flatnonzero(mask):
+                rejected.append({
+                    "record": batch[i],
+                    "reasons": [name for bit, name in enumerate(REASONS) if mask[i] & (1 << bit)],
+                    "scores": {k: round(float(v[i]), 3) for k, v in scores.items()},
+                })
+        with self.lock:
+            self.stats["kept"] += len(kept)
+            self.stats["rejected"] += len(rejected)
+        return kept, rejected
+
+    def summary(self):
+        total = self.stats["kept"] + self.stats["rejected"]
+        detail = "，".join(f"{name} {self.stats[name]}" for name in REASONS if self.stats[name])
+        return f"保留 {self.stats['kept']}/{total}，拒绝 {self.stats['rejected']}" + (f"（{detail}）" if detail else "")
+
+
+def filter_file(src, dst, report, quality=None):
+    """过滤已生成的数据集（没有来源文本，只看长度与中文比例）；返回 (保留条数, 拒绝条数)"""
+    quality = quality or QualityFilter()
+    kept, rejected = quality.split(list(iter_records(src)))
+    write_records(dst, kept)
+    if rejected:
+        write_records(report, rejected)
+    return len(kept), len(rejected)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("用法：python qa_quality.py 文件 [文件 ...]")
+        sys.exit(1)
+    quality = QualityFilter()
+    for path in map(Path, sys.argv[1:]):
+        out = path.with_name(f"{path.stem}.filtered{path.suffix}")
+        kept, rejected = filter_file(path, out, path.with_name(f"{path.stem}.rejected.jsonl"), quality)
+        print(f"✅ {path.name} → {out.name} | 保留 {kept}，拒绝 {rejected}")
+    print(f"📊 {quality.summary()}")
@@ -0,0 +1,238 @@
+"""
+打包的二进制数据集格式（.rstore 目录），可内存映射，按下标 O(1) 随机访问
+目录结构：
+- meta.json：格式版本、记录数、列名
+- <列>.bin：该列全部字符串的 UTF-8 字节依次拼接
+- <列>.off：小端 uint64 偏移数组（记录数 + 1 个），第 i 条记录的该列为 bin[off[i]:off[i+1]]
+列为 Alpaca 的 instruction / input / output，另有一列 _json：键顺序或取值类型与标准 Alpaca 不同的记录在这里存整条 JSON
+（其余列仍存该字段的字符串，按列读取不受影响），标准记录此列为空，导出时与原文件逐字节一致
+读取：偏移数组用 numpy.memmap、字符串区用 mmap，raw() 返回不复制的 memoryview，
+get()/column() 只解码请求的列，顺序遍历时除了返回的字符串外不为每条记录分配对象
+用法：
+  python record_store.py pack 输入.json(l) 输出.rstore
+  python record_store.py unpack 输入.rstore 输出.json(l)
+  python record_store.py get 输入.rstore 下标
+"""
+import json
+import mmap
+import shutil
+import sys
+from array import array
+from pathlib import Path
+
+import numpy as np
+
+from dataset_io import iter_records, open_writer
+
+FORMAT_VERSION = 1
+FIELDS = ("instruction", "input", "output")
+EXTRA = "_json"
+STORE_SUFFIX = ".rstore"
+# 写出时每攒够这么多条记录就把偏移刷到磁盘
+FLUSH_EVERY = 65536
+
+_OFFSET = np.dtype("<u8")
+
+
+def is_store(path):
+    return str(path).lower().rstrip("/\\").endswith(STORE_SUFFIX)
+
+
+class RecordStoreWriter:
+    """
+    流式写出一个 .rstore：先写到同级的 <名字>.tmp 目录，close() 时写 meta.json 再改名为目标目录；
+    with 块内出错时调用 abort()，删掉临时目录，原有的记录库保持不变
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.tmp = self.path.with_name(self.path.name + ".tmp")
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        self.tmp.mkdir(parents=True)
+        self.columns = FIELDS + (EXTRA,)
+        self.blobs = {c: open(self.tmp / f"{c}.bin", "wb") for c in self.columns}
+        self.offs = {c: open(self.tmp / f"{c}.off", "wb") for c in self.columns}
+        self.pos = dict.fromkeys(self.columns, 0)
+        self.pending = {c: array("Q", [0]) for c in self.columns}
+        self.count = 0
+
+    def write(self, record):
+        standard = isinstance(record, dict) and tuple(record) == FIELDS and all(isinstance(record[f], str) for f in FIELDS)
+        values = [record[f] if standard else _field_text(record, f) for f in FIELDS]
+        values.append("" if standard else json.dumps(record, ensure_ascii=False))
+        for c, value in zip(self.columns, values):
+            data = value.encode("utf-8")
+            self.blobs[c].write(data)
+            self.pos[c] += len(data)
+            self.pending[c].append(self.pos[c])
+        self.count += 1
+        if self.count % FLUSH_EVERY == 0:
+            self._flush()
+
+    def _flush(self):
+        for c in self.columns:
+            pending = self.pending[c]
+            if sys.byteorder != "little":
+                pending.byteswap()
+            pending.tofile(self.offs[c])
+            self.pending[c] = array("Q")
+
+    def _close_files(self):
+        for f in list(self.blobs.values()) + list(self.offs.values()):
+            f.close()
+
+    def close(self):
+        self._flush()
+        self._close_files()
+        meta = {"version": FORMAT_VERSION, "count": self.count, "columns": list(self.columns)}
+        (self.tmp / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.tmp.rename(self.path)
+
+    def abort(self):
+        """放弃写到一半的记录库：关闭文件并删除临时目录，不写 meta.json"""
+        self._close_files()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def _field_text(record, field):
+    """非标准记录的列值：字段是字符串时原样存，否则存空串（整条记录以 _json 为准）"""
+    value = record.get(field) if isinstance(record, dict) else None
+    return value if isinstance(value, str) else ""
+
+
+class RecordStore:
+    """只读打开一个 .rstore；支持 len()、store[i]（可为负下标）与 with"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        meta_path = self.path / "meta.json"
+        if not meta_path.exists():
+            raise FileNotFoundError(f"不是完整的记录库（缺少 meta.json）：{self.path}")
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        if meta["version"] != FORMAT_VERSION:
+            raise ValueError(f"不支持的记录库版本 {meta['version']}：{self.path}")
+        self.count = meta["count"]
+        self.columns = tuple(meta["columns"])
+        self._files = []
+        self.blobs = {}
+        self.offsets = {}
+        for c in self.columns:
+            f = open(self.path / f"{c}.bin", "rb")
+            self._files.append(f)
+            # 空文件不能 mmap，用空 bytes 代替
+            self.blobs[c] = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self._size(f) else b"")
+            self.offsets[c] = np.memmap(self.path / f"{c}.off", dtype=_OFFSET, mode="r", shape=(self.count + 1,))
+
+    @staticmethod
+    def _size(f):
+        f.seek(0, 2)
+        return f.tell()
+
+    def __len__(self):
+        return self.count
+
+    def _index(self, i):
+        if not self.blobs:
+            raise ValueError(f"记录库已关闭：{self.path}")
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(f"记录下标越界：{i}（共 {self.count} 条）")
+        return i
+
+    def raw(self, i, column):
+        """第 i 条记录某列的 UTF-8 字节（memoryview，不复制）"""
+        i = self._index(i)
+        off = self.offsets[column]
+        return self.blobs[column][int(off[i]):int(off[i + 1])]
+
+    def field(self, i, column):
+        return str(self.raw(i, column), "utf-8")
+
+    def get(self, i, fields=None):
+        """第 i 条记录；fields 为列名序列时只解码这些列，返回字典"""
+        i = self._index(i)
+        extra = self.field(i, EXTRA)
+        if extra:
+            record = json.loads(extra)
+            return record if fields is None or not isinstance(record, dict) else {f: record.get(f) for f in fields}
+        return {f: self.field(i, f) for f in (fields or FIELDS)}
+
+    def __getitem__(self, i):
+        return self.get(i)
+
+    def column(self, name, start=0, stop=None):
+        """按顺序产出某一列 [start, stop) 的字符串；偏移按块读出，逐条只做一次解码"""
+        stop = self.count if stop is None else min(stop, self.count)
+        blob = self.blobs[name]
+        offsets = self.offsets[name]
+        for block in range(start, stop, FLUSH_EVERY):
+            off = offsets[block:min(block + FLUSH_EVERY, stop) + 1].tolist()
+            for a, b in zip(off, off[1:]):
+                yield str(blob[a:b], "utf-8")
+
+    def __iter__(self):
+        """顺序产出全部记录（与 get() 相同的字典）"""
+        cols = [self.column(f) for f in FIELDS]
+        for values, extra in zip(zip(*cols), self.column(EXTRA)):
+            yield json.loads(extra) if extra else dict(zip(FIELDS, values))
+
+    def close(self):
+        for view in self.blobs.values():
+            obj = view.obj
+            view.release()
+            if isinstance(obj, mmap.mmap):
+                try:
+                    obj.close()
+                except BufferError:
+                    pass  # 调用方还持有 raw() 返回的 memoryview，映射随其释放
+        self.blobs = {}
+        self.offsets = {}
+        for f in self._files:
+            f.close()
+        self._files = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def pack(src, dst):
+    """把 Alpaca JSON 数组 / JSONL（或另一个 .rstore）打包成 .rstore，返回记录数"""
+    with RecordStoreWriter(dst) as writer:
+        for record in iter_records(src):
+            writer.write(record)
+    return writer.count
+
+
+def unpack(src, dst):
+    """把 .rstore 导出为 JSON 数组或 JSONL（按后缀），返回记录数"""
+    with RecordStore(src) as store, open_writer(dst) as writer:
+        for record in store:
+            writer.write(record)
+        return writer.count
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] not in ("pack", "unpack", "get"):
+        print("用法：python record_store.py pack|unpack 输入 输出，或 python record_store.py get 记录库 下标")
+        sys.exit(1)
+    command, src, dst = sys.argv[1:]
+    if command == "get":
+        with RecordStore(src) as store:
+            print(json.dumps(store[int(dst)], ensure_ascii=False, indent=2))
+    else:
+        n = (pack if command == "pack" else unpack)(src, dst)
+        print(f"✅ {src} → {dst}，共 {n} 条")
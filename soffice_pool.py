@@ -0,0 +1,269 @@
+"""
+LibreOffice 转换进程池：把大量 .doc 批量转成 .docx
+- 每个工作者有自己独立的用户配置目录（-env:UserInstallation），并发启动不再争抢同一个配置
+- 装有 LibreOffice 自带的 Python-UNO（import uno 成功）时：每个工作者常驻一个 headless soffice，
+  通过 UNO socket 逐个下发转换任务，只付一次启动开销
+- 否则退化为批量命令行：每次 soffice 调用转换一批文件，启动开销摊到整批
+- 健康检查 + 崩溃/卡死自动重启：单个文档超时会杀掉该实例并重启，出错的批次逐个文件重试一次，定位坏文件
+"""
+import queue
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+except ImportError:  # 普通 Python 环境没有 UNO，使用批量命令行模式
+    uno = None
+
+DOCX_FILTER = "MS Word 2007 XML"
+
+
+def find_soffice():
+    return shutil.which("soffice") or shutil.which("libreoffice")
+
+
+def converted_path(doc: Path) -> Path:
+    """与 02word_to_txt.soffice_convert_to_docx 相同的输出位置：源目录下的 _converted_docx/"""
+    return doc.parent / "_converted_docx" / (doc.stem + ".docx")
+
+
+def _prop(name, value):
+    p = PropertyValue()
+    p.Name, p.Value = name, value
+    return p
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class SofficeWorker:
+    """一个 LibreOffice 实例（独立配置目录）；UNO 可用时常驻，否则每批启动一次"""
+
+    def __init__(self, index, profile_root: Path, timeout=120, use_uno=None):
+        self.soffice = find_soffice()
+        if self.soffice is None:
+            raise RuntimeError("未检测到 soffice（LibreOffice）。请安装 LibreOffice 或在 Windows 上使用 Word。")
+        self.profile = Path(profile_root) / f"worker{index}"
+        self.profile.mkdir(parents=True, exist_ok=True)
+        self.timeout = timeout
+        self.use_uno = (uno is not None) if use_uno is None else use_uno
+        self.proc = None
+        self.desktop = None
+        self.restarts = 0
+
+    # ---------------- 常驻实例（UNO） ----------------
+
+    def start(self):
+        if not self.use_uno:
+            return
+        port = _free_port()
+        self.proc = subprocess.Popen([
+            self.soffice, "--headless", "--invisible", "--nologo", "--norestore", "--nodefault",
+            f"-env:UserInstallation={self.profile.as_uri()}",
+            f"--accept=socket,host=127.0.0.1,port={port};urp;StarOffice.ComponentContext",
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        local = uno.getComponentContext()
+        resolver = local.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", local)
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                ctx = resolver.resolve(f"uno:socket,host=127.0.0.1,port={port};urp;StarOffice.ComponentContext")
+                break
+            except Exception:
+                if self.proc.poll() is not None or time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError("LibreOffice 实例启动失败")
+                time.sleep(0.5)
+        self.desktop = ctx.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", ctx)
+
+    def stop(self):
+        if self.desktop is not None:
+            try:
+                self.desktop.terminate()
+            except Exception:
+                pass
+            self.desktop = None
+        if self.proc is not None:
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+            self.proc = None
+
+    def restart(self):
+        self.restarts += 1
+        if self.proc is not None:
+            self.proc.kill()
+            self.proc.wait()
+            self.proc = None
+        self.desktop = None
+        self.start()
+
+    def healthy(self):
+        """常驻实例：进程存活且 UNO 调用有响应；命令行模式：soffice 可执行文件仍在"""
+        if not self.use_uno:
+            return Path(self.soffice).exists()
+        if self.proc is None or self.proc.poll() is not None or self.desktop is None:
+            return False
+        try:
+            self.desktop.getComponents()
+            return True
+        except Exception:
+            return False
+
+    def _convert_uno(self, doc: Path, dst: Path):
+        # 看门狗：超时直接杀掉实例，阻塞中的 UNO 调用随之抛错
+        proc = self.proc
+        watchdog = threading.Timer(self.timeout, proc.kill)
+        watchdog.start()
+        try:
+            component = self.desktop.loadComponentFromURL(
+                uno.systemPathToFileUrl(str(doc.resolve())), "_blank", 0,
+                (_prop("Hidden", True), _prop("ReadOnly", True)))
+            try:
+                component.storeToURL(uno.systemPathToFileUrl(str(dst.resolve())),
+                                     (_prop("FilterName", DOCX_FILTER), _prop("Overwrite", True)))
+            finally:
+                component.close(True)
+        finally:
+            watchdog.cancel()
+        if proc.poll() is not None:
+            raise RuntimeError(f"转换超时（>{self.timeout} 秒）或 LibreOffice 崩溃")
+
+    # ---------------- 批量命令行 ----------------
+
+    def _convert_cli(self, docs, out_dir: Path):
+        cmd = [self.soffice, "--headless", "--norestore", "--nologo",
+               f"-env:UserInstallation={self.profile.as_uri()}",
+               "--convert-to", "docx", "--outdir", str(out_dir), *map(str, docs)]
+        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=self.timeout * len(docs))
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr or proc.stdout or f"soffice 退出码 {proc.returncode}")
+
+    # ---------------- 对外接口 ----------------
+
+    def convert_batch(self, docs):
+        """转换同一目录下的一批 .doc，返回 {doc: docx 路径或异常}"""
+        out_dir = converted_path(docs[0]).parent
+        out_dir.mkdir(parents=True, exist_ok=True)
+        # 先删掉上次留下的输出，之后存在的 docx 一定是这一批转换出来的
+        for doc in docs:
+            converted_path(doc).unlink(missing_ok=True)
+        results = {}
+        if self.use_uno:
+            for doc in docs:
+                if not self.healthy():
+                    self.restart()
+                try:
+                    self._convert_uno(doc, converted_path(doc))
+                    results[doc] = converted_path(doc)
+                except Exception as e:
+                    results[doc] = e
+                    self.restart()
+            return results
+
+        try:
+            self._convert_cli(docs, out_dir)
+            batch_error = None
+        except Exception as e:
+            batch_error = e
+        for doc in docs:
+            dst = converted_path(doc)
+            if dst.exists() and dst.stat().st_size > 0:
+                results[doc] = dst
+            elif batch_error is not None and len(docs) > 1:
+                # 整批失败（某个坏文件卡死/崩溃）：其余文件逐个重试一次
+                try:
+                    self._convert_cli([doc], out_dir)
+                    ok = dst.exists() and dst.stat().st_size > 0
+                    results[doc] = dst if ok else RuntimeError("LibreOffice 未生成输出文件")
+                except Exception as e:
+                    results[doc] = e
+            else:
+                results[doc] = batch_error or RuntimeError("LibreOffice 未生成输出文件")
+        return results
+
+
+class SofficePool:
+    """
+    固定数量的 LibreOffice 工作者，从队列领取按目录分组的批次
+    workers：实例数；batch_size：每批文件数；timeout：单个文档超时秒数
+    """
+
+    def __init__(self, workers=2, batch_size=20, timeout=120, profile_root=None, use_uno=None):
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.timeout = timeout
+        self.use_uno = use_uno
+        self._tmp = None
+        if profile_root is None:
+            self._tmp = tempfile.mkdtemp(prefix="soffice_profiles_")
+            profile_root = self._tmp
+        self.profile_root = Path(profile_root)
+
+    def _batches(self, docs):
+        by_dir = {}
+        for doc in docs:
+            by_dir.setdefault(converted_path(doc).parent, []).append(doc)
+        for group in by_dir.values():
+            for i in range(0, len(group), self.batch_size):
+                yield group[i:i + self.batch_size]
+
+    def convert_all(self, docs):
+        """转换全部 .doc，返回 {doc: docx 路径或异常}"""
+        docs = [Path(d) for d in docs]
+        if not docs:
+            return {}
+        jobs = queue.Queue()
+        for batch in self._batches(docs):
+            jobs.put(batch)
+        results = {}
+        lock = threading.Lock()
+
+        def run(index):
+            try:
+                worker = SofficeWorker(index, self.profile_root, self.timeout, self.use_uno)
+                worker.start()
+            except Exception as e:
+                # 实例起不来：把它本该处理的批次留给其他实例；全部起不来时由下面的兜底统一记失败
+                with lock:
+                    results.setdefault("_start_errors", []).append(e)
+                return
+            try:
+                while True:
+                    try:
+                        batch = jobs.get_nowait()
+                    except queue.Empty:
+                        return
+                    out = worker.convert_batch(batch)
+                    with lock:
+                        results.update(out)
+            finally:
+                worker.stop()
+
+        threads = [threading.Thread(target=run, args=(i,), daemon=True)
+                   for i in range(min(self.workers, jobs.qsize()))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        start_errors = results.pop("_start_errors", [])
+        for doc in docs:
+            if doc not in results:
+                results[doc] = start_errors[0] if start_errors else RuntimeError("未被转换")
+        return results
+
+    def close(self):
+        if self._tmp:
+            shutil.rmtree(self._tmp, ignore_errors=True)
+            self._tmp = None
@@ -0,0 +1,7 @@
+"""测试公共设置：把仓库根目录加入 sys.path，编号脚本（01…07）用 importlib.import_module 导入"""
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
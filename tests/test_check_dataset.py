@@ -0,0 +1,106 @@
+"""07check_dataset：格式判断、严格 UTF-8 解码（报告字节偏移）、顶层单个对象按“不是数组”报错"""
+import importlib
+import json
+
+import pytest
+
+check = importlib.import_module("07check_dataset")
+
+GOOD = {"instruction": "曝气池溶解氧控制在多少？", "input": "", "output": "2 mg/L 左右。"}
+
+
+def validate(path):
+    return check.validate_files([path], workers=1)[str(path)]
+
+
+def write_lines(path, items):
+    path.write_text("".join(json.dumps(x, ensure_ascii=False) + "\n" for x in items), encoding="utf-8")
+    return path
+
+
+def test_valid_array_and_jsonl(tmp_path):
+    array = tmp_path / "a.json"
+    array.write_text(json.dumps([GOOD] * 3, ensure_ascii=False, indent=2), encoding="utf-8")
+    report = validate(array)
+    assert (report["format"], report["records"], report["ok"]) == ("array", 3, True)
+
+    jsonl = write_lines(tmp_path / "b.jsonl", [GOOD] * 4)
+    report = validate(jsonl)
+    assert (report["format"], report["records"], report["ok"]) == ("jsonl", 4, True)
+
+
+def test_single_line_jsonl_is_still_jsonl(tmp_path):
+    report = validate(write_lines(tmp_path / "one.jsonl", [GOOD]))
+    assert (report["format"], report["records"], report["ok"]) == ("jsonl", 1, True)
+
+
+def test_jsonl_content_in_json_file(tmp_path):
+    report = validate(write_lines(tmp_path / "lines.json", [GOOD] * 2))
+    assert (report["format"], report["records"], report["ok"]) == ("jsonl", 2, True)
+
+
+@pytest.mark.parametrize("name, text", [
+    ("pretty.json", json.dumps(GOOD, ensure_ascii=False, indent=2)),
+    ("pretty.jsonl", json.dumps(GOOD, ensure_ascii=False, indent=2)),
+    ("single.json", json.dumps(GOOD, ensure_ascii=False) + "\n\n"),
+])
+def test_top_level_object_is_not_an_array(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text, encoding="utf-8")
+    report = validate(path)
+    assert report["format"] == "object"
+    assert not report["ok"]
+    assert "不是数组" in report["errors"][0]["error"]
+
+
+def test_jsonl_invalid_utf8_reports_byte_offset(tmp_path):
+    path = tmp_path / "bad.jsonl"
+    good = (json.dumps(GOOD, ensure_ascii=False) + "\n").encode("utf-8")
+    bad = b'{"instruction": "ab\xff", "output": "x"}\n'
+    path.write_bytes(good + bad + good)
+    report = validate(path)
+    assert report["records"] == 3
+    assert len(report["errors"]) == 1
+    err = report["errors"][0]
+    assert (err["line"], err["record"]) == (2, 2)
+    offset = len(good) + bad.index(b"\xff")
+    assert f"第{offset}字节" in err["error"]
+    assert "UTF-8" in err["error"]
+
+
+def test_jsonl_invalid_utf8_across_ranges(tmp_path, monkeypatch):
+    """按字节区间并行检查时，偏移仍是全文位置"""
+    monkeypatch.setattr(check, "RANGE_BYTES", 64)
+    path = tmp_path / "bad.jsonl"
+    good = (json.dumps(GOOD, ensure_ascii=False) + "\n").encode("utf-8")
+    bad = b'{"instruction": "\xc3(", "output": "x"}\n'
+    path.write_bytes(good * 5 + bad)
+    lines, records, errors = check.scan_jsonl_range(str(path), len(good) * 5, len(good) * 5 + len(bad))
+    assert (lines, records) == (1, 1)
+    offset = len(good) * 5 + bad.index(b"\xc3")
+    assert f"第{offset}字节" in errors[0]["error"]
+
+
+def test_array_invalid_utf8_reports_byte_offset(tmp_path):
+    path = tmp_path / "bad.json"
+    head = json.dumps([GOOD, GOOD], ensure_ascii=False, indent=2)[:-2].encode("utf-8")
+    data = head + b',\n  {"instruction": "\xe6\xb0", "output": "x"}\n]'
+    path.write_bytes(data)
+    report = validate(path)
+    assert report["format"] == "array"
+    assert not report["ok"]
+    err = report["errors"][0]
+    offset = data.rindex(b"\xe6\xb0")
+    assert f"第{offset}字节" in err["error"]
+    assert err["line"] == data.count(b"\n", 0, offset) + 1
+
+
+def test_first_invalid_utf8_across_blocks(tmp_path, monkeypatch):
+    path = tmp_path / "x.txt"
+    data = "汉字\n".encode("utf-8") * 300000 + b"\xff"
+    path.write_bytes(data)
+    offset, line, _ = check._first_invalid_utf8(str(path))
+    assert offset == len(data) - 1
+    assert line == 300001
+    path.write_bytes(data[:-1])
+    assert check._first_invalid_utf8(str(path)) is None
@@ -0,0 +1,90 @@
+"""04dataset_split.hash_split：读到一半失败的文件不留下部分记录、不登记清单，修好后下次运行补上"""
+import importlib
+import json
+import random
+
+import pytest
+
+from dataset_io import iter_records
+from pipeline_manifest import Manifest
+from qa_dedup import DedupIndex
+
+split = importlib.import_module("04dataset_split")
+
+
+WORDS = ("曝气池", "溶解氧", "污泥龄", "回流比", "混合液", "硝化", "反硝化", "二沉池", "格栅", "沉砂池", "加药量",
+         "絮凝剂", "碳源", "总磷", "氨氮", "出水", "进水", "泵站", "鼓风机", "膜组件", "反冲洗", "pH", "碱度", "污泥浓度")
+
+
+def records(prefix, n):
+    """内容互不相近的问答（避免被近似去重当成重复）"""
+    rng = random.Random(prefix)
+    return [{"instruction": f"{prefix}{i}：" + "、".join(rng.sample(WORDS, 6)) + "之间是什么关系？", "input": "",
+             "output": "".join(rng.sample(WORDS, 8)) + f"，数值 {rng.randint(1, 9999)}。"}
+            for i in range(n)]
+
+
+def write_json(path, data):
+    path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def read_all(out_dir):
+    return {name: list(iter_records(out_dir / f"{name}.json")) for name in split.SPLITS}
+
+
+@pytest.fixture
+def dirs(tmp_path, monkeypatch):
+    src, out = tmp_path / "qa", tmp_path / "dataset"
+    src.mkdir()
+    monkeypatch.setattr(split, "MERGED_DIR", str(out))
+    monkeypatch.setattr(split, "OUTPUT_SUFFIX", ".json")
+    monkeypatch.setattr(split, "GROUP_BY", "record")
+    return src, out
+
+
+@pytest.mark.parametrize("use_dedup", [False, True])
+def test_partial_file_is_not_kept_or_recorded(dirs, tmp_path, use_dedup):
+    src, out = dirs
+    write_json(src / "a.json", records("甲", 40))
+    write_json(src / "b.json", records("乙", 40))
+    # 前 30 条完整，之后 JSON 截断：读取时先产出记录，再抛解析错误
+    broken = json.dumps(records("丙", 40), ensure_ascii=False, indent=2)
+    (src / "c.json").write_text(broken[:len(broken) * 3 // 4], encoding="utf-8")
+    files = sorted(src.glob("*.json"))
+    manifest = Manifest(tmp_path / "manifest.json")
+    dedup = DedupIndex(str(tmp_path / "dedup.sqlite")) if use_dedup else None
+    try:
+        split.hash_split(files, manifest, dedup=dedup)
+        got = read_all(out)
+        texts = [r["instruction"] for recs in got.values() for r in recs]
+        assert not any(t.startswith("丙") for t in texts)
+        assert len(texts) == 80
+        entry = manifest.entry(split.HASH_STAGE, out / "train.json")
+        assert not any(k.endswith("c.json") for k in entry["inputs"])
+        assert sum(manifest.entry(split.HASH_STAGE, out / f"{n}.json")["count"] for n in split.SPLITS) == 80
+
+        # 没修好：再跑一次仍然重试，输出不变
+        split.hash_split(files, manifest, dedup=dedup)
+        assert read_all(out) == got
+
+        # 修好后：只追加这个文件
+        write_json(src / "c.json", records("丙", 40))
+        split.hash_split(files, manifest, dedup=dedup)
+        fixed = read_all(out)
+        texts = [r["instruction"] for recs in fixed.values() for r in recs]
+        assert len(texts) == 120 and len(set(texts)) == 120
+        assert all(fixed[n][:len(got[n])] == got[n] for n in split.SPLITS)   # 追加，不是重建
+        entry = manifest.entry(split.HASH_STAGE, out / "train.json")
+        assert any(k.endswith("c.json") for k in entry["inputs"])
+    finally:
+        if dedup is not None:
+            dedup.close()
+
+
+def test_unchanged_inputs_skip(dirs, tmp_path, capsys):
+    src, out = dirs
+    write_json(src / "a.json", records("甲", 20))
+    manifest = Manifest(tmp_path / "manifest.json")
+    split.hash_split([src / "a.json"], manifest)
+    split.hash_split([src / "a.json"], manifest)
+    assert "无变化，跳过" in capsys.readouterr().out
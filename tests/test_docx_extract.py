@@ -0,0 +1,176 @@
+"""
+02word_to_txt：lxml 直接解析（docx_to_txt_fast）与 python-docx 版（docx_to_txt）的输出逐字一致，
+块索引 .blocks.jsonl 也一致，且各块的 start/end 偏移能从 .txt 中切出对应文本
+"""
+import importlib
+
+import pytest
+from docx import Document
+from docx.enum.text import WD_BREAK
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+
+from dataset_io import iter_records
+
+word = importlib.import_module("02word_to_txt")
+
+
+def add_hyperlink(paragraph, text, url="https://example.com"):
+    """python-docx 没有超链接接口，直接拼 w:hyperlink"""
+    rel = paragraph.part.relate_to(url, "http://schemas.openxmlformats.org/officeDocument/2006/relationships/hyperlink",
+                                   is_external=True)
+    link = OxmlElement("w:hyperlink")
+    link.set(qn("r:id"), rel)
+    run = OxmlElement("w:r")
+    t = OxmlElement("w:t")
+    t.text = text
+    run.append(t)
+    link.append(run)
+    paragraph._p.append(link)
+
+
+def build_hyperlinks(doc):
+    p = doc.add_paragraph("正文段落，链接：")
+    add_hyperlink(p, "正文里的链接文字")
+    p.add_run("（链接之后）")
+    table = doc.add_table(rows=1, cols=2)
+    cell = table.cell(0, 0).paragraphs[0]
+    cell.add_run("单元格")
+    add_hyperlink(cell, "单元格里的链接")
+    table.cell(0, 1).text = "右侧"
+
+
+def build_tabs_and_breaks(doc):
+    p = doc.add_paragraph()
+    run = p.add_run("曝气池")
+    run.add_tab()
+    run.add_text("溶解氧 2 mg/L")
+    run.add_break()
+    run.add_text("换行之后")
+    run.add_break(WD_BREAK.PAGE)
+    run.add_text("分页之后")
+    run.add_break(WD_BREAK.COLUMN)
+    p.add_run("分栏之后\t制表符原文")
+
+
+def build_merged_cells(doc):
+    table = doc.add_table(rows=4, cols=4)
+    for r, row in enumerate(table.rows):
+        for c, cell in enumerate(row.cells):
+            cell.text = f"r{r}c{c}"
+    table.cell(0, 0).merge(table.cell(0, 2))        # 横向合并：gridSpan=3
+    table.cell(1, 0).merge(table.cell(3, 0))        # 纵向合并：vMerge
+    table.cell(1, 2).merge(table.cell(2, 3))        # 2×2 合并：gridSpan 与 vMerge 同时出现
+
+
+def build_nested_tables(doc):
+    doc.add_paragraph("嵌套表格之前")
+    outer = doc.add_table(rows=2, cols=2)
+    outer.cell(0, 0).text = "外层"
+    inner = outer.cell(0, 1).add_table(rows=2, cols=2)
+    for r, row in enumerate(inner.rows):
+        for c, cell in enumerate(row.cells):
+            cell.text = f"内层{r}{c}"
+    outer.cell(1, 0).text = "第二行"
+    doc.add_paragraph("嵌套表格之后")
+
+
+def build_empty_paragraphs(doc):
+    doc.add_paragraph("")
+    doc.add_paragraph("   ")
+    doc.add_paragraph("第一段")
+    doc.add_paragraph()
+    doc.add_paragraph("第二段")
+    doc.add_table(rows=2, cols=2)                   # 全空的表格不输出
+    doc.add_paragraph("")
+
+
+def build_headings(doc):
+    doc.add_heading("标题", level=0)
+    doc.add_heading("第一章 总则", level=1)
+    doc.add_paragraph("本章正文。")
+    doc.add_heading("1.1 适用范围", level=2)
+    table = doc.add_table(rows=2, cols=2)
+    table.cell(0, 0).text = "指标"
+    table.cell(0, 1).text = "限值"
+    table.cell(1, 0).text = "COD"
+    table.cell(1, 1).text = "50 mg/L"
+    doc.add_paragraph("表后正文。")
+
+
+def build_mixed(doc):
+    for build in (build_headings, build_hyperlinks, build_tabs_and_breaks, build_merged_cells,
+                  build_nested_tables, build_empty_paragraphs):
+        build(doc)
+
+
+CASES = {
+    "hyperlinks": build_hyperlinks,
+    "tabs_and_breaks": build_tabs_and_breaks,
+    "merged_cells": build_merged_cells,
+    "nested_tables": build_nested_tables,
+    "empty_paragraphs": build_empty_paragraphs,
+    "headings": build_headings,
+    "mixed": build_mixed,
+}
+
+
+@pytest.fixture(params=sorted(CASES))
+def docx_file(request, tmp_path):
+    doc = Document()
+    CASES[request.param](doc)
+    path = tmp_path / f"{request.param}.docx"
+    doc.save(str(path))
+    return path
+
+
+def convert(extract, docx_path, out_dir, blocks=False):
+    out_dir.mkdir()
+    txt = out_dir / (docx_path.stem + ".txt")
+    blocks_path = word.blocks_path_for(txt) if blocks else None
+    extract(docx_path, txt, blocks_path)
+    text = txt.read_text(encoding="utf-8")
+    return text, (list(iter_records(blocks_path)) if blocks else None)
+
+
+def test_fast_matches_python_docx(docx_file, tmp_path):
+    slow, _ = convert(word.docx_to_txt, docx_file, tmp_path / "slow")
+    fast, _ = convert(word.docx_to_txt_fast, docx_file, tmp_path / "fast")
+    assert fast == slow
+
+
+def test_blocks_sidecar_matches(docx_file, tmp_path):
+    slow_text, slow_blocks = convert(word.docx_to_txt, docx_file, tmp_path / "slow", blocks=True)
+    fast_text, fast_blocks = convert(word.docx_to_txt_fast, docx_file, tmp_path / "fast", blocks=True)
+    assert fast_text == slow_text
+    assert fast_blocks == slow_blocks
+    # 偏移按 \n 计换行，直接切 .txt 的内容就是该块的文本
+    for block in fast_blocks:
+        assert fast_text[block["start"]:block["end"]] == block["text"]
+    ends = [b["end"] for b in fast_blocks]
+    assert ends == sorted(ends)
+
+
+def test_sidecar_does_not_change_text(docx_file, tmp_path):
+    plain, _ = convert(word.docx_to_txt_fast, docx_file, tmp_path / "plain")
+    with_blocks, _ = convert(word.docx_to_txt_fast, docx_file, tmp_path / "blocks", blocks=True)
+    assert with_blocks == plain
+
+
+def test_fixture_contents(tmp_path):
+    """确认夹具确实覆盖了要比较的结构（避免两边都输出空文本也算通过）"""
+    doc = Document()
+    build_mixed(doc)
+    path = tmp_path / "mixed.docx"
+    doc.save(str(path))
+    text, blocks = convert(word.docx_to_txt_fast, path, tmp_path / "out", blocks=True)
+    assert "单元格里的链接" in text                 # 单元格内超链接文字保留
+    assert "正文里的链接文字" not in text           # 正文段落只取直接子 run（与 python-docx 的 runs 一致）
+    assert "曝气池\t溶解氧 2 mg/L\n换行之后分页之后" in text
+    # 合并单元格按网格位置重复，合并时 python-docx 把各格文字拼在一起
+    assert "r0c0 r0c1 r0c2\tr0c0 r0c1 r0c2\tr0c0 r0c1 r0c2\tr0c3" in text
+    assert "\nr1c0 r2c0 r3c0\tr2c1\tr1c2 r1c3 r2c2 r2c3\t" in text
+    # 单元格只取自己的段落，嵌套表格的内容两种解析方式都不输出
+    assert "外层\n第二行" in text and "内层00" not in text
+    assert {b["type"] for b in blocks} == {"heading", "paragraph", "table"}
+    assert [b["level"] for b in blocks if b["type"] == "heading"][:3] == [0, 1, 2]
@@ -0,0 +1,263 @@
+"""
+llm_backends：BatchBackend 的排队 → 提交 → 取回往返（FakeBatchClient），03 process_file 的 BatchDeferred 延后路径，
+以及 OpenAICompatibleBackend 对着本地桩服务的请求体、响应与 usage 解析、长连接复用和批量接口
+"""
+import importlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from llm_backends import (BatchBackend, BatchDeferred, FakeBatchClient, OpenAICompatibleBackend, make_backend,
+                          request_key, chat_body)
+from pipeline_manifest import Manifest
+from pipeline_metrics import Metrics
+from qa_engine import FakeGeneration, GenerationEngine
+
+MESSAGES = [{"role": "system", "content": "系统"}, {"role": "user", "content": "曝气池溶解氧控制在多少？"}]
+
+
+def ask(backend, text="曝气池溶解氧控制在多少？", **params):
+    return backend(model="qwen-turbo", messages=[{"role": "user", "content": text}], max_tokens=100, **params)
+
+
+# ================== BatchBackend + FakeBatchClient ==================
+
+def test_batch_round_trip(tmp_path):
+    client = FakeBatchClient(FakeGeneration(latency=0, pairs=2), delay_polls=1)
+    backend = BatchBackend(tmp_path, client)
+    with pytest.raises(BatchDeferred):
+        ask(backend, "第一个")
+    with pytest.raises(BatchDeferred):
+        ask(backend, "第一个")            # 同一请求不重复排队
+    with pytest.raises(BatchDeferred):
+        ask(backend, "第二个")
+    assert backend.queued == 2
+    assert len((tmp_path / "pending.jsonl").read_text("utf-8").splitlines()) == 2
+
+    created = backend.submit()
+    assert len(created) == 1
+    assert not (tmp_path / "pending.jsonl").exists()
+    assert (tmp_path / "submitted" / f"{created[0]}.jsonl").exists()
+    with pytest.raises(BatchDeferred):
+        ask(backend, "第一个")            # 已提交、还没取回：仍然延后，但不再排队
+    assert backend.submit() == []
+
+    assert backend.collect() == (0, 1)    # 第一次查询还在进行
+    assert backend.collect() == (1, 0)
+    response = ask(backend, "第一个")
+    assert response.status_code == 200
+    pairs = json.loads(response.output["choices"][0]["message"]["content"])
+    assert len(pairs) == 2
+    assert response.usage["output_tokens"] > 0
+
+    # 重新打开同一个工作目录：取回的结果从 results/ 读回，不必再查询
+    reopened = BatchBackend(tmp_path, client)
+    assert ask(reopened, "第二个").status_code == 200
+    assert reopened.collect() == (0, 0)
+    assert json.loads((tmp_path / "batches.json").read_text("utf-8"))[0]["collected"] is True
+
+
+def test_batch_failed_requests_are_requeued(tmp_path):
+    client = FakeBatchClient(FakeGeneration(latency=0, error_rate=1.0))
+    backend = BatchBackend(tmp_path, client)
+    with pytest.raises(BatchDeferred):
+        ask(backend)
+    backend.submit()
+    assert backend.collect() == (1, 0)
+    assert backend.batches[0]["failed"] == 1
+    with pytest.raises(BatchDeferred):
+        ask(backend)                      # 失败的结果不登记，重跑时重新排队
+    assert backend.queued == 2
+    assert (tmp_path / "pending.jsonl").exists()
+
+
+def test_batch_submit_splits_files(tmp_path):
+    backend = BatchBackend(tmp_path, FakeBatchClient(FakeGeneration(latency=0)))
+    for i in range(5):
+        with pytest.raises(BatchDeferred):
+            ask(backend, f"问题{i}")
+    created = backend.submit(max_requests=2)
+    assert [b["requests"] for b in backend.batches] == [2, 2, 1]
+    assert len(created) == 3
+    assert backend.collect() == (3, 0)
+    assert all(ask(backend, f"问题{i}").status_code == 200 for i in range(5))
+
+
+def test_batch_deferred_passes_through_engine(tmp_path):
+    """引擎不重试 BatchDeferred，也不计入失败与熔断"""
+    backend = make_backend("fake-batch", workdir=tmp_path, latency=0)
+    engine = GenerationEngine(backend, concurrency=2, max_retries=3)
+    with pytest.raises(BatchDeferred):
+        engine.call(model="qwen-turbo", messages=MESSAGES, max_tokens=100)
+    assert engine.stats["calls"] == 1
+    assert engine.stats["retried"] == 0 and engine.stats["failed"] == 0
+
+
+def test_process_file_deferred_then_collected(tmp_path, monkeypatch):
+    qa = importlib.import_module("03text_to_qa")
+    monkeypatch.setattr(qa, "OUTPUT_DIR", tmp_path / "qa")
+    monkeypatch.setattr(qa, "REJECTED_DIR", tmp_path / "qa" / "_rejected")
+    monkeypatch.setattr(qa, "CACHE_PATH", None)
+    monkeypatch.setattr(qa, "QUALITY_FILTER", None)
+    txt = tmp_path / "in" / "运行手册.txt"
+    txt.parent.mkdir()
+    txt.write_text("活性污泥法的曝气池应控制溶解氧在 2 mg/L 左右，污泥龄一般为 10~15 天。\n" * 30, encoding="utf-8")
+    output = qa.OUTPUT_DIR / f"{txt.stem}{qa.OUTPUT_SUFFIX}"
+    manifest = Manifest(tmp_path / "manifest.json")
+    metrics = Metrics(None)
+    client = FakeBatchClient(FakeGeneration(latency=0, pairs=3))
+
+    # 第一轮：请求进入批量任务，文件既不写出也不登记清单
+    engine, cache = qa.open_generation(metrics, 2, BatchBackend(tmp_path / "batch", client))
+    with pytest.raises(BatchDeferred):
+        qa.process_file(txt, engine, cache, manifest, metrics)
+    assert not output.exists()
+    assert not manifest.is_fresh(qa.STAGE, txt, [output])
+    qa.close_generation(engine, cache, deferred=1)
+    assert len(client.batches) == 1
+
+    # 第二轮：先取回批次，再处理时全部命中结果
+    backend = BatchBackend(tmp_path / "batch", client)
+    engine, cache = qa.open_generation(metrics, 2, backend)
+    assert backend.results
+    saved = qa.process_file(txt, engine, cache, manifest, metrics)
+    qa.close_generation(engine, cache)
+    assert saved > 0
+    assert len(json.loads(output.read_text("utf-8"))) == saved
+    assert manifest.is_fresh(qa.STAGE, txt, [output])
+    assert backend.queued == 0
+
+
+# ================== OpenAI 兼容接口（本地桩服务） ==================
+
+class StubHandler(BaseHTTPRequestHandler):
+    """最小的 OpenAI 兼容服务：/chat/completions 与 /files、/batches；请求记录在 server.seen"""
+
+    protocol_version = "HTTP/1.1"  # 支持 keep-alive
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8") if not isinstance(payload, bytes) else payload
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_POST(self):
+        server = self.server
+        raw = self._body()
+        server.seen.append((self.path, dict(self.headers), raw))
+        if self.path == "/v1/chat/completions":
+            body = json.loads(raw)
+            if body["model"] == "busy":
+                return self._send(429, {"error": {"code": "rate_limit_exceeded", "message": "slow down"}})
+            return self._send(200, completion(body))
+        if self.path == "/v1/files":
+            # multipart：取 file 字段的内容
+            part = raw.split(b'name="file"', 1)[1].split(b"\r\n\r\n", 1)[1]
+            content = part.rsplit(b"\r\n--", 1)[0]
+            file_id = f"file-{len(server.files)}"
+            server.files[file_id] = content
+            return self._send(200, {"id": file_id})
+        if self.path == "/v1/batches":
+            request = json.loads(raw)
+            lines = []
+            for line in server.files[request["input_file_id"]].decode("utf-8").splitlines():
+                item = json.loads(line)
+                lines.append(json.dumps({"custom_id": item["custom_id"],
+                                         "response": {"status_code": 200, "body": completion(item["body"])}},
+                                        ensure_ascii=False))
+            output_id = f"file-{len(server.files)}"
+            server.files[output_id] = "\n".join(lines).encode("utf-8")
+            batch = {"id": f"batch-{len(server.batches)}", "status": "completed", "output_file_id": output_id}
+            server.batches[batch["id"]] = batch
+            return self._send(200, batch)
+        self._send(404, {"error": {"message": "not found"}})
+
+    def do_GET(self):
+        server = self.server
+        server.seen.append((self.path, dict(self.headers), b""))
+        if self.path.startswith("/v1/batches/"):
+            return self._send(200, server.batches[self.path.rsplit("/", 1)[1]])
+        if self.path.startswith("/v1/files/") and self.path.endswith("/content"):
+            return self._send(200, server.files[self.path.split("/")[3]])
+        self._send(404, {"error": {"message": "not found"}})
+
+
+def completion(body):
+    question = body["messages"][-1]["content"]
+    content = json.dumps([{"question": question, "answer": "答案"}], ensure_ascii=False)
+    return {"object": "chat.completion",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 17, "completion_tokens": 9, "total_tokens": 26}}
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.seen, server.files, server.batches = [], {}, {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def base_url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def test_openai_response_and_usage(stub_server):
+    backend = OpenAICompatibleBackend(base_url(stub_server), api_key="sk-test")
+    response = ask(backend, result_format="message", temperature=0.7)
+    assert response.status_code == 200
+    assert response["output"]["choices"][0]["finish_reason"] == "stop"
+    assert json.loads(response.output["choices"][0]["message"]["content"])[0]["question"] == "曝气池溶解氧控制在多少？"
+    assert response.usage == {"input_tokens": 17, "output_tokens": 9}
+
+    path, headers, raw = stub_server.seen[0]
+    body = json.loads(raw)
+    assert headers["Authorization"] == "Bearer sk-test"
+    assert "result_format" not in body                # 只对 dashscope SDK 有意义的参数不发给兼容接口
+    assert body["temperature"] == 0.7 and body["max_tokens"] == 100
+    backend.close()
+
+
+def test_openai_error_status(stub_server):
+    backend = OpenAICompatibleBackend(base_url(stub_server))
+    response = backend(model="busy", messages=MESSAGES)
+    assert response.status_code == 429
+    assert response.code == "rate_limit_exceeded"
+    assert response.message == "slow down"
+    assert response.output is None
+    backend.close()
+
+
+def test_openai_keep_alive_reuses_connection(stub_server):
+    backend = OpenAICompatibleBackend(base_url(stub_server), pool_size=2)
+    for i in range(5):
+        assert ask(backend, f"问题{i}").status_code == 200
+    assert backend.pool.opened == 1
+    backend.close()
+
+
+def test_openai_batch_round_trip(stub_server, tmp_path):
+    backend = make_backend("batch", workdir=tmp_path, base_url=base_url(stub_server), api_key="sk-test")
+    with pytest.raises(BatchDeferred):
+        ask(backend, "批量问题")
+    created = backend.submit()
+    assert created == ["batch-0"]
+    assert backend.collect() == (1, 0)
+    response = ask(backend, "批量问题")
+    assert response.usage == {"input_tokens": 17, "output_tokens": 9}
+    key = request_key(chat_body("qwen-turbo", [{"role": "user", "content": "批量问题"}], max_tokens=100))
+    assert key in backend.results
+    backend.client.close()
@@ -0,0 +1,167 @@
+"""qa_engine.GenerationEngine 对着 FakeGeneration（模拟延迟与 429）：并发上限、RPM/TPM 限流、限流重试、结果顺序"""
+import threading
+import time
+
+import pytest
+
+from qa_engine import FakeGeneration, GenerationEngine, GenerationError, TokenBucket, estimate_tokens
+
+MESSAGES = [{"role": "user", "content": "曝气池溶解氧控制在多少？"}]
+
+
+class InFlight:
+    """包一层 call_fn，记录同时在途的调用数峰值"""
+
+    def __init__(self, call_fn):
+        self.call_fn = call_fn
+        self.current = self.peak = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, **kwargs):
+        with self.lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+        try:
+            return self.call_fn(**kwargs)
+        finally:
+            with self.lock:
+                self.current -= 1
+
+
+def run_all(engine, n, **kwargs):
+    return list(engine.map(lambda i: engine.call(messages=MESSAGES, max_tokens=50, **kwargs), range(n)))
+
+
+@pytest.mark.parametrize("concurrency", [1, 3, 8])
+def test_concurrency_cap(concurrency):
+    fake = InFlight(FakeGeneration(latency=(0.01, 0.03), seed=1))
+    engine = GenerationEngine(fake, concurrency=concurrency)
+    results = run_all(engine, 40)
+    assert all(error is None for _, _, error in results)
+    assert fake.peak == concurrency
+
+
+def test_concurrency_cap_shared_by_direct_calls():
+    """map 之外直接并发调用 call() 时，槽位同样限制在途请求数"""
+    fake = InFlight(FakeGeneration(latency=0.02, seed=2))
+    engine = GenerationEngine(fake, concurrency=2)
+    threads = [threading.Thread(target=engine.call, kwargs={"messages": MESSAGES}) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert fake.peak <= 2
+    assert engine.stats["calls"] == 10
+
+
+def test_rpm_bucket_throttles():
+    # 桶容量设为 1，去掉初始突发，只剩匀速补充：每秒 10 个请求
+    engine = GenerationEngine(FakeGeneration(latency=0, seed=3), concurrency=8, rpm=600)
+    engine.limiter.requests = TokenBucket(600, capacity=1)
+    start = time.monotonic()
+    run_all(engine, 11)
+    elapsed = time.monotonic() - start
+    assert elapsed >= 0.9          # 第 1 个立即放行，其余 10 个每 0.1 秒一个
+    assert elapsed < 3
+
+
+def test_rpm_burst_matches_server_quota():
+    """引擎 RPM 与服务端配额一致时，不会触发 429"""
+    fake = FakeGeneration(latency=0, rpm=30, seed=4)
+    engine = GenerationEngine(fake, concurrency=8, rpm=30)
+    results = run_all(engine, 30)
+    assert all(error is None for _, _, error in results)
+    assert fake.throttled == 0
+
+
+def test_tpm_bucket_throttles():
+    budget = estimate_tokens(MESSAGES[0]["content"]) + 50     # TPM 按输入 + 最大输出预占
+    engine = GenerationEngine(FakeGeneration(latency=0, seed=5), concurrency=4, tpm=6000)
+    engine.limiter.tokens = TokenBucket(6000, capacity=budget)  # 每秒 100 个 token，没有初始突发
+    start = time.monotonic()
+    run_all(engine, 5)
+    elapsed = time.monotonic() - start
+    expected = 4 * budget / 100
+    assert elapsed >= expected * 0.9
+    assert elapsed < expected + 2
+
+
+def test_429_backoff_retries_without_losing_items():
+    fake = FakeGeneration(latency=(0.001, 0.005), error_rate=0.3, seed=6)
+    engine = GenerationEngine(fake, concurrency=4, max_retries=20, backoff=0.005, max_backoff=0.05)
+    results = run_all(engine, 50)
+    assert len(results) == 50
+    assert sorted(item for item, _, _ in results) == list(range(50))
+    assert all(error is None and response.status_code == 200 for _, response, error in results)
+    assert fake.throttled > 0
+    assert engine.stats["rate_limited"] == fake.throttled
+    assert engine.stats["calls"] == 50 + fake.throttled
+    assert engine.stats["failed"] == 0
+
+
+def test_429_pauses_all_threads():
+    """收到 429 后全局暂停：暂停期间其他线程也不会发出新请求"""
+    engine = GenerationEngine(FakeGeneration(latency=0, seed=7), concurrency=4)
+    engine.limiter.penalize(0.3)
+    start = time.monotonic()
+    run_all(engine, 4)
+    assert time.monotonic() - start >= 0.25
+
+
+def test_retries_exhausted_raises():
+    fake = FakeGeneration(latency=0, error_rate=1.0, seed=8)
+    engine = GenerationEngine(fake, concurrency=2, max_retries=2, backoff=0.001)
+    with pytest.raises(GenerationError):
+        engine.call(messages=MESSAGES)
+    assert fake.calls == 3
+    assert engine.stats["failed"] == 1
+
+
+def test_map_ordered_returns_input_order():
+    engine = GenerationEngine(FakeGeneration(latency=(0.001, 0.03), seed=9), concurrency=4)
+
+    def work(i):
+        engine.call(messages=MESSAGES)
+        return i * i
+
+    results = list(engine.map(work, range(30), ordered=True))
+    assert [item for item, _, _ in results] == list(range(30))
+    assert [value for _, value, _ in results] == [i * i for i in range(30)]
+
+
+def test_map_pairs_results_with_items():
+    """默认按完成顺序产出，但每个结果都与自己的输入配对，错误不会丢项"""
+    engine = GenerationEngine(FakeGeneration(latency=0, seed=10), concurrency=4)
+
+    def work(i):
+        time.sleep((30 - i) * 0.001)
+        if i % 7 == 0:
+            raise ValueError(i)
+        return i * 2
+
+    results = list(engine.map(work, iter(range(30))))
+    assert sorted(item for item, _, _ in results) == list(range(30))
+    for item, value, error in results:
+        if item % 7 == 0:
+            assert isinstance(error, ValueError) and value is None
+        else:
+            assert value == item * 2 and error is None
+
+
+def test_map_backpressure():
+    """生成器输入按需取出，取出但未产出的任务不超过 concurrency*2"""
+    engine = GenerationEngine(FakeGeneration(latency=0, seed=11), concurrency=2)
+    pulled = []
+
+    def items():
+        for i in range(20):
+            pulled.append(i)
+            yield i
+
+    for ordered in (False, True):
+        pulled.clear()
+        produced = 0
+        for _ in engine.map(lambda i: time.sleep(0.002) or i, items(), ordered=ordered):
+            produced += 1
+            assert len(pulled) - produced <= 4
+        assert produced == 20
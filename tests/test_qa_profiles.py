@@ -0,0 +1,39 @@
+"""qa_profiles.route：默认规则只看文件夹名，含 / 的规则才匹配文件名"""
+from pathlib import Path
+
+from qa_profiles import DEFAULT_PROFILE, route
+
+
+def name(path, routes=None, root=None):
+    return route(Path(path), routes, root=root).name
+
+
+def test_filename_does_not_change_default_profile():
+    # 文件名里带“规范”“标准”“维修”等字样的运行资料仍用默认配置
+    for path in ("docs/运行规范.txt", "docs/设备维修记录汇总.txt", "docs/paper_towel_usage.txt", "运行规范.txt"):
+        assert name(path) == DEFAULT_PROFILE
+
+
+def test_folder_routes():
+    assert name("国家标准/GB 18918.txt") == "policy"
+    assert name("Papers/xx.txt") == "papers"
+    assert name("设备维修/泵.txt") == "maintenance"
+
+
+def test_nested_folders_under_root():
+    root = Path("/data/txt")
+    assert name(root / "政策" / "2023" / "a.txt", root=root) == "policy"
+    assert name(root / "misc" / "运行规范.txt", root=root) == DEFAULT_PROFILE
+    # 文件在根目录之外时退回“所在文件夹/文件名”
+    assert name(Path("/elsewhere/论文/a.txt"), root=root) == "papers"
+
+
+def test_slash_patterns_match_filenames():
+    routes = [("*/*规范*.txt", "policy"), ("weixiu", "maintenance")]
+    assert name("docs/运行规范.txt", routes) == "policy"
+    assert name("WeiXiu/a.txt", routes) == "maintenance"     # 不区分大小写，不含 / 时整段匹配文件夹名
+    assert name("weixiu_old/a.txt", routes) == DEFAULT_PROFILE
+
+
+def test_empty_routes_use_default():
+    assert name("国家标准/a.txt", routes=[]) == DEFAULT_PROFILE